@@ -0,0 +1,77 @@
+"""
+Сравнение JSON+base64 и msgpack для сообщений с картинкой.
+
+Для картинок 1-5 МБ печатает размер тела сообщения и время кодирования
+и декодирования до сырых байт картинки (то, что нужно воркеру).
+
+Запуск из каталога app:
+    python -m benchmarks.bench_message_codec
+"""
+
+import argparse
+import base64
+import os
+import time
+from statistics import median
+
+from services.message_codec import (
+    JSON_CONTENT_TYPE,
+    MSGPACK_CONTENT_TYPE,
+    decode,
+    encode,
+)
+
+
+def _image_bytes(payload: dict) -> bytes:
+    if "image" in payload:
+        return payload["image"]
+    return base64.b64decode(payload["image_base64"])
+
+
+def bench(content_type: str, image: bytes, repeat: int) -> dict:
+    payload = {"text": "Что изображено на картинке?", "image": image}
+    encode_times, decode_times = [], []
+    body = b""
+    for _ in range(repeat):
+        started = time.perf_counter()
+        body = encode(payload, content_type)
+        encode_times.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        assert len(_image_bytes(decode(body, content_type))) == len(image)
+        decode_times.append(time.perf_counter() - started)
+
+    return {
+        "bytes": len(body),
+        "encode_ms": median(encode_times) * 1000,
+        "decode_ms": median(decode_times) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes-mb", type=int, nargs="+", default=[1, 2, 3, 4, 5])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    print(
+        f"{'size':>6} {'format':>8} {'wire bytes':>12} {'overhead':>9} "
+        f"{'encode ms':>10} {'decode ms':>10}"
+    )
+    for size_mb in args.sizes_mb:
+        # Случайные байты похожи по энтропии на сжатый JPEG/PNG
+        image = os.urandom(size_mb * 1024 * 1024)
+        for name, content_type in (
+            ("json", JSON_CONTENT_TYPE),
+            ("msgpack", MSGPACK_CONTENT_TYPE),
+        ):
+            result = bench(content_type, image, args.repeat)
+            overhead = result["bytes"] / len(image) - 1
+            print(
+                f"{size_mb:>4}MB {name:>8} {result['bytes']:>12} {overhead:>8.1%} "
+                f"{result['encode_ms']:>10.2f} {result['decode_ms']:>10.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
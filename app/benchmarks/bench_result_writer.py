@@ -0,0 +1,158 @@
+"""
+Запись результатов воркера в requesthistorydb: по строке или пакетами.
+
+Создает --rows запросов в статусе pending и завершает их двумя способами:
+через RequestHistoryService.complete_request (get + flush + refresh на
+каждую строку) и через ResultWriter (один UPDATE на батч). Печатает
+строки в секунду для каждого способа.
+
+По умолчанию - SQLite в памяти (пакетный путь там executemany).
+Для PostgreSQL с UPDATE ... FROM (VALUES ...) передайте --db-url
+на тестовую базу со схемой приложения. Запуск из каталога app:
+    python -m benchmarks.bench_result_writer --rows 2000
+"""
+
+import argparse
+import asyncio
+import time
+
+from sqlalchemy import delete
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from db.base_model import Base
+
+# Модели с noqa не используются напрямую: импорт регистрирует их таблицы
+# в Base.metadata для create_all и связей UserDB
+from db.models.mlmodel import MLModelDB
+from db.models.mlmodel_settings import MLModelSettingsDB  # noqa: F401
+from db.models.request_history import RequestHistoryDB
+from db.models.request_stats import RequestStatsRollupDB
+from db.models.transaction import TransactionDB  # noqa: F401
+from db.models.user import UserDB
+from db.models.user_action_history import UserActionHistoryDB  # noqa: F401
+from db.models.user_roles import UserRoleDB  # noqa: F401
+from services.ml_queue_request_service import result_update
+from services.request_history_service import RequestHistoryService
+from services.result_writer import ResultWriter
+
+
+async def create_requests(session_factory, user_id: int, model_id: int, rows: int):
+    async with session_factory() as session:
+        async with session.begin():
+            requests = [
+                RequestHistoryDB(
+                    request_type="prediction",
+                    user_id=user_id,
+                    model_id=model_id,
+                    input_data=f"Вопрос {i}",
+                )
+                for i in range(rows)
+            ]
+            session.add_all(requests)
+            await session.flush()
+            return [r.id for r in requests]
+
+
+def response(i: int) -> dict:
+    return {
+        "success": True,
+        "output_data": f"Ответ {i}",
+        "execution_time_ms": 120,
+        "metrics": {"prefill_tokens": 42},
+    }
+
+
+async def run_per_row(service, ids, concurrency: int) -> float:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i, request_id):
+        async with semaphore:
+            update = result_update(response(i))
+            await service.complete_request(
+                request_id,
+                output_data=update.output_data,
+                metrics=update.output_metrics,
+                execution_time_ms=update.execution_time_ms,
+                cost=update.cost,
+            )
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i, request_id) for i, request_id in enumerate(ids)))
+    return time.perf_counter() - started
+
+
+async def run_batched(service, ids, concurrency: int, args) -> float:
+    writer = await ResultWriter(
+        service, flush_interval=args.flush_interval, max_batch_size=args.batch_size
+    ).start()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i, request_id):
+        async with semaphore:
+            await writer.write(request_id, result_update(response(i)))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i, request_id) for i, request_id in enumerate(ids)))
+    elapsed = time.perf_counter() - started
+    await writer.stop()
+    return elapsed
+
+
+async def run(args, session_factory):
+    async with session_factory() as session:
+        async with session.begin():
+            user = UserDB(
+                username=f"bench-{time.time_ns()}",
+                email=f"bench-{time.time_ns()}@example.com",
+                password_hash="x",
+            )
+            model = MLModelDB(name="bench", input_type="text", output_type="generation")
+            session.add_all([user, model])
+        user_id, model_id = user.id, model.id
+
+    service = RequestHistoryService(session_factory)
+    try:
+        print(f"{'path':>10} {'rows':>7} {'seconds':>9} {'rows/s':>10}")
+        for name in ("per-row", "batched"):
+            ids = await create_requests(session_factory, user_id, model_id, args.rows)
+            if name == "per-row":
+                elapsed = await run_per_row(service, ids, args.concurrency)
+            else:
+                elapsed = await run_batched(service, ids, args.concurrency, args)
+            print(
+                f"{name:>10} {args.rows:>7} {elapsed:>9.3f} {args.rows / elapsed:>10.0f}"
+            )
+    finally:
+        async with session_factory() as session:
+            async with session.begin():
+                await session.execute(
+                    delete(RequestHistoryDB).where(RequestHistoryDB.user_id == user_id)
+                )
+                await session.execute(
+                    delete(RequestStatsRollupDB).where(
+                        RequestStatsRollupDB.user_id == user_id
+                    )
+                )
+                await session.execute(delete(UserDB).where(UserDB.id == user_id))
+                await session.execute(delete(MLModelDB).where(MLModelDB.id == model_id))
+
+
+async def main(args):
+    engine = create_async_engine(args.db_url)
+    try:
+        if engine.dialect.name == "sqlite":
+            async with engine.begin() as conn:
+                await conn.run_sync(Base.metadata.create_all)
+        await run(args, async_sessionmaker(bind=engine, expire_on_commit=False))
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--db-url", default="sqlite+aiosqlite:///:memory:")
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--flush-interval", type=float, default=0.05)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,221 @@
+"""
+Загрузка пользователя на путях авторизации и баланса: как было (все
+связи UserDB грузились selectin при каждом обращении к пользователю)
+и как сейчас (колонки для авторизации, UPDATE ... RETURNING для баланса).
+
+Создает пользователя с --history строками истории запросов и
+--transactions транзакциями и выполняет каждый путь --repeat раз.
+Печатает число SQL-запросов, загруженных ORM-объектов и время на вызов.
+Старое поведение воспроизводится опциями selectinload, поэтому оба
+варианта работают на одной схеме.
+
+По умолчанию - SQLite в памяти. Для PostgreSQL передайте --db-url
+на тестовую базу со схемой приложения. Запуск из каталога app:
+    python -m benchmarks.bench_user_loading --history 50000
+"""
+
+import argparse
+import asyncio
+import time
+from decimal import Decimal
+
+from sqlalchemy import delete, event, insert, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Mapper, selectinload
+
+from db.base_model import Base
+
+# Модели с noqa не используются напрямую: импорт регистрирует их таблицы
+# в Base.metadata для create_all и связей UserDB
+from db.models.mlmodel import MLModelDB
+from db.models.mlmodel_settings import MLModelSettingsDB  # noqa: F401
+from db.models.request_history import RequestHistoryDB
+from db.models.transaction import TransactionDB
+from db.models.user import UserDB
+from db.models.user_action_history import UserActionHistoryDB
+from db.models.user_roles import UserRoleDB
+from schemas.user import UserRead
+from services.transaction_service import TransactionService
+from services.user_service import UserService
+
+# Так UserDB грузился раньше: lazy="selectin" на всех коллекциях
+EAGER = (
+    selectinload(UserDB.transactions),
+    selectinload(UserDB.request_history),
+    selectinload(UserDB.roles),
+)
+
+
+class Counter:
+    """Считает SQL-запросы движка и ORM-объекты, созданные из строк"""
+
+    def __init__(self, engine):
+        self.statements = 0
+        self.instances = 0
+        event.listen(engine.sync_engine, "before_cursor_execute", self._on_execute)
+        event.listen(Mapper, "load", self._on_load)
+
+    def _on_execute(self, *_):
+        self.statements += 1
+
+    def _on_load(self, *_):
+        self.instances += 1
+
+    def reset(self):
+        self.statements = 0
+        self.instances = 0
+
+
+async def seed(session_factory, history: int, transactions: int) -> int:
+    async with session_factory() as session:
+        async with session.begin():
+            stamp = time.time_ns()
+            user = UserDB(
+                username=f"bench-{stamp}",
+                email=f"bench-{stamp}@example.com",
+                password_hash="x",
+                balance=Decimal("1000000.00"),
+            )
+            model = MLModelDB(name="bench", input_type="text", output_type="generation")
+            session.add_all([user, model])
+            await session.flush()
+            session.add(UserRoleDB(user_id=user.id, role="user"))
+            # Пакетная вставка без ORM-объектов
+            for start in range(0, history, 5000):
+                await session.execute(
+                    insert(RequestHistoryDB),
+                    [
+                        {
+                            "request_type": "prediction",
+                            "user_id": user.id,
+                            "model_id": model.id,
+                            "input_data": f"Вопрос {i}",
+                        }
+                        for i in range(start, min(start + 5000, history))
+                    ],
+                )
+            for start in range(0, transactions, 5000):
+                await session.execute(
+                    insert(TransactionDB),
+                    [
+                        {
+                            "user_id": user.id,
+                            "amount": Decimal("1.00"),
+                            "transaction_type": "deposit",
+                            "status": "completed",
+                        }
+                        for _ in range(start, min(start + 5000, transactions))
+                    ],
+                )
+            return user.id
+
+
+async def eager_auth(session_factory, user_id: int):
+    async with session_factory() as session:
+        result = await session.execute(
+            select(UserDB).options(*EAGER).where(UserDB.id == user_id)
+        )
+        return UserRead.model_validate(result.scalars().first())
+
+
+async def eager_deposit(session_factory, user_id: int):
+    async with session_factory() as session:
+        async with session.begin():
+            user = await session.get(UserDB, user_id, options=EAGER)
+            session.add(
+                TransactionDB(
+                    user_id=user_id,
+                    amount=Decimal("1.00"),
+                    transaction_type="deposit",
+                    status="completed",
+                )
+            )
+            user.balance += Decimal("1.00")
+            await session.flush()
+            # refresh перечитывал пользователя вместе со всеми связями
+            await session.refresh(user)
+            await session.get(UserDB, user_id, options=EAGER, populate_existing=True)
+
+
+async def measure(counter: Counter, name: str, call, repeat: int):
+    await call()  # прогрев
+    counter.reset()
+    started = time.perf_counter()
+    for _ in range(repeat):
+        await call()
+    elapsed = (time.perf_counter() - started) / repeat
+    print(
+        f"{name:>15} {counter.statements / repeat:>11.1f} "
+        f"{counter.instances / repeat:>13.0f} {elapsed * 1000:>9.2f}"
+    )
+
+
+async def run(args, engine, session_factory):
+    counter = Counter(engine)
+    user_id = await seed(session_factory, args.history, args.transactions)
+    users = UserService(session_factory)
+    transactions = TransactionService(session_factory)
+    token = users._create_access_token(user_id)
+    try:
+        print(f"{'path':>15} {'statements':>11} {'orm objects':>13} {'ms/call':>9}")
+        await measure(
+            counter,
+            "auth before",
+            lambda: eager_auth(session_factory, user_id),
+            args.repeat,
+        )
+        await measure(
+            counter, "auth after", lambda: users.get_current_user(token), args.repeat
+        )
+        await measure(
+            counter,
+            "deposit before",
+            lambda: eager_deposit(session_factory, user_id),
+            args.repeat,
+        )
+        await measure(
+            counter,
+            "deposit after",
+            lambda: transactions.process_deposit(user_id, Decimal("1.00")),
+            args.repeat,
+        )
+        await measure(
+            counter,
+            "withdraw after",
+            lambda: transactions.process_withdrawal(user_id, Decimal("1.00")),
+            args.repeat,
+        )
+    finally:
+        async with session_factory() as session:
+            async with session.begin():
+                for model in (
+                    RequestHistoryDB,
+                    TransactionDB,
+                    UserRoleDB,
+                    UserActionHistoryDB,
+                ):
+                    await session.execute(delete(model).where(model.user_id == user_id))
+                await session.execute(delete(UserDB).where(UserDB.id == user_id))
+                await session.execute(
+                    delete(MLModelDB).where(MLModelDB.name == "bench")
+                )
+
+
+async def main(args):
+    engine = create_async_engine(args.db_url)
+    try:
+        if engine.dialect.name == "sqlite":
+            async with engine.begin() as conn:
+                await conn.run_sync(Base.metadata.create_all)
+        await run(args, engine, async_sessionmaker(bind=engine, expire_on_commit=False))
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--db-url", default="sqlite+aiosqlite:///:memory:")
+    parser.add_argument("--history", type=int, default=50000)
+    parser.add_argument("--transactions", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=5)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,176 @@
+"""
+Статистика запросов пользователя (RequestHistoryService.get_user_stats):
+подсчет в Python по всем строкам (как было), один GROUP BY по истории
+(exact=True) и накопительная таблица RequestStatsRollupDB (по умолчанию).
+
+Создает пользователя с --rows запросами в разных статусах, строит
+накопительную статистику (rebuild_stats) и выполняет каждый способ
+--repeat раз. Печатает время на вызов и проверяет, что результаты
+совпадают.
+
+По умолчанию - SQLite в памяти. Для PostgreSQL передайте --db-url
+на тестовую базу со схемой приложения. Запуск из каталога app:
+    python -m benchmarks.bench_user_stats --rows 1000000
+"""
+
+import argparse
+import asyncio
+import random
+import time
+from decimal import Decimal
+
+from sqlalchemy import delete, insert, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from db.base_model import Base
+
+# Модели с noqa не используются напрямую: импорт регистрирует их таблицы
+# в Base.metadata для create_all и связей UserDB
+from db.models.mlmodel import MLModelDB
+from db.models.mlmodel_settings import MLModelSettingsDB  # noqa: F401
+from db.models.request_history import RequestHistoryDB, RequestStatusDB
+from db.models.request_stats import RequestStatsRollupDB
+from db.models.transaction import TransactionDB  # noqa: F401
+from db.models.user import UserDB
+from db.models.user_action_history import UserActionHistoryDB  # noqa: F401
+from db.models.user_roles import UserRoleDB  # noqa: F401
+from services.request_history_service import RequestHistoryService
+
+STATUSES = ["completed"] * 90 + ["failed"] * 6 + ["cancelled"] * 2 + ["pending"] * 2
+
+
+async def seed(session_factory, rows: int):
+    async with session_factory() as session:
+        async with session.begin():
+            stamp = time.time_ns()
+            user = UserDB(
+                username=f"bench-{stamp}",
+                email=f"bench-{stamp}@example.com",
+                password_hash="x",
+            )
+            model = MLModelDB(name="bench", input_type="text", output_type="generation")
+            session.add_all([user, model])
+            await session.flush()
+            user_id, model_id = user.id, model.id
+
+    random.seed(0)
+    for start in range(0, rows, 10000):
+        async with session_factory() as session:
+            async with session.begin():
+                batch = []
+                for i in range(start, min(start + 10000, rows)):
+                    status = random.choice(STATUSES)
+                    final = status != "pending"
+                    batch.append(
+                        {
+                            "request_type": "prediction",
+                            "user_id": user_id,
+                            "model_id": model_id,
+                            "input_data": f"Вопрос {i}",
+                            "status": RequestStatusDB(status),
+                            "cost": Decimal("0.0100") if final else Decimal("0"),
+                            "execution_time_ms": (
+                                int(random.lognormvariate(6, 0.8)) if final else None
+                            ),
+                        }
+                    )
+                await session.execute(insert(RequestHistoryDB), batch)
+    return user_id, model_id
+
+
+async def python_stats(session_factory, user_id: int):
+    """Прежняя реализация: все строки пользователя в память"""
+    async with session_factory() as session:
+        result = await session.execute(
+            select(RequestHistoryDB).where(RequestHistoryDB.user_id == user_id)
+        )
+        requests = result.scalars().all()
+        completed = [r for r in requests if r.status == "completed"]
+        total_cost = sum(r.cost for r in completed if r.cost is not None)
+        avg_time = sum(r.execution_time_ms or 0 for r in completed) / len(completed)
+        return {
+            "total_requests": len(requests),
+            "completed_requests": len(completed),
+            "failed_requests": len(requests) - len(completed),
+            "total_cost": total_cost,
+            "avg_execution_time": Decimal(str(avg_time)).quantize(Decimal("0.00")),
+        }
+
+
+async def measure(name: str, call, repeat: int):
+    result = await call()
+    started = time.perf_counter()
+    for _ in range(repeat):
+        await call()
+    print(f"{name:>8} {(time.perf_counter() - started) / repeat * 1000:>12.2f}")
+    return result
+
+
+async def run(args, session_factory):
+    started = time.perf_counter()
+    user_id, model_id = await seed(session_factory, args.rows)
+    print(f"seeded {args.rows} rows in {time.perf_counter() - started:.1f}s")
+    service = RequestHistoryService(session_factory)
+    try:
+        started = time.perf_counter()
+        rollup_rows = await service.rebuild_stats(user_id)
+        print(
+            f"rollup rebuilt in {time.perf_counter() - started:.2f}s, "
+            f"{rollup_rows} rows\n"
+        )
+        print(f"{'path':>8} {'ms/call':>12}")
+        rollup = await measure(
+            "rollup", lambda: service.get_user_stats(user_id), args.repeat
+        )
+        exact = await measure(
+            "exact", lambda: service.get_user_stats(user_id, exact=True), args.repeat
+        )
+        if not args.skip_python:
+            python = await measure(
+                "python",
+                lambda: python_stats(session_factory, user_id),
+                max(1, args.repeat // 5),
+            )
+            for key, value in python.items():
+                assert exact[key] == value, (key, exact[key], value)
+        assert exact == rollup
+        print(
+            f"\np50 {rollup['p50_execution_time']} ms, "
+            f"p95 {rollup['p95_execution_time']} ms, "
+            f"avg {rollup['avg_execution_time']} ms"
+        )
+    finally:
+        async with session_factory() as session:
+            async with session.begin():
+                await session.execute(
+                    delete(RequestStatsRollupDB).where(
+                        RequestStatsRollupDB.user_id == user_id
+                    )
+                )
+                await session.execute(
+                    delete(RequestHistoryDB).where(RequestHistoryDB.user_id == user_id)
+                )
+                await session.execute(delete(UserDB).where(UserDB.id == user_id))
+                await session.execute(delete(MLModelDB).where(MLModelDB.id == model_id))
+
+
+async def main(args):
+    engine = create_async_engine(args.db_url)
+    try:
+        if engine.dialect.name == "sqlite":
+            async with engine.begin() as conn:
+                await conn.run_sync(Base.metadata.create_all)
+        await run(args, async_sessionmaker(bind=engine, expire_on_commit=False))
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--db-url", default="sqlite+aiosqlite:///:memory:")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument(
+        "--skip-python", action="store_true", help="без прежней реализации"
+    )
+    asyncio.run(main(parser.parse_args()))
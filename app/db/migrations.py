@@ -0,0 +1,149 @@
+"""
+Миграции схемы вместо пересоздания таблиц.
+
+Примененные версии записываются в schema_migrations; migrate применяет
+недостающие по порядку в одной транзакции. Пустая база создается по
+моделям целиком, а миграции только отмечаются примененными - модели
+уже описывают итоговую схему. Запуск из каталога app:
+    python -m db.migrations
+"""
+
+import asyncio
+from dataclasses import dataclass
+from typing import Callable, List
+
+from sqlalchemy import (
+    Column,
+    Connection,
+    DateTime,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    delete,
+    func,
+    inspect,
+    select,
+    text,
+)
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from db.base_model import Base
+from db.models.mlmodel import MLModelDB  # noqa: F401
+from db.models.mlmodel_settings import MLModelSettingsDB
+from db.models.request_history import RequestHistoryDB
+from db.models.request_stats import rollup_rebuild_statements
+from db.models.transaction import TransactionDB
+from db.models.user import UserDB
+from db.models.user_action_history import UserActionHistoryDB
+from db.models.user_roles import UserRoleDB
+
+schema_migrations = Table(
+    "schema_migrations",
+    MetaData(),
+    Column("version", Integer, primary_key=True),
+    Column("name", String(100), nullable=False),
+    Column("applied_at", DateTime(timezone=True), server_default=func.now()),
+)
+
+# Ключ advisory-блокировки PostgreSQL: приложение запускается в нескольких
+# экземплярах, миграции должен применить один
+MIGRATION_LOCK_ID = 718_202_501
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    name: str
+    upgrade: Callable[[Connection], None]
+
+
+def _baseline(conn: Connection) -> None:
+    # Таблицы, появившиеся после создания базы через init_db (create_all
+    # существующие таблицы не трогает)
+    Base.metadata.create_all(conn)
+
+
+# Индексы миграции 2 - список закрыт. Новый индекс в моделях требует
+# новой миграции, иначе базы, уже прошедшие версию 2, его не получат
+HOT_PATH_INDEXES = (
+    (RequestHistoryDB.__table__, "ix_requesthistorydb_user_status"),
+    (RequestHistoryDB.__table__, "ix_requesthistorydb_user_created"),
+    (RequestHistoryDB.__table__, "ix_requesthistorydb_model_created"),
+    (RequestHistoryDB.__table__, "ix_requesthistorydb_pending"),
+    (TransactionDB.__table__, "ix_transactiondb_user_created"),
+    (TransactionDB.__table__, "ix_transactiondb_pending"),
+    (TransactionDB.__table__, "ix_transactiondb_related"),
+    (UserActionHistoryDB.__table__, "ix_useractionhistorydb_user_created"),
+    (UserActionHistoryDB.__table__, "ix_useractionhistorydb_type_created"),
+    (MLModelSettingsDB.__table__, "ix_mlmodelsettingsdb_model_parameter"),
+    (UserRoleDB.__table__, "ix_userroledb_user_id"),
+)
+
+
+def _hot_path_indexes(conn: Connection) -> None:
+    settings = MLModelSettingsDB.__table__
+    # Перед уникальным индексом остаются только последние дубли параметров
+    conn.execute(
+        delete(settings).where(
+            settings.c.id.not_in(
+                select(func.max(settings.c.id)).group_by(
+                    settings.c.model_id, settings.c.parameter
+                )
+            )
+        )
+    )
+    for table, name in HOT_PATH_INDEXES:
+        index = next(index for index in table.indexes if index.name == name)
+        index.create(conn, checkfirst=True)
+
+
+def _backfill_request_stats(conn: Connection) -> None:
+    # Таблицу статистики baseline создает пустой, а get_user_stats читает
+    # ее по умолчанию: заполняем по уже записанной истории
+    for stmt in rollup_rebuild_statements():
+        conn.execute(stmt)
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, "baseline", _baseline),
+    Migration(2, "hot_path_indexes", _hot_path_indexes),
+    Migration(3, "backfill_request_stats", _backfill_request_stats),
+]
+
+
+def _migrate(conn: Connection) -> List[int]:
+    if conn.dialect.name == "postgresql":
+        conn.execute(text(f"SELECT pg_advisory_xact_lock({MIGRATION_LOCK_ID})"))
+    schema_migrations.create(conn, checkfirst=True)
+    applied = set(conn.scalars(select(schema_migrations.c.version)))
+    pending = [m for m in MIGRATIONS if m.version not in applied]
+    if not applied and not inspect(conn).has_table(UserDB.__tablename__):
+        Base.metadata.create_all(conn)
+    else:
+        for migration in pending:
+            migration.upgrade(conn)
+    if pending:
+        conn.execute(
+            schema_migrations.insert(),
+            [{"version": m.version, "name": m.name} for m in pending],
+        )
+    return [m.version for m in pending]
+
+
+async def migrate(engine: AsyncEngine) -> List[int]:
+    """Применяет недостающие миграции, возвращает их версии"""
+    async with engine.begin() as conn:
+        return await conn.run_sync(_migrate)
+
+
+if __name__ == "__main__":
+    from db.session import async_engine
+
+    async def main():
+        try:
+            print(f"Applied migrations: {await migrate(async_engine) or 'none'}")
+        finally:
+            await async_engine.dispose()
+
+    asyncio.run(main())
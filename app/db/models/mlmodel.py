@@ -57,9 +57,10 @@ class MLModelDB(Base, BaseMixin):
     settings: Mapped[List["MLModelSettingsDB"]] = relationship(
         back_populates="mlmodel", cascade="all, delete-orphan", lazy="selectin"
     )
+    # История модели грузится только явно (selectinload в MLModelService)
     request_history: Mapped[List["RequestHistoryDB"]] = relationship(
         back_populates="mlmodel",
-        lazy="dynamic",
+        lazy="raise_on_sql",
         order_by="desc(RequestHistoryDB.created_at)",
     )
 
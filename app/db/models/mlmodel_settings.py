@@ -1,4 +1,4 @@
-from sqlalchemy import ForeignKey, String, Text
+from sqlalchemy import ForeignKey, Index, String, Text
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from ..base_model import Base, BaseMixin
 from typing import TYPE_CHECKING
@@ -9,6 +9,13 @@ if TYPE_CHECKING:
 
 class MLModelSettingsDB(Base, BaseMixin):
     repr_cols = ("model_id", "parameter", "parameter_value")
+    __table_args__ = (
+        # Параметр задается для модели один раз; индекс же обслуживает
+        # поиск настроек модели и внешний ключ на mlmodeldb
+        Index(
+            "ix_mlmodelsettingsdb_model_parameter", "model_id", "parameter", unique=True
+        ),
+    )
 
     model_id: Mapped[int] = mapped_column(
         ForeignKey("mlmodeldb.id", ondelete="CASCADE"),
@@ -1,7 +1,7 @@
 from decimal import Decimal
 from enum import Enum
 from typing import Optional
-from sqlalchemy import ForeignKey, Text, Numeric, Enum as SQLEnum
+from sqlalchemy import ForeignKey, Index, Text, Numeric, Enum as SQLEnum
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from ..base_model import Base, BaseMixin
 
@@ -26,6 +26,10 @@ class RequestStatusDB(str, Enum):
 
 
 class RequestHistoryDB(Base, BaseMixin):
+    __table_args__ = (
+        # Незавершенные запросы пользователя для статистики
+        Index("ix_requesthistorydb_user_status", "user_id", "status"),
+    )
 
     request_type: Mapped[RequestTypeDB] = mapped_column(
         SQLEnum(RequestTypeDB), nullable=False, comment="Тип ML-запроса"
@@ -70,3 +74,27 @@ class RequestHistoryDB(Base, BaseMixin):
     def mark_as_failed(self, error_msg: str = ""):
         self.status = RequestStatusDB.FAILED
         self.output_metrics = error_msg or "Unknown error"
+
+
+# Лента пользователя: WHERE user_id = ? ORDER BY created_at DESC, id DESC
+# с keyset-курсором (services/pagination.py) читает индекс по порядку
+Index(
+    "ix_requesthistorydb_user_created",
+    RequestHistoryDB.user_id,
+    RequestHistoryDB.created_at.desc(),
+    RequestHistoryDB.id.desc(),
+)
+# Запросы модели (get_model_requests) и внешний ключ на mlmodeldb
+Index(
+    "ix_requesthistorydb_model_created",
+    RequestHistoryDB.model_id,
+    RequestHistoryDB.created_at,
+)
+# Очередь ожидающих: частичный индекс - в нем только строки в статусе
+# pending, поэтому он не растет вместе с историей
+Index(
+    "ix_requesthistorydb_pending",
+    RequestHistoryDB.created_at,
+    postgresql_where=RequestHistoryDB.status == RequestStatusDB.PENDING,
+    sqlite_where=RequestHistoryDB.status == RequestStatusDB.PENDING,
+)
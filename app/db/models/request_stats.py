@@ -0,0 +1,112 @@
+from decimal import Decimal
+from typing import Optional
+from sqlalchemy import BigInteger, ForeignKey, Numeric, case, delete, func, insert
+from sqlalchemy import literal_column, select
+from sqlalchemy import Enum as SQLEnum
+from sqlalchemy.orm import Mapped, mapped_column
+from db.base_model import Base
+from .request_history import RequestHistoryDB, RequestStatusDB
+
+# Верхние границы корзин времени выполнения, мс. Корзина i - время
+# не больше LATENCY_BUCKETS_MS[i], последняя - больше всех границ
+LATENCY_BUCKETS_MS = (50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+# Время выполнения не записано
+NO_LATENCY_BUCKET = -1
+
+# Статусы, после которых запрос больше не меняется
+FINAL_STATUSES = (
+    RequestStatusDB.COMPLETED,
+    RequestStatusDB.FAILED,
+    RequestStatusDB.CANCELLED,
+)
+
+
+def latency_bucket(execution_time_ms: Optional[int]) -> int:
+    if execution_time_ms is None:
+        return NO_LATENCY_BUCKET
+    for index, bound in enumerate(LATENCY_BUCKETS_MS):
+        if execution_time_ms <= bound:
+            return index
+    return len(LATENCY_BUCKETS_MS)
+
+
+def latency_bucket_sql(column):
+    """
+    То же, что latency_bucket, выражением SQL. Константы встраиваются
+    в текст: выражение повторяется в GROUP BY и должно совпасть дословно
+    """
+
+    def const(value: int):
+        return literal_column(str(value))
+
+    return case(
+        (column.is_(None), const(NO_LATENCY_BUCKET)),
+        *(
+            (column <= const(bound), const(index))
+            for index, bound in enumerate(LATENCY_BUCKETS_MS)
+        ),
+        else_=const(len(LATENCY_BUCKETS_MS)),
+    )
+
+
+class RequestStatsRollupDB(Base):
+    """
+    Накопительная статистика завершенных запросов пользователя:
+    по строке на статус и корзину времени выполнения. Обновляется
+    в той же транзакции, что и статус запроса
+    """
+
+    __tablename__ = "requeststatsrollupdb"
+
+    user_id: Mapped[int] = mapped_column(ForeignKey("userdb.id"), primary_key=True)
+    status: Mapped[RequestStatusDB] = mapped_column(
+        SQLEnum(RequestStatusDB), primary_key=True
+    )
+    latency_bucket: Mapped[int] = mapped_column(
+        primary_key=True, comment="Индекс корзины в LATENCY_BUCKETS_MS"
+    )
+    requests: Mapped[int] = mapped_column(
+        BigInteger, default=0, comment="Число запросов"
+    )
+    total_cost: Mapped[Decimal] = mapped_column(
+        Numeric(16, 4), default=Decimal("0.0"), comment="Сумма стоимости"
+    )
+    total_execution_ms: Mapped[int] = mapped_column(
+        BigInteger, default=0, comment="Сумма времени выполнения, мс"
+    )
+
+
+def rollup_rebuild_statements(user_id: Optional[int] = None):
+    """
+    DELETE и INSERT ... SELECT GROUP BY, пересчитывающие статистику по
+    истории запросов - всех пользователей или одного
+    """
+    bucket = latency_bucket_sql(RequestHistoryDB.execution_time_ms)
+    stmt = (
+        select(
+            RequestHistoryDB.user_id,
+            RequestHistoryDB.status,
+            bucket,
+            func.count(),
+            func.coalesce(func.sum(RequestHistoryDB.cost), 0),
+            func.coalesce(func.sum(RequestHistoryDB.execution_time_ms), 0),
+        )
+        .where(RequestHistoryDB.status.in_(FINAL_STATUSES))
+        .group_by(RequestHistoryDB.user_id, RequestHistoryDB.status, bucket)
+    )
+    clear = delete(RequestStatsRollupDB)
+    if user_id is not None:
+        stmt = stmt.where(RequestHistoryDB.user_id == user_id)
+        clear = clear.where(RequestStatsRollupDB.user_id == user_id)
+    fill = insert(RequestStatsRollupDB).from_select(
+        [
+            "user_id",
+            "status",
+            "latency_bucket",
+            "requests",
+            "total_cost",
+            "total_execution_ms",
+        ],
+        stmt,
+    )
+    return clear, fill
@@ -2,7 +2,7 @@ from datetime import datetime, timezone
 from decimal import Decimal
 from enum import Enum
 from typing import Optional
-from sqlalchemy import ForeignKey, Numeric, String, Enum as SQLEnum
+from sqlalchemy import ForeignKey, Index, Numeric, String, Enum as SQLEnum
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from ..base_model import Base, BaseMixin
 from typing import TYPE_CHECKING
@@ -60,3 +60,21 @@ class TransactionDB(Base, BaseMixin):
 
     def mark_as_completed(self):
         self.status = "completed"
+
+
+# Страницы транзакций пользователя (services/pagination.py)
+Index(
+    "ix_transactiondb_user_created",
+    TransactionDB.user_id,
+    TransactionDB.created_at.desc(),
+    TransactionDB.id.desc(),
+)
+# Незавершенные транзакции (get_pending_transactions)
+Index(
+    "ix_transactiondb_pending",
+    TransactionDB.created_at,
+    postgresql_where=TransactionDB.status == "pending",
+    sqlite_where=TransactionDB.status == "pending",
+)
+# Дочерние транзакции по внешнему ключу (child_transactions)
+Index("ix_transactiondb_related", TransactionDB.related_transaction_id)
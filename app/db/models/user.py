@@ -35,16 +35,19 @@ class UserDB(Base, BaseMixin):
         default=True, comment="Флаг активности пользователя"
     )
 
-    # Связи с другими моделями
+    # Связи с другими моделями.
+    # История растет без ограничений, поэтому коллекции не грузятся вместе
+    # с пользователем: нужные подгружаются в запросе явно (selectinload)
+    # или через session.refresh(user, [...]). Неявная подгрузка - ошибка.
 
     transactions: Mapped[List["TransactionDB"]] = relationship(
-        back_populates="user", lazy="selectin"
+        back_populates="user", lazy="raise_on_sql"
     )
     request_history: Mapped[List["RequestHistoryDB"]] = relationship(
-        back_populates="user", lazy="selectin"
+        back_populates="user", lazy="raise_on_sql"
     )
     roles: Mapped[List["UserRoleDB"]] = relationship(
-        back_populates="user", lazy="selectin"
+        back_populates="user", lazy="raise_on_sql"
     )
     actions_history: Mapped[list["UserActionHistoryDB"]] = relationship(
         back_populates="user"  # Обратная ссылка
@@ -1,6 +1,6 @@
 from enum import Enum
 from typing import Optional
-from sqlalchemy import ForeignKey, String, Text
+from sqlalchemy import ForeignKey, Index, String, Text
 from sqlalchemy import Enum as SQLEnum
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from db.base_model import Base, BaseMixin
@@ -52,3 +52,18 @@ class UserActionHistoryDB(Base, BaseMixin):
     @property
     def is_successful(self) -> bool:
         return self.status == "success"
+
+
+# Страницы действий пользователя, новые первыми
+Index(
+    "ix_useractionhistorydb_user_created",
+    UserActionHistoryDB.user_id,
+    UserActionHistoryDB.created_at.desc(),
+    UserActionHistoryDB.id.desc(),
+)
+# Последние действия заданного типа (get_recent_actions)
+Index(
+    "ix_useractionhistorydb_type_created",
+    UserActionHistoryDB.action_type,
+    UserActionHistoryDB.created_at,
+)
@@ -20,7 +20,10 @@ class Roles(str, Enum):
 
 class UserRoleDB(Base, BaseMixin):
     user_id: Mapped[int] = mapped_column(
-        ForeignKey("userdb.id"), nullable=False, comment="ID пользователя"
+        ForeignKey("userdb.id"),
+        nullable=False,
+        index=True,
+        comment="ID пользователя",
     )
     role: Mapped[Roles] = mapped_column(SQLEnum(Roles), comment="Роль пользователя")
     is_active: Mapped[bool] = mapped_column(default=True)
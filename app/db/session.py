@@ -2,7 +2,7 @@ from typing import AsyncIterator
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from contextlib import asynccontextmanager
 from config.config import get_settings
-from db.base_model import Base
+from db.migrations import migrate
 
 settings = get_settings()
 # Create async engine
@@ -41,11 +41,10 @@ async def get_async_db() -> AsyncIterator[AsyncSession]:
 
 
 async def init_db():
+    """Применяет миграции схемы (db/migrations.py), данные сохраняются"""
     try:
-        async with async_engine.begin() as conn:
-            await conn.run_sync(Base.metadata.drop_all)
-            await conn.run_sync(Base.metadata.create_all)
-        print("Database initialized successfully")
+        versions = await migrate(async_engine)
+        print(f"Database migrated: {versions or 'up to date'}")
     except Exception as e:
-        print(f"Error initializing database: {e}")
+        print(f"Error migrating database: {e}")
         raise
@@ -1,3 +1,5 @@
+import asyncio
+from contextlib import asynccontextmanager
 from pathlib import Path
 from fastapi.staticfiles import StaticFiles
 import uvicorn
@@ -11,11 +13,89 @@ from routes.profile import router as profile_router
 from routes.transaction_route import router as transaction_router
 from fastapi.middleware.cors import CORSMiddleware
 from routes.auth_route import router as auth_router
+from config.config import get_settings
+from db.session import AsyncSessionFactory, init_db
+from services.admission import AdmissionController
+from services.dependencies import get_generation_params_cache, get_response_cache
+from services.job_result_consumer import JobResultConsumer
+from services.ml_queue_request_service import MLRequestOrchestratorService
+from services.mlmodel_settings_service import MLModelSettingsService
+from services.pagination import NEXT_CURSOR_HEADER
+from services.queue_service import QueueService
+from services.request_history_service import RequestHistoryService
+from services.result_writer import ResultWriter
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Схема доводится до текущей версии до приема запросов
+    await init_db()
+    # Одно соединение с RabbitMQ на процесс вместо подключения на каждый запрос
+    settings = get_settings()
+    queue_service = QueueService(
+        settings.RABBITMQ_URL,
+        settings.ML_REQUEST_QUEUE,
+        channel_pool_size=settings.RABBITMQ_CHANNEL_POOL_SIZE,
+        max_priority=settings.ML_QUEUE_MAX_PRIORITY,
+    )
+    app.state.queue_service = queue_service
+    app.state.admission = AdmissionController(
+        queue_service,
+        worker_concurrency=settings.ML_WORKER_CONCURRENCY,
+        refresh_interval=settings.ADMISSION_REFRESH_INTERVAL,
+    )
+
+    # Ответы на асинхронные задачи пишутся в БД в фоне пакетами
+    request_service = RequestHistoryService(AsyncSessionFactory)
+    result_writer = await ResultWriter(
+        request_service,
+        flush_interval=settings.RESULT_FLUSH_INTERVAL,
+        max_batch_size=settings.RESULT_BATCH_SIZE,
+    ).start()
+    orchestrator = MLRequestOrchestratorService(
+        request_service,
+        queue_service,
+        get_response_cache(),
+        result_writer=result_writer,
+        admission=app.state.admission,
+        settings_service=MLModelSettingsService(
+            AsyncSessionFactory, get_generation_params_cache()
+        ),
+    )
+    job_results = JobResultConsumer(
+        queue_service,
+        request_service,
+        orchestrator.complete_job,
+        result_queue=settings.ML_RESULT_QUEUE,
+    )
+    app.state.job_results = job_results
+
+    async def start_queue():
+        # Брокер может подняться позже API: до подключения запросы к ML
+        # получают 503 (get_queue_service), остальное API уже работает
+        await queue_service.connect_with_retry(settings.RABBITMQ_CONNECT_RETRY_INTERVAL)
+        await job_results.start()
+
+    queue_task = asyncio.create_task(start_queue())
+    try:
+        yield
+    finally:
+        queue_task.cancel()
+        try:
+            await queue_task
+        except asyncio.CancelledError:
+            pass
+        await job_results.close()
+        await result_writer.stop()
+        await queue_service.close()
+        await get_response_cache().close()
+
 
 app = FastAPI(
     title="ML Model API",
     description="API для управления ML моделями и базой данных",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
 
@@ -25,6 +105,8 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Курсор следующей страницы списков (services/pagination.py)
+    expose_headers=[NEXT_CURSOR_HEADER],
 )
 
 app.include_router(chat_router)
@@ -1,5 +1,7 @@
 from datetime import datetime
+import json
 from fastapi import APIRouter, HTTPException, Request, Depends, status
+from fastapi.responses import StreamingResponse
 from fastapi.security import HTTPBearer
 from services.dependencies import (
     get_ml_orchestrator_service,
@@ -18,6 +20,11 @@ security = HTTPBearer()
 chat_history: Dict[int, List[Dict[str, str]]] = {}
 
 
+def _chat_session_id(user_id: int) -> str:
+    """Один диалог на пользователя, как и chat_history"""
+    return f"chat-{user_id}"
+
+
 class ChatMessage(BaseModel):
     user_id: int
     text: str
@@ -92,6 +99,7 @@ async def send_message(
             model_id=1,
             input_data=message.text,
             request_type="prediction",
+            session_id=_chat_session_id(message.user_id),
         )
 
         # Добавляем ответ модели
@@ -107,3 +115,67 @@ async def send_message(
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+
+def _sse(data: dict, event: str = None) -> str:
+    """Форматирует событие Server-Sent Events"""
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@router.get("/send-message/stream")
+async def stream_message(
+    text: str,
+    request: Request,
+    orchestrator: MLRequestOrchestratorService = Depends(get_ml_orchestrator_service),
+    user_service: UserService = Depends(get_user_service),
+):
+    """Ответ модели по кускам через SSE: data-события с chunk, затем done"""
+    token = request.cookies.get("access_token")
+    user = await user_service.get_current_user(token) if token else None
+    if not user:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+
+    history = chat_history.setdefault(user.id, [])
+    history.append(
+        {
+            "sender": "user",
+            "text": text,
+            "timestamp": datetime.now().isoformat(),
+        }
+    )
+
+    async def events():
+        answer = ""
+        try:
+            async for message in orchestrator.stream_prediction_request(
+                user_id=user.id,
+                model_id=1,
+                input_data=text,
+                request_type="prediction",
+                session_id=_chat_session_id(user.id),
+            ):
+                if "chunk" in message:
+                    answer += message["chunk"]
+                    yield _sse({"chunk": message["chunk"]})
+                else:
+                    answer = message["result"].output_data or answer
+        except Exception as e:
+            yield _sse({"detail": str(e)}, event="error")
+            return
+
+        history.append(
+            {
+                "sender": "model",
+                "text": answer,
+                "timestamp": datetime.now().isoformat(),
+            }
+        )
+        yield _sse({"answer": answer}, event="done")
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        # Отключаем буферизацию в nginx, иначе куски придут разом
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
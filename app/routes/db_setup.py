@@ -9,6 +9,7 @@ from db.models.user_roles import UserRoleDB
 from db.models.mlmodel import MLModelDB
 from db.models.mlmodel_settings import MLModelSettingsDB
 from db.models.request_history import RequestHistoryDB
+from db.models.request_stats import RequestStatsRollupDB
 from db.models.transaction import TransactionDB
 from db.models.user_action_history import UserActionHistoryDB
 import os
@@ -21,7 +22,7 @@ router = APIRouter(
 
 @router.post(
     "/create_tables",
-    summary="Создание всех таблиц",
+    summary="Создание таблиц и применение миграций",
     response_description="Результат создания таблиц",
     responses={
         200: {"description": "Таблицы успешно созданы"},
@@ -30,7 +31,7 @@ router = APIRouter(
     },
 )
 async def create_tables():
-    """Создает все таблицы в базе данных в правильном порядке"""
+    """Применяет миграции схемы: недостающие таблицы и индексы, данные сохраняются"""
     if not Base.metadata.tables:
         raise HTTPException(
             status_code=400,
@@ -1,6 +1,15 @@
 import logging
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException
+from typing import List, Optional
+from fastapi import (
+    APIRouter,
+    Depends,
+    File,
+    Form,
+    HTTPException,
+    Query,
+    Response,
+    UploadFile,
+)
 from sqlalchemy.orm import Session
 from services.ml_queue_request_service import MLRequestOrchestratorService
 from schemas.mlmodel import MLModelCreate, MLModelRead
@@ -10,12 +19,20 @@ from schemas.request_history import (
     RequestHistoryRead,
 )
 from services.request_history_service import RequestHistoryService
+from config.config import get_settings
 from services.dependencies import (
+    get_admission,
+    get_job_results,
     get_ml_orchestrator_service,
     get_mlmodel_service,
     get_request_history_service,
     get_queue_service,
+    get_response_cache,
 )
+from services.admission import AdmissionController, OverloadedError
+from services.job_result_consumer import JobResultConsumer
+from services.response_cache import ResponseCache
+from services.pagination import MAX_PAGE_SIZE, NEXT_CURSOR_HEADER, next_cursor
 
 router = APIRouter(prefix="/ml-models", tags=["ml model"])
 
@@ -46,8 +63,49 @@ async def create_prediction_request(
             input_data=request.input_data,
             request_type=request.request_type,
         )
+    except OverloadedError as oe:
+        raise HTTPException(
+            status_code=429,
+            detail=str(oe),
+            headers={"Retry-After": str(oe.retry_after)},
+        )
+    except ValueError as ve:
+        raise HTTPException(status_code=404, detail=str(ve))
+    except TimeoutError as te:
+        raise HTTPException(status_code=504, detail=str(te))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+
+@router.post("/predict-image", response_model=RequestHistoryRead)
+async def create_image_prediction_request(
+    user_id: int = Form(...),
+    model_id: int = Form(...),
+    text: str = Form(...),
+    image: UploadFile = File(...),
+    orchestrator: MLRequestOrchestratorService = Depends(get_ml_orchestrator_service),
+):
+    """
+    Запрос на предсказание по тексту и картинке
+    """
+    try:
+        return await orchestrator.process_prediction_request(
+            user_id=user_id,
+            model_id=model_id,
+            input_data=text,
+            request_type="prediction",
+            image=await image.read(),
+        )
+    except OverloadedError as oe:
+        raise HTTPException(
+            status_code=429,
+            detail=str(oe),
+            headers={"Retry-After": str(oe.retry_after)},
+        )
     except ValueError as ve:
         raise HTTPException(status_code=404, detail=str(ve))
+    except TimeoutError as te:
+        raise HTTPException(status_code=504, detail=str(te))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
@@ -55,9 +113,78 @@ async def create_prediction_request(
 @router.get("/user/{user_id}/prediction", response_model=List[RequestHistoryRead])
 async def get_user_requests(
     user_id: int,
+    response: Response,
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = Query(None, description="Из заголовка X-Next-Cursor"),
     request_service: RequestHistoryService = Depends(get_request_history_service),
 ):
     try:
-        return await request_service.get_user_requests(user_id)
+        requests = await request_service.get_user_requests(
+            user_id, limit=limit, cursor=cursor
+        )
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
+    if next_page := next_cursor(requests, limit):
+        response.headers[NEXT_CURSOR_HEADER] = next_page
+    return requests
+
+
+@router.post("/jobs", response_model=RequestHistoryRead, status_code=202)
+async def create_prediction_job(
+    request: RequestHistoryCreate,
+    orchestrator: MLRequestOrchestratorService = Depends(get_ml_orchestrator_service),
+):
+    """
+    Асинхронное предсказание: сразу возвращает запись в статусе pending,
+    результат - через GET /ml-models/requests/{id}
+    """
+    settings = get_settings()
+    try:
+        return await orchestrator.submit_prediction_job(
+            user_id=request.user_id,
+            model_id=request.model_id,
+            input_data=request.input_data,
+            result_queue=settings.ML_RESULT_QUEUE,
+            request_type=request.request_type,
+            timeout=settings.JOB_TIMEOUT,
+        )
+    except OverloadedError as oe:
+        raise HTTPException(
+            status_code=429,
+            detail=str(oe),
+            headers={"Retry-After": str(oe.retry_after)},
+        )
+    except ValueError as ve:
+        raise HTTPException(status_code=404, detail=str(ve))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+
+@router.get("/requests/{request_id}", response_model=RequestHistoryRead)
+async def get_prediction_request(
+    request_id: int,
+    wait: float = Query(0, ge=0, description="Long-poll: сколько секунд ждать"),
+    job_results: JobResultConsumer = Depends(get_job_results),
+):
+    """Статус и результат запроса; с wait ждет завершения задачи"""
+    wait = min(wait, get_settings().JOB_LONG_POLL_MAX)
+    request = await job_results.wait_for_result(request_id, wait)
+    if request is None:
+        raise HTTPException(status_code=404, detail="Request not found")
+    return request
+
+
+@router.get("/cache/stats")
+async def get_response_cache_stats(
+    response_cache: ResponseCache = Depends(get_response_cache),
+):
+    """Счетчики попаданий и промахов кэша ответов этого процесса"""
+    return response_cache.stats()
+
+
+@router.get("/admission/stats")
+async def get_admission_stats(
+    admission: AdmissionController = Depends(get_admission),
+):
+    """Глубина очереди, время обслуживания и число отказов этого процесса"""
+    return admission.stats()
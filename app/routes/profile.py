@@ -1,6 +1,6 @@
 # Добавим в router.py (или создадим новый файл для профиля)
 
-from fastapi import APIRouter, Depends, status, HTTPException, Request
+from fastapi import APIRouter, Depends, status, HTTPException, Query, Request, Response
 from fastapi.responses import HTMLResponse
 from services.dependencies import (
     get_templates,
@@ -9,7 +9,8 @@ from services.dependencies import (
     get_request_history_service,
 )
 from services.user_service import UserService
-from typing import List, Dict
+from services.pagination import MAX_PAGE_SIZE, NEXT_CURSOR_HEADER, next_cursor
+from typing import List, Dict, Optional
 from datetime import datetime
 
 router = APIRouter(tags=["Profile"])
@@ -70,6 +71,9 @@ async def get_user_info(
 @router.get("/api/profile/ml-requests")
 async def get_user_ml_requests(
     request: Request,
+    response: Response,
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = Query(None, description="Из заголовка X-Next-Cursor"),
     user_service: UserService = Depends(get_user_service),
     request_service=Depends(get_request_history_service),
 ):
@@ -78,11 +82,17 @@ async def get_user_ml_requests(
     if not user:
         raise HTTPException(status_code=401, detail="Not authenticated")
 
-    ml_requests = await request_service.get_user_requests(
-        user_id=user.id,
-        limit=100,  # или любое другое значение
-        include_details=False,  # если нужны детали
-    )
+    try:
+        ml_requests = await request_service.get_user_requests(
+            user_id=user.id,
+            limit=limit,
+            include_details=False,  # если нужны детали
+            cursor=cursor,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if next_page := next_cursor(ml_requests, limit):
+        response.headers[NEXT_CURSOR_HEADER] = next_page
     return [
         {
             "id": ml_request.id,
@@ -102,6 +112,9 @@ async def get_user_ml_requests(
 @router.get("/api/profile/transactions")
 async def get_user_transactions(
     request: Request,
+    response: Response,
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = Query(None, description="Из заголовка X-Next-Cursor"),
     user_service: UserService = Depends(get_user_service),
     transaction_service=Depends(get_transaction_service),
 ):
@@ -110,11 +123,17 @@ async def get_user_transactions(
     if not user:
         raise HTTPException(status_code=401, detail="Not authenticated")
 
-    transactions = await transaction_service.get_user_transactions(
-        user_id=user.id,
-        limit=100,  # или любое другое значение
-        include_details=False,  # если нужны детали
-    )
+    try:
+        transactions = await transaction_service.get_user_transactions(
+            user_id=user.id,
+            limit=limit,
+            include_details=False,  # если нужны детали
+            cursor=cursor,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if next_page := next_cursor(transactions, limit):
+        response.headers[NEXT_CURSOR_HEADER] = next_page
     return [
         {
             **transaction.dict(),
@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from typing import Dict, List, Optional
 from decimal import Decimal
@@ -9,12 +9,14 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from services.request_history_service import RequestHistoryService
 from services.transaction_service import TransactionService
 from services.dependencies import (
+    get_action_history_service,
     get_request_history_service,
     get_user_service,
     get_user_roles_service,
     get_transaction_service,
 )
 from services.user_action_history_service import UserActionHistoryService
+from services.pagination import MAX_PAGE_SIZE, NEXT_CURSOR_HEADER, next_cursor
 from db.models.user import UserDB
 from db.session import get_async_db
 from services.user_service import UserService
@@ -24,6 +26,7 @@ from schemas.user import (
     TransactionRead,
     UserRead,
 )
+from schemas.user_action_history import UserActionHistoryRead
 
 router = APIRouter(prefix="/users", tags=["users"])
 
@@ -53,12 +56,39 @@ async def get_user_info(
 @router.get("/{user_id}/transactions", response_model=List[TransactionRead])
 async def user_transactions(
     user_id: int,
+    response: Response,
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = Query(None, description="Из заголовка X-Next-Cursor"),
     transaction_service: TransactionService = Depends(get_transaction_service),
 ):
     try:
-        return await transaction_service.get_user_transactions(user_id)
+        transactions = await transaction_service.get_user_transactions(
+            user_id, limit=limit, cursor=cursor
+        )
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
+    if next_page := next_cursor(transactions, limit):
+        response.headers[NEXT_CURSOR_HEADER] = next_page
+    return transactions
+
+
+@router.get("/{user_id}/actions", response_model=List[UserActionHistoryRead])
+async def user_actions(
+    user_id: int,
+    response: Response,
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = Query(None, description="Из заголовка X-Next-Cursor"),
+    action_service: UserActionHistoryService = Depends(get_action_history_service),
+):
+    try:
+        actions = await action_service.get_user_actions(
+            user_id, limit=limit, cursor=cursor
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if next_page := next_cursor(actions, limit):
+        response.headers[NEXT_CURSOR_HEADER] = next_page
+    return actions
 
 
 @router.post("/{user_id}/stats", response_model=Dict[str, Decimal])
@@ -1,13 +1,9 @@
 from decimal import Decimal
 from datetime import datetime
-from typing import Optional, Dict, Any, List, TYPE_CHECKING
+from typing import Optional, Dict, Any, List
 from pydantic import BaseModel, ConfigDict, field_validator
 from db.models.mlmodel import ModelInputTypeDB, ModelOutputTypeDB
 
-if TYPE_CHECKING:
-    from .mlmodel_settings import SettingsRead
-    from .request_history import RequestHistoryRead
-
 
 # Базовый DTO
 class MLModelBase(BaseModel):
@@ -82,3 +78,10 @@ class MLModelRead(MLModelBase):
 class MLModelDetailRead(MLModelRead):
     settings: List["MLModelSettingRead"] = []
     request_history: List["RequestHistoryRead"] = []
+
+
+# Импорт после объявления классов: schemas.request_history ссылается на этот модуль
+from schemas.mlmodel_settings import MLModelSettingRead
+from schemas.request_history import RequestHistoryRead
+
+MLModelDetailRead.model_rebuild()
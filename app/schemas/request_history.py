@@ -1,14 +1,10 @@
 from decimal import Decimal
 from datetime import datetime
 from enum import Enum
-from typing import Optional, TYPE_CHECKING
+from typing import Optional
 from pydantic import BaseModel, ConfigDict
 from db.models.request_history import RequestTypeDB, RequestStatusDB
 
-if TYPE_CHECKING:
-    from .mlmodel import MLModelRead
-    from .user import UserRead
-
 
 # Базовый DTO
 class RequestHistoryBase(BaseModel):
@@ -73,3 +69,10 @@ class RequestHistoryDetailRead(RequestHistoryRead):
     user: Optional["UserRead"] = None
     mlmodel: Optional["MLModelRead"] = None
     model_config = ConfigDict(from_attributes=True)
+
+
+# Импорт после объявления классов: schemas.mlmodel ссылается на этот модуль
+from schemas.mlmodel import MLModelRead
+from schemas.user import UserRead
+
+RequestHistoryDetailRead.model_rebuild()
@@ -1,11 +1,9 @@
 from enum import Enum
 from pydantic import BaseModel, ConfigDict
 from datetime import datetime
-from typing import Optional, TYPE_CHECKING
+from typing import Optional
 from db.models.user_action_history import ActionTypeDB
-
-if TYPE_CHECKING:
-    from .user import UserRead
+from schemas.user import UserRead
 
 
 # Базовый DTO
@@ -43,3 +41,6 @@ class UserActionHistoryRead(UserActionHistoryBase):
 # DTO с деталями пользователя (если нужно включать связанные данные)
 class UserActionHistoryReadWithUser(UserActionHistoryRead):
     user: Optional["UserRead"] = None
+
+
+UserActionHistoryReadWithUser.model_rebuild()
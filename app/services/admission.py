@@ -0,0 +1,103 @@
+import asyncio
+import logging
+import math
+import time
+from collections import deque
+from typing import Deque, Dict, Optional
+
+from services.queue_service import QueueService
+
+logger = logging.getLogger(__name__)
+
+
+class OverloadedError(Exception):
+    """Очередь ML воркера не успеет обработать запрос до его дедлайна"""
+
+    def __init__(self, estimated_wait: float, retry_after: int):
+        super().__init__(
+            f"ML queue is overloaded: estimated wait {estimated_wait:.1f}s"
+        )
+        self.estimated_wait = estimated_wait
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Admission control перед публикацией в очередь ML воркера.
+
+    Ожидание оценивается как глубина очереди (passive declare, не чаще
+    раза в refresh_interval) умноженная на среднее время обслуживания
+    одного запроса и деленная на число запросов, которые воркеры
+    обрабатывают параллельно. Если оценка больше дедлайна запроса,
+    публиковать его бессмысленно - он все равно истечет в очереди.
+    """
+
+    def __init__(
+        self,
+        queue_service: QueueService,
+        worker_concurrency: int = 8,
+        default_service_time: float = 2.0,
+        refresh_interval: float = 1.0,
+        window: int = 200,
+    ):
+        self.queue_service = queue_service
+        self.worker_concurrency = max(1, worker_concurrency)
+        self.default_service_time = default_service_time
+        self.refresh_interval = refresh_interval
+        self._service_times: Deque[float] = deque(maxlen=window)
+        self._message_count = 0
+        self._consumer_count = 1
+        self._refreshed_at = 0.0
+        self._refresh_lock = asyncio.Lock()
+        self.rejected = 0
+
+    def observe(self, execution_time_ms: Optional[int]):
+        """Время обслуживания из ответа воркера"""
+        if execution_time_ms:
+            self._service_times.append(execution_time_ms / 1000)
+
+    @property
+    def service_time(self) -> float:
+        if not self._service_times:
+            return self.default_service_time
+        return sum(self._service_times) / len(self._service_times)
+
+    async def _refresh(self):
+        if time.monotonic() - self._refreshed_at < self.refresh_interval:
+            return
+        async with self._refresh_lock:
+            if time.monotonic() - self._refreshed_at < self.refresh_interval:
+                return
+            try:
+                (
+                    self._message_count,
+                    self._consumer_count,
+                ) = await self.queue_service.get_queue_stats()
+            except Exception as e:
+                # Брокер недоступен - не блокируем запросы по устаревшим данным
+                logger.error(f"Failed to read queue depth: {e}")
+                self._message_count = 0
+            self._refreshed_at = time.monotonic()
+
+    async def estimate_wait(self) -> float:
+        """Оценка ожидания в очереди, секунды"""
+        await self._refresh()
+        parallelism = max(1, self._consumer_count) * self.worker_concurrency
+        return self._message_count * self.service_time / parallelism
+
+    async def check(self, deadline_seconds: float):
+        """Поднимает OverloadedError, если запрос не успеет до дедлайна"""
+        estimated_wait = await self.estimate_wait()
+        if estimated_wait > deadline_seconds:
+            self.rejected += 1
+            raise OverloadedError(
+                estimated_wait, retry_after=math.ceil(estimated_wait - deadline_seconds)
+            )
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "queue_depth": self._message_count,
+            "consumers": self._consumer_count,
+            "service_time_s": self.service_time,
+            "rejected": self.rejected,
+        }
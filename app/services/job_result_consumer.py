@@ -0,0 +1,132 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+
+from aio_pika.abc import AbstractChannel, AbstractIncomingMessage
+
+from db.models.request_history import RequestStatusDB
+from schemas.request_history import RequestHistoryRead
+from services.message_codec import decode
+from services.queue_service import CHUNK_MESSAGE_TYPE, QueueService
+from services.request_history_service import RequestHistoryService
+
+logger = logging.getLogger(__name__)
+
+# correlation_id асинхронной задачи: по нему находим строку RequestHistoryDB
+JOB_CORRELATION_PREFIX = "job-"
+
+# Статусы, после которых ответ воркера уже не придет
+FINAL_STATUSES = (
+    RequestStatusDB.COMPLETED,
+    RequestStatusDB.FAILED,
+    RequestStatusDB.CANCELLED,
+)
+
+
+def job_correlation_id(request_id: int) -> str:
+    return f"{JOB_CORRELATION_PREFIX}{request_id}"
+
+
+def parse_job_correlation_id(correlation_id: Optional[str]) -> Optional[int]:
+    if not correlation_id or not correlation_id.startswith(JOB_CORRELATION_PREFIX):
+        return None
+    try:
+        return int(correlation_id[len(JOB_CORRELATION_PREFIX) :])
+    except ValueError:
+        return None
+
+
+class JobResultConsumer:
+    """
+    Фоновый consumer ответов воркера на асинхронные задачи.
+
+    prefetch_count ограничивает, сколько ответов может ждать одной
+    пакетной записи в БД (ResultWriter).
+
+    Очередь результатов общая для всех процессов приложения: ответ
+    обновляет строку в БД в том процессе, который его получил, и будит
+    long-poll запросы этого процесса. Остальные процессы увидят новый
+    статус при следующем чтении БД.
+    """
+
+    def __init__(
+        self,
+        queue_service: QueueService,
+        request_service: RequestHistoryService,
+        handle_result: Callable[[int, dict], Awaitable[Any]],
+        result_queue: str = "ml_results",
+        prefetch_count: int = 256,
+    ):
+        self.queue_service = queue_service
+        self.request_service = request_service
+        self.handle_result = handle_result
+        self.result_queue = result_queue
+        self.prefetch_count = prefetch_count
+        self.channel: Optional[AbstractChannel] = None
+        self._waiters: Dict[int, Set[asyncio.Future]] = {}
+
+    async def start(self):
+        self.channel = await self.queue_service.connection.channel()
+        await self.channel.set_qos(prefetch_count=self.prefetch_count)
+        queue = await self.channel.declare_queue(self.result_queue, durable=True)
+        await queue.consume(self._on_result)
+        logger.info(f"Consuming job results from {self.result_queue}")
+        return self
+
+    async def _on_result(self, message: AbstractIncomingMessage):
+        # Ответ, который не удалось записать, возвращается в очередь один
+        # раз; повторная ошибка его отбрасывает, иначе он зациклится
+        async with message.process(requeue=not message.redelivered):
+            request_id = parse_job_correlation_id(message.correlation_id)
+            if request_id is None or message.type == CHUNK_MESSAGE_TYPE:
+                logger.warning(f"Unexpected job result {message.correlation_id}")
+                return
+            try:
+                await self.handle_result(
+                    request_id, decode(message.body, message.content_type)
+                )
+            except Exception as e:
+                logger.error(f"Failed to store job result {request_id}: {e}")
+                raise
+            finally:
+                self._notify(request_id)
+
+    def _notify(self, request_id: int):
+        for waiter in self._waiters.pop(request_id, ()):
+            if not waiter.done():
+                waiter.set_result(None)
+
+    async def _wait(self, request_id: int, timeout: float):
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(request_id, set()).add(waiter)
+        try:
+            await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            waiters = self._waiters.get(request_id)
+            if waiters is not None:
+                waiters.discard(waiter)
+                if not waiters:
+                    del self._waiters[request_id]
+
+    async def wait_for_result(
+        self, request_id: int, wait: float = 0
+    ) -> Optional[RequestHistoryRead]:
+        """
+        Long-poll: возвращает запись, как только она в финальном статусе,
+        или текущее состояние через wait секунд
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + wait
+        while True:
+            request = await self.request_service.get_request_by_id(request_id)
+            remaining = deadline - loop.time()
+            if request is None or request.status in FINAL_STATUSES or remaining <= 0:
+                return request
+            # Ответ мог обработать другой процесс: перечитываем БД раз в секунду
+            await self._wait(request_id, min(remaining, 1.0))
+
+    async def close(self):
+        if self.channel is not None and not self.channel.is_closed:
+            await self.channel.close()
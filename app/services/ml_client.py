@@ -1,10 +1,15 @@
 import aio_pika
-import json
-import base64
 from fastapi import UploadFile
 from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 import os
+from services.message_codec import (
+    ACCEPT_HEADER,
+    MSGPACK_CONTENT_TYPE,
+    SUPPORTED_CONTENT_TYPES,
+    decode,
+    encode,
+)
 
 load_dotenv()
 
@@ -19,17 +24,17 @@ class QwenVLClient:
 
     async def query_model(self, text: str, image: UploadFile = None) -> dict:
         """Отправка мультимодального запроса"""
-        image_b64 = None
-        if image:
-            image_data = await image.read()
-            image_b64 = base64.b64encode(image_data).decode()
+        # Картинка уходит сырыми байтами в msgpack, без base64
+        image_data = await image.read() if image else None
 
         async with self.connection.channel() as channel:
             callback_queue = await channel.declare_queue(exclusive=True)
 
             await channel.default_exchange.publish(
                 aio_pika.Message(
-                    body=json.dumps({"text": text, "image": image_b64}).encode(),
+                    body=encode({"text": text, "image": image_data}),
+                    content_type=MSGPACK_CONTENT_TYPE,
+                    headers={ACCEPT_HEADER: ", ".join(SUPPORTED_CONTENT_TYPES)},
                     reply_to=callback_queue.name,
                 ),
                 routing_key=os.getenv("ML_REQUEST_QUEUE"),
@@ -38,7 +43,7 @@ class QwenVLClient:
             async with callback_queue.iterator() as queue_iter:
                 async for message in queue_iter:
                     async with message.process():
-                        return json.loads(message.body.decode())
+                        return decode(message.body, message.content_type)
 
 
 @asynccontextmanager
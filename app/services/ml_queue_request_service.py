@@ -1,24 +1,67 @@
-from typing import Optional
+import asyncio
+from typing import Any, AsyncIterator, Dict, Optional
 from decimal import Decimal
 import json
 import logging
+import time
 
+from services.admission import AdmissionController
+from services.job_result_consumer import job_correlation_id
+from services.mlmodel_settings_service import MLModelSettingsService
 from services.request_history_service import RequestHistoryService
 from services.queue_service import QueueService
-from schemas.request_history import RequestHistoryCreate, RequestHistoryRead
+from services.request_priority import PriorityClass, choose_priority_class
+from services.user_roles_service import UserRolesService
+from services.response_cache import ResponseCache, make_cache_key
+from services.result_writer import ResultWriter
+from schemas.request_history import (
+    RequestHistoryCreate,
+    RequestHistoryRead,
+    RequestHistoryUpdate,
+)
 from db.models.request_history import RequestStatusDB
 
 logger = logging.getLogger(__name__)
 
+# Условная стоимость одного успешного ответа модели
+PREDICTION_COST = Decimal(0.01)
+
+
+def result_update(response: dict) -> RequestHistoryUpdate:
+    """Поля RequestHistoryDB по ответу воркера"""
+    if response.get("success"):
+        return RequestHistoryUpdate(
+            status=RequestStatusDB.COMPLETED,
+            output_data=response.get("output_data"),
+            output_metrics=json.dumps(response.get("metrics", {})),
+            execution_time_ms=response.get("execution_time_ms"),
+            cost=PREDICTION_COST,
+        )
+    return RequestHistoryUpdate(
+        status=RequestStatusDB.FAILED,
+        output_metrics=response.get("error", "Unknown error"),
+        execution_time_ms=response.get("execution_time_ms"),
+    )
+
 
 class MLRequestOrchestratorService:
     def __init__(
         self,
         request_service: RequestHistoryService,
         queue_service: QueueService,
+        response_cache: Optional[ResponseCache] = None,
+        user_roles_service: Optional[UserRolesService] = None,
+        result_writer: Optional[ResultWriter] = None,
+        admission: Optional[AdmissionController] = None,
+        settings_service: Optional[MLModelSettingsService] = None,
     ):
         self.request_service = request_service
         self.queue_service = queue_service
+        self.response_cache = response_cache
+        self.user_roles_service = user_roles_service
+        self.result_writer = result_writer
+        self.admission = admission
+        self.settings_service = settings_service
 
     async def process_prediction_request(
         self,
@@ -27,14 +70,39 @@ class MLRequestOrchestratorService:
         input_data: dict,
         request_type: str = "prediction",
         timeout: int = 30,
+        session_id: Optional[str] = None,
+        image: Optional[bytes] = None,
     ) -> RequestHistoryRead:
         """
         Основной метод обработки запроса:
         1. Создает запись в БД
-        2. Отправляет в очередь
+        2. Берет ответ из кэша или отправляет в очередь
         3. Обрабатывает ответ
         4. Обновляет запись в БД
+
+        timeout - дедлайн всего RPC: по его истечении запись помечается
+        CANCELLED и поднимается TimeoutError
         """
+        generation = await self._generation_params(model_id)
+        # Ответ в диалоге зависит от истории, такие запросы не кэшируем
+        cache_key = None
+        if not session_id:
+            cache_key = self._cache_key(model_id, input_data, generation, image)
+
+        started = time.perf_counter()
+        cached = None
+        if cache_key is not None:
+            cached = await self.response_cache.get(cache_key)
+
+        # Диалог в чате - интерактивный запрос, остальное по типу и ролям
+        priority_class = None
+        if cached is None:
+            priority_class = await self._choose_priority_class(
+                user_id, request_type, interactive=session_id is not None
+            )
+            # При перегрузке отказываем до записи в БД
+            await self._admit(timeout, priority_class)
+
         # 1. Создаем запись в БД
         db_request = await self._create_db_request(
             user_id, model_id, input_data, request_type
@@ -42,16 +110,173 @@ class MLRequestOrchestratorService:
 
         # 2. Отправляем в очередь
         try:
-            response = await self._send_to_queue(input_data)
+            if cached is not None:
+                return await self._handle_success_response(
+                    db_request.id,
+                    {
+                        **cached,
+                        "execution_time_ms": int(
+                            (time.perf_counter() - started) * 1000
+                        ),
+                        "metrics": {"cache_hit": True},
+                    },
+                )
+
+            response = await self._send_to_queue(
+                input_data, session_id, image, timeout, priority_class, generation
+            )
+            if cache_key is not None and response.get("success"):
+                await self.response_cache.set(
+                    cache_key,
+                    {"success": True, "output_data": response.get("output_data")},
+                )
 
             # 3. Обрабатываем ответ
+            self._observe(response)
             return await self._handle_queue_response(db_request.id, response)
 
+        except (TimeoutError, asyncio.CancelledError) as e:
+            await self._handle_cancelled_request(db_request.id, e)
+            raise
         except Exception as e:
             logger.error(f"Error processing request {db_request.id}: {str(e)}")
             await self._handle_processing_error(db_request.id, str(e))
             raise
 
+    async def submit_prediction_job(
+        self,
+        user_id: int,
+        model_id: int,
+        input_data: str,
+        result_queue: str,
+        request_type: str = "prediction",
+        timeout: int = 600,
+    ) -> RequestHistoryRead:
+        """
+        Асинхронная задача: создает запись PENDING, публикует запрос
+        и сразу возвращает запись. Ответ воркера придет в result_queue,
+        статус обновит JobResultConsumer через complete_job
+        """
+        generation = await self._generation_params(model_id)
+        cache_key = self._cache_key(model_id, input_data, generation)
+        cached = None
+        if cache_key is not None:
+            cached = await self.response_cache.get(cache_key)
+
+        priority_class = None
+        if cached is None:
+            priority_class = await self._choose_priority_class(
+                user_id, request_type, interactive=False
+            )
+            await self._admit(timeout, priority_class)
+
+        db_request = await self._create_db_request(
+            user_id, model_id, input_data, request_type
+        )
+
+        try:
+            if cached is not None:
+                return await self._handle_success_response(
+                    db_request.id,
+                    {**cached, "execution_time_ms": 0, "metrics": {"cache_hit": True}},
+                )
+
+            await self.queue_service.publish_job(
+                self._build_payload(input_data, generation=generation),
+                job_correlation_id(db_request.id),
+                reply_to=result_queue,
+                timeout=timeout,
+                priority_class=priority_class,
+            )
+            return db_request
+
+        except Exception as e:
+            logger.error(f"Error submitting job {db_request.id}: {str(e)}")
+            await self._handle_processing_error(db_request.id, str(e))
+            raise
+
+    async def complete_job(self, request_id: int, response: dict) -> None:
+        """Обновляет запись асинхронной задачи по ответу воркера"""
+        self._observe(response)
+        if self.result_writer is not None:
+            # Пакетная запись: один UPDATE на много ответов
+            await self.result_writer.write(request_id, result_update(response))
+        else:
+            await self._handle_queue_response(request_id, response)
+        if response.get("success"):
+            await self._cache_job_response(request_id, response)
+
+    async def _cache_job_response(self, request_id: int, response: dict):
+        """
+        Ответ задачи в кэш под тем же ключом, что проверяет
+        submit_prediction_job: модель и текст берутся из записи запроса
+        """
+        if self.response_cache is None:
+            return
+        try:
+            request = await self.request_service.get_request_by_id(request_id)
+            if request is None:
+                return
+            generation = await self._generation_params(request.model_id)
+            cache_key = self._cache_key(
+                request.model_id, request.input_data, generation
+            )
+            if cache_key is not None:
+                await self.response_cache.set(
+                    cache_key,
+                    {"success": True, "output_data": response.get("output_data")},
+                )
+        except Exception as e:
+            # Ответ уже записан в БД, кэш - только ускорение
+            logger.error(f"Failed to cache job result {request_id}: {e}")
+
+    async def stream_prediction_request(
+        self,
+        user_id: int,
+        model_id: int,
+        input_data: str,
+        request_type: str = "prediction",
+        timeout: int = 30,
+        session_id: Optional[str] = None,
+    ) -> AsyncIterator[dict]:
+        """
+        Потоковый вариант process_prediction_request:
+        отдает {"chunk": ...} по мере генерации, последним -
+        {"result": RequestHistoryRead} с обновленной записью
+        """
+        generation = await self._generation_params(model_id)
+        db_request = await self._create_db_request(
+            user_id, model_id, input_data, request_type
+        )
+
+        try:
+            response = None
+            # Поток всегда смотрит пользователь - интерактивный класс
+            async for message in self.queue_service.stream_request(
+                self._build_payload(input_data, session_id, generation=generation),
+                timeout=timeout,
+                priority_class=PriorityClass.INTERACTIVE,
+            ):
+                if "chunk" in message:
+                    yield message
+                else:
+                    response = message
+
+            if response is None:
+                raise ConnectionError("Stream ended without result")
+            self._observe(response)
+            result = await self._handle_queue_response(db_request.id, response)
+            yield {"result": result}
+
+        except (TimeoutError, asyncio.CancelledError, GeneratorExit) as e:
+            # GeneratorExit - клиент закрыл SSE соединение
+            await self._handle_cancelled_request(db_request.id, e)
+            raise
+        except Exception as e:
+            logger.error(f"Error streaming request {db_request.id}: {str(e)}")
+            await self._handle_processing_error(db_request.id, str(e))
+            raise
+
     async def _create_db_request(
         self,
         user_id: int,
@@ -70,15 +295,89 @@ class MLRequestOrchestratorService:
             )
         )
 
-    async def _send_to_queue(
+    async def _admit(self, timeout: float, priority_class: PriorityClass):
+        """OverloadedError, если очередь не успеет обработать запрос до дедлайна"""
+        # Интерактивные запросы обгоняют очередь по приоритету,
+        # глубина очереди для них не показательна
+        if self.admission is None or priority_class == PriorityClass.INTERACTIVE:
+            return
+        await self.admission.check(timeout)
+
+    def _observe(self, response: dict):
+        if self.admission is not None and response.get("success"):
+            self.admission.observe(response.get("execution_time_ms"))
+
+    async def _choose_priority_class(
+        self, user_id: int, request_type: str, interactive: bool
+    ) -> PriorityClass:
+        """Класс приоритета в очереди ML воркера"""
+        roles = []
+        if not interactive and self.user_roles_service is not None:
+            roles = [
+                role.role
+                for role in await self.user_roles_service.get_active_user_roles(user_id)
+            ]
+        return choose_priority_class(request_type, interactive, roles)
+
+    async def _generation_params(self, model_id: int) -> Dict[str, Any]:
+        """Параметры генерации из настроек модели (MLModelSettingsDB)"""
+        if self.settings_service is None:
+            return {}
+        try:
+            return await self.settings_service.get_generation_params(model_id)
+        except Exception as e:
+            # Без настроек воркер сгенерирует с параметрами по умолчанию
+            logger.error(f"Failed to load generation params of model {model_id}: {e}")
+            return {}
+
+    def _cache_key(
         self,
+        model_id: int,
         input_data: str,
+        generation: Dict[str, Any],
+        image: Optional[bytes] = None,
+    ) -> Optional[str]:
+        """Ключ кэша ответов или None, если ответ не детерминирован"""
+        if self.response_cache is None or generation.get("temperature", 0) > 0:
+            return None
+        return make_cache_key(model_id, input_data, image, generation)
+
+    def _build_payload(
+        self,
+        input_data: str,
+        session_id: Optional[str] = None,
+        image: Optional[bytes] = None,
+        generation: Optional[Dict[str, Any]] = None,
     ) -> dict:
-        """Отправка запроса в очередь"""
+        """Тело сообщения для ML воркера"""
         payload = {
             "text": input_data,
         }
-        return await self.queue_service.send_request(payload)
+        # По session_id воркер переиспользует KV-кэш прошлых ходов диалога
+        if session_id:
+            payload["session_id"] = session_id
+        # Сырые байты: кодек сам решит, как их передать
+        if image:
+            payload["image"] = image
+        if generation:
+            payload["generation"] = generation
+        return payload
+
+    async def _send_to_queue(
+        self,
+        input_data: str,
+        session_id: Optional[str] = None,
+        image: Optional[bytes] = None,
+        timeout: int = 30,
+        priority_class: PriorityClass = PriorityClass.STANDARD,
+        generation: Optional[Dict[str, Any]] = None,
+    ) -> dict:
+        """Отправка запроса в очередь"""
+        return await self.queue_service.send_request(
+            self._build_payload(input_data, session_id, image, generation),
+            timeout=timeout,
+            priority_class=priority_class,
+        )
 
     async def _handle_queue_response(
         self, request_id: int, response: dict
@@ -101,7 +400,7 @@ class MLRequestOrchestratorService:
             output_data=response.get("output_data"),
             metrics=json.dumps(response.get("metrics", {})),
             execution_time_ms=response.get("execution_time_ms"),
-            cost=Decimal(0.01),
+            cost=PREDICTION_COST,
         )
 
     async def _handle_failed_response(
@@ -125,3 +424,21 @@ class MLRequestOrchestratorService:
             request_id=request_id,
             error_message=error_message,
         )
+
+    async def _handle_cancelled_request(
+        self, request_id: int, error: BaseException
+    ) -> None:
+        """Таймаут или отмена: ответа уже никто не ждет"""
+        reason = (
+            "Request timed out"
+            if isinstance(error, TimeoutError)
+            else "Request cancelled by client"
+        )
+        logger.warning(f"Request {request_id} cancelled: {reason}")
+        try:
+            # shield: задача может быть уже отменена, а запись обновить нужно
+            await asyncio.shield(
+                self.request_service.cancel_request(request_id, reason)
+            )
+        except Exception as e:
+            logger.error(f"Failed to cancel request {request_id}: {e}")
@@ -1,18 +1,29 @@
 from datetime import datetime, timezone
 from decimal import Decimal
 from typing import Any, List, Dict, Optional
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, lazyload, selectinload
 from sqlalchemy import desc, select
 from db.models.mlmodel import MLModelDB
 from schemas.mlmodel import MLModelCreate, MLModelRead, MLModelUpdate, MLModelDetailRead
+from services.mlmodel_settings_service import GenerationParamsCache
 
 from sqlalchemy.ext.asyncio import async_sessionmaker, AsyncSession
 from sqlalchemy import desc, select
 
 
 class MLModelService:
-    def __init__(self, async_session_factory: async_sessionmaker):
+    def __init__(
+        self,
+        async_session_factory: async_sessionmaker,
+        params_cache: Optional[GenerationParamsCache] = None,
+    ):
         self.async_session_factory = async_session_factory
+        # config модели влияет на параметры генерации (assisted_generation)
+        self.params_cache = params_cache
+
+    def _invalidate(self, model_id: int):
+        if self.params_cache is not None:
+            self.params_cache.invalidate(model_id)
 
     async def create_model(self, model_data: MLModelCreate) -> MLModelRead:
         """Create a new ML model"""
@@ -46,7 +57,9 @@ class MLModelService:
                     model.updated_at = datetime.now(timezone.utc)
                     await session.flush()
                     await session.refresh(model)
-                    return MLModelRead.model_validate(model)
+                    updated = MLModelRead.model_validate(model)
+                self._invalidate(model_id)
+                return updated
             except Exception:
                 await session.rollback()
                 raise
@@ -62,7 +75,8 @@ class MLModelService:
 
                     await session.delete(model)
                     await session.flush()
-                    return True
+                self._invalidate(model_id)
+                return True
             except Exception:
                 await session.rollback()
                 raise
@@ -72,13 +86,12 @@ class MLModelService:
     ) -> Optional[MLModelRead | MLModelDetailRead]:
         """Get model by ID"""
         async with self.async_session_factory() as session:
-            model = await session.get(MLModelDB, model_id)
+            model = await session.get(
+                MLModelDB, model_id, options=self._load_options(include_details)
+            )
             if not model:
                 return None
 
-            if include_details:
-                await session.refresh(model, ["settings", "request_history"])
-
             return self._map_to_read_model(model, include_details)
 
     async def get_all_models(
@@ -87,14 +100,12 @@ class MLModelService:
         """Get all ML models"""
         async with self.async_session_factory() as session:
             result = await session.execute(
-                select(MLModelDB).order_by(desc(MLModelDB.created_at)).limit(limit)
+                select(MLModelDB)
+                .options(*self._load_options(include_details))
+                .order_by(desc(MLModelDB.created_at))
+                .limit(limit)
             )
             models = result.scalars().all()
-
-            if include_details:
-                for model in models:
-                    await session.refresh(model, ["settings", "request_history"])
-
             return [self._map_to_read_model(m, include_details) for m in models]
 
     async def get_models_by_input_type(
@@ -104,16 +115,12 @@ class MLModelService:
         async with self.async_session_factory() as session:
             result = await session.execute(
                 select(MLModelDB)
+                .options(*self._load_options(include_details))
                 .where(MLModelDB.input_type == input_type)
                 .order_by(desc(MLModelDB.created_at))
                 .limit(limit)
             )
             models = result.scalars().all()
-
-            if include_details:
-                for model in models:
-                    await session.refresh(model, ["settings", "request_history"])
-
             return [self._map_to_read_model(m, include_details) for m in models]
 
     async def get_models_by_output_type(
@@ -123,16 +130,12 @@ class MLModelService:
         async with self.async_session_factory() as session:
             result = await session.execute(
                 select(MLModelDB)
+                .options(*self._load_options(include_details))
                 .where(MLModelDB.output_type == output_type)
                 .order_by(desc(MLModelDB.created_at))
                 .limit(limit)
             )
             models = result.scalars().all()
-
-            if include_details:
-                for model in models:
-                    await session.refresh(model, ["settings", "request_history"])
-
             return [self._map_to_read_model(m, include_details) for m in models]
 
     async def calculate_cost(
@@ -157,18 +160,32 @@ class MLModelService:
                     if not model:
                         return None
 
-                    current_config = model.config or {}
-                    current_config.update(config_updates)
-                    model.config = current_config
+                    # Новый dict: изменение на месте JSON-колонка не заметит
+                    model.config = {**(model.config or {}), **config_updates}
                     model.updated_at = datetime.now(timezone.utc)
 
                     await session.flush()
                     await session.refresh(model)
-                    return MLModelRead.model_validate(model)
+                    updated = MLModelRead.model_validate(model)
+                self._invalidate(model_id)
+                return updated
             except Exception:
                 await session.rollback()
                 raise
 
+    def _load_options(self, include_details: bool) -> tuple:
+        if include_details:
+            # Коллекции для DetailRead - по одному selectin-запросу на всю
+            # страницу. В DTO элементов коллекций связей нет, поэтому их
+            # связи не грузим: иначе eager-загрузка по умолчанию тянет
+            # пользователя и модель каждой строки истории
+            return (
+                selectinload(MLModelDB.settings).lazyload("*"),
+                selectinload(MLModelDB.request_history).lazyload("*"),
+            )
+        # Для MLModelRead коллекции не нужны
+        return (lazyload(MLModelDB.settings),)
+
     def _map_to_read_model(
         self, model: MLModelDB, include_details: bool = False
     ) -> MLModelRead | MLModelDetailRead:
@@ -1,7 +1,11 @@
 from datetime import datetime, timezone
-from typing import List, Optional, Dict
-from sqlalchemy.orm import Session
+import json
+import logging
+import time
+from typing import Any, Iterable, List, Optional, Dict, Tuple
+from sqlalchemy.orm import Session, joinedload, lazyload
 from sqlalchemy import and_, select
+from sqlalchemy.exc import IntegrityError
 from db.models.mlmodel_settings import MLModelSettingsDB
 from db.models.mlmodel import MLModelDB
 from schemas.mlmodel_settings import (
@@ -14,10 +18,120 @@ from schemas.mlmodel_settings import (
 from sqlalchemy.ext.asyncio import async_sessionmaker, AsyncSession
 from sqlalchemy import and_, select
 
+logger = logging.getLogger(__name__)
+
+# Настройки модели, которые уходят воркеру как параметры генерации
+GENERATION_PARAMETERS = {
+    "max_new_tokens": int,
+    "temperature": float,
+    "top_p": float,
+    # JSON-список строк или одна строка
+    "stop": list,
+    # Ранняя остановка генерации по времени, секунды
+    "max_time": float,
+}
+
+
+# Ключ MLModelDB.config: генерировать с draft-моделью (assisted generation)
+ASSISTED_GENERATION_KEY = "assisted_generation"
+
+
+def parse_generation_params(settings: Iterable[Tuple[str, str]]) -> Dict[str, Any]:
+    """Строковые значения MLModelSettingsDB -> поле generation сообщения воркеру"""
+    params = {}
+    for parameter, value in settings:
+        kind = GENERATION_PARAMETERS.get(parameter)
+        if kind is None:
+            continue
+        try:
+            if kind is list:
+                try:
+                    parsed = json.loads(value)
+                except ValueError:
+                    parsed = value
+                params[parameter] = [parsed] if isinstance(parsed, str) else parsed
+            else:
+                params[parameter] = kind(value)
+        except (TypeError, ValueError):
+            logger.warning(f"Invalid value {value!r} for setting {parameter}")
+    return params
+
+
+class GenerationParamsCache:
+    """
+    Параметры генерации моделей в памяти процесса.
+
+    Изменения через MLModelSettingsService сбрасывают запись сразу,
+    изменения из других процессов видны не позже чем через ttl секунд.
+    Счетчик версий не дает чтению, начатому до сброса, положить
+    в кэш устаревшие параметры после него.
+    """
+
+    def __init__(self, ttl_seconds: float = 30):
+        self.ttl = ttl_seconds
+        self._items: Dict[int, Tuple[float, Dict[str, Any]]] = {}
+        self._versions: Dict[int, int] = {}
+
+    def get(self, model_id: int) -> Optional[Dict[str, Any]]:
+        item = self._items.get(model_id)
+        if item is None or item[0] < time.monotonic():
+            return None
+        return item[1]
+
+    def version(self, model_id: int) -> int:
+        """Запомнить до чтения из БД и передать в set"""
+        return self._versions.get(model_id, 0)
+
+    def set(self, model_id: int, params: Dict[str, Any], version: int):
+        if self._versions.get(model_id, 0) != version:
+            # Пока параметры читались, настройки изменились
+            return
+        self._items[model_id] = (time.monotonic() + self.ttl, params)
+
+    def invalidate(self, model_id: int):
+        self._versions[model_id] = self._versions.get(model_id, 0) + 1
+        self._items.pop(model_id, None)
+
 
 class MLModelSettingsService:
-    def __init__(self, async_session_factory: async_sessionmaker):
+    def __init__(
+        self,
+        async_session_factory: async_sessionmaker,
+        params_cache: Optional[GenerationParamsCache] = None,
+    ):
         self.async_session_factory = async_session_factory
+        self.params_cache = params_cache
+
+    def _invalidate(self, model_id: int):
+        if self.params_cache is not None:
+            self.params_cache.invalidate(model_id)
+
+    async def get_generation_params(self, model_id: int) -> Dict[str, Any]:
+        """Параметры генерации модели, из кэша процесса или из БД"""
+        if self.params_cache is not None:
+            params = self.params_cache.get(model_id)
+            if params is not None:
+                return params
+            version = self.params_cache.version(model_id)
+        async with self.async_session_factory() as session:
+            result = await session.execute(
+                select(
+                    MLModelSettingsDB.parameter, MLModelSettingsDB.parameter_value
+                ).where(
+                    MLModelSettingsDB.model_id == model_id,
+                    MLModelSettingsDB.parameter.in_(GENERATION_PARAMETERS),
+                )
+            )
+            params = parse_generation_params(result.all())
+            model_config = await session.scalar(
+                select(MLModelDB.config).where(MLModelDB.id == model_id)
+            )
+        # Speculative decoding с draft-моделью воркера включается в config модели
+        if (model_config or {}).get(ASSISTED_GENERATION_KEY):
+            params["assisted"] = True
+        if self.params_cache is not None:
+            self.params_cache.set(model_id, params, version)
+        return params
 
     async def create_setting(
         self, setting_data: MLModelSettingCreate
@@ -48,7 +162,14 @@ class MLModelSettingsService:
                     session.add(db_setting)
                     await session.flush()
                     await session.refresh(db_setting)
-                    return MLModelSettingRead.model_validate(db_setting)
+                    created = MLModelSettingRead.model_validate(db_setting)
+                # Сбрасываем кэш после коммита, иначе его заполнят старым значением
+                self._invalidate(setting_data.model_id)
+                return created
+            except IntegrityError:
+                # Параллельный запрос успел создать тот же параметр
+                await session.rollback()
+                raise ValueError("Parameter already exists for this model")
             except Exception:
                 await session.rollback()
                 raise
@@ -71,7 +192,9 @@ class MLModelSettingsService:
                     setting.updated_at = datetime.now(timezone.utc)
                     await session.flush()
                     await session.refresh(setting)
-                    return MLModelSettingRead.model_validate(setting)
+                    updated = MLModelSettingRead.model_validate(setting)
+                self._invalidate(updated.model_id)
+                return updated
             except Exception:
                 await session.rollback()
                 raise
@@ -85,9 +208,11 @@ class MLModelSettingsService:
                     if not setting:
                         return False
 
+                    model_id = setting.model_id
                     await session.delete(setting)
                     await session.flush()
-                    return True
+                self._invalidate(model_id)
+                return True
             except Exception:
                 await session.rollback()
                 raise
@@ -97,13 +222,12 @@ class MLModelSettingsService:
     ) -> Optional[MLModelSettingRead | MLModelSettingDetailRead]:
         """Get setting by ID"""
         async with self.async_session_factory() as session:
-            setting = await session.get(MLModelSettingsDB, setting_id)
+            setting = await session.get(
+                MLModelSettingsDB, setting_id, options=self._load_options(include_model)
+            )
             if not setting:
                 return None
 
-            if include_model:
-                await session.refresh(setting, ["model"])
-
             return self._map_to_read_model(setting, include_model)
 
     async def get_model_settings(
@@ -113,15 +237,11 @@ class MLModelSettingsService:
         async with self.async_session_factory() as session:
             result = await session.execute(
                 select(MLModelSettingsDB)
+                .options(*self._load_options(include_model))
                 .where(MLModelSettingsDB.model_id == model_id)
                 .limit(limit)
             )
             settings = result.scalars().all()
-
-            if include_model:
-                for setting in settings:
-                    await session.refresh(setting, ["model"])
-
             return [self._map_to_read_model(s, include_model) for s in settings]
 
     async def get_settings_by_parameter(
@@ -131,15 +251,11 @@ class MLModelSettingsService:
         async with self.async_session_factory() as session:
             result = await session.execute(
                 select(MLModelSettingsDB)
+                .options(*self._load_options(include_model))
                 .where(MLModelSettingsDB.parameter == parameter_name)
                 .limit(limit)
             )
             settings = result.scalars().all()
-
-            if include_model:
-                for setting in settings:
-                    await session.refresh(setting, ["model"])
-
             return [self._map_to_read_model(s, include_model) for s in settings]
 
     async def bulk_update_settings(
@@ -183,13 +299,21 @@ class MLModelSettingsService:
                     for setting in updated_settings:
                         await session.refresh(setting)
 
-                    return [
+                    updated = [
                         MLModelSettingRead.model_validate(s) for s in updated_settings
                     ]
+                self._invalidate(model_id)
+                return updated
             except Exception:
                 await session.rollback()
                 raise
 
+    def _load_options(self, include_model: bool) -> tuple:
+        if include_model:
+            # Модель для DetailRead - тем же запросом, что и список
+            return (joinedload(MLModelSettingsDB.mlmodel),)
+        return (lazyload(MLModelSettingsDB.mlmodel),)
+
     def _map_to_read_model(
         self, setting: MLModelSettingsDB, include_model: bool = False
     ) -> MLModelSettingRead | MLModelSettingDetailRead:
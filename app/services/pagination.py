@@ -0,0 +1,45 @@
+from typing import Optional, Sequence
+from sqlalchemy import Select, select, tuple_
+from sqlalchemy.orm import aliased
+
+# Заголовок ответа с курсором следующей страницы
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+MAX_PAGE_SIZE = 500
+
+
+def decode_cursor(cursor: str) -> int:
+    try:
+        return int(cursor)
+    except (TypeError, ValueError):
+        raise ValueError("Invalid cursor")
+
+
+def keyset_page(stmt: Select, model, limit: int, cursor: Optional[str] = None):
+    """
+    Страница ленты model (новые первыми) с keyset-пагинацией по
+    (created_at, id): вместо OFFSET - условие "после последней строки
+    прошлой страницы", поэтому глубокие страницы стоят столько же,
+    сколько первая.
+
+    Курсор - id последней строки. Ее created_at берется подзапросом,
+    а не из курсора: так сравниваются значения в формате самой базы
+    (SQLite хранит server_default-время без микросекунд)
+    """
+    stmt = stmt.order_by(model.created_at.desc(), model.id.desc()).limit(limit)
+    if cursor is None:
+        return stmt
+    last_id = decode_cursor(cursor)
+    anchor = aliased(model)
+    last_created_at = (
+        select(anchor.created_at).where(anchor.id == last_id).scalar_subquery()
+    )
+    return stmt.where(
+        tuple_(model.created_at, model.id) < tuple_(last_created_at, last_id)
+    )
+
+
+def next_cursor(items: Sequence, limit: int) -> Optional[str]:
+    """Курсор следующей страницы; None - страница последняя"""
+    if len(items) < limit or not items:
+        return None
+    return str(items[-1].id)
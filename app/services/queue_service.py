@@ -1,62 +1,279 @@
 # services/queue_service.py
 import asyncio
-import json
+import logging
+import time
 import uuid
 import aio_pika
-from typing import Dict, Any
+from aio_pika.abc import AbstractChannel, AbstractIncomingMessage
+from aio_pika.pool import Pool
+from typing import AsyncIterator, Dict, Any, Optional, Tuple
+from services.message_codec import (
+    ACCEPT_HEADER,
+    DEADLINE_HEADER,
+    ENQUEUED_AT_HEADER,
+    PRIORITY_CLASS_HEADER,
+    MSGPACK_CONTENT_TYPE,
+    SUPPORTED_CONTENT_TYPES,
+    decode,
+    encode,
+)
+from services.request_priority import PRIORITY_VALUES, PriorityClass
+
+# Тип ответного сообщения воркера с куском потоковой генерации
+CHUNK_MESSAGE_TYPE = "chunk"
+
+logger = logging.getLogger(__name__)
 
 
 class QueueService:
-    def __init__(self, rabbitmq_url: str, request_queue: str = "ml_requests"):
+    """
+    RPC-клиент к ML воркеру.
+
+    На процесс один reply-queue и один consumer: ответы раскладываются
+    по correlation_id в ожидающие Future (или очереди потоковых запросов),
+    так что запрос - это publish и ожидание Future.
+
+    Создается один раз на процесс (lifespan приложения): соединение robust
+    и переподключается само, публикация идет через пул каналов.
+    """
+
+    def __init__(
+        self,
+        rabbitmq_url: str,
+        request_queue: str = "ml_requests",
+        content_type: str = MSGPACK_CONTENT_TYPE,
+        channel_pool_size: int = 8,
+        max_priority: int = 10,
+    ):
         self.rabbitmq_url = rabbitmq_url
         self.connection = None
         self.channel = None
         self.request_queue = request_queue
+        self.content_type = content_type
+        self.callback_queue = None
+        self.channel_pool_size = channel_pool_size
+        self.max_priority = max_priority
+        self._channel_pool: Optional[Pool] = None
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._streams: Dict[str, asyncio.Queue] = {}
+
+    def _build_message(
+        self,
+        payload: Dict[str, Any],
+        correlation_id: str,
+        timeout: int,
+        priority_class: PriorityClass = PriorityClass.STANDARD,
+        reply_to: Optional[str] = None,
+        expires: bool = True,
+    ) -> aio_pika.Message:
+        """Сообщение запроса: тело в self.content_type, ответ в любом из наших форматов"""
+        now = time.time()
+        return aio_pika.Message(
+            body=encode(payload, self.content_type),
+            content_type=self.content_type,
+            headers={
+                ACCEPT_HEADER: ", ".join(SUPPORTED_CONTENT_TYPES),
+                # Воркер не начнет генерацию, если дедлайн уже прошел
+                DEADLINE_HEADER: now + timeout,
+                ENQUEUED_AT_HEADER: now,
+                PRIORITY_CLASS_HEADER: priority_class.value,
+            },
+            priority=PRIORITY_VALUES[priority_class],
+            reply_to=reply_to or self.callback_queue.name,
+            correlation_id=correlation_id,
+            # Без expiration брокер не выбросит сообщение молча:
+            # воркер сам ответит ошибкой по x-deadline
+            expiration=timeout * 1000 if expires else None,
+        )
 
     async def connect(self):
         """Подключение к RabbitMQ"""
         self.connection = await aio_pika.connect_robust(self.rabbitmq_url)
         self.channel = await self.connection.channel()
 
-        # Объявляем очереди
-        await self.channel.declare_queue(self.request_queue, durable=True)
+        # Объявляем очереди; аргументы должны совпадать с объявлением у воркера
+        await self.channel.declare_queue(
+            self.request_queue,
+            durable=True,
+            arguments={"x-max-priority": self.max_priority},
+        )
+
+        # Имя задаем сами: серверное amq.gen-* нельзя переобъявить после реконнекта
+        self.callback_queue = await self.channel.declare_queue(
+            f"{self.request_queue}.replies.{uuid.uuid4().hex}",
+            exclusive=True,
+            auto_delete=True,
+        )
+        await self.callback_queue.consume(self._on_response, no_ack=True)
+
+        self._channel_pool = Pool(self._open_channel, max_size=self.channel_pool_size)
         return self
 
+    async def connect_with_retry(self, retry_interval: float = 5.0):
+        """
+        connect, пока брокер не примет соединение. Выполняется в фоне:
+        API стартует без RabbitMQ, а до подключения get_queue_service
+        отвечает 503
+        """
+        while True:
+            try:
+                return await self.connect()
+            except Exception as e:
+                logger.warning(
+                    f"RabbitMQ is unavailable, retrying in {retry_interval}s: {e}"
+                )
+                try:
+                    await self.close()
+                except Exception:
+                    pass
+                self.connection = None
+                self.channel = None
+                self._channel_pool = None
+                await asyncio.sleep(retry_interval)
+
+    async def _open_channel(self) -> AbstractChannel:
+        return await self.connection.channel()
+
+    async def _publish(self, message: aio_pika.Message):
+        """Публикация запроса через канал из пула"""
+        async with self._channel_pool.acquire() as channel:
+            if channel.is_closed:
+                # Канал закрыт брокером (ошибка канала) - открываем заново
+                await channel.reopen()
+            await channel.default_exchange.publish(
+                message, routing_key=self.request_queue
+            )
+
+    async def _on_response(self, message: AbstractIncomingMessage):
+        """Раскладывает ответ воркера по correlation_id"""
+        correlation_id = message.correlation_id
+        try:
+            body = decode(message.body, message.content_type)
+        except Exception as e:
+            body = e
+
+        stream = self._streams.get(correlation_id)
+        if stream is not None:
+            stream.put_nowait((message.type, body))
+            return
+
+        future = self._pending.pop(correlation_id, None)
+        if future is None or future.done():
+            # Ответ на запрос, который уже отвалился по таймауту
+            logger.warning(f"Dropping late reply {correlation_id}")
+            return
+        if isinstance(body, Exception):
+            future.set_exception(body)
+        else:
+            future.set_result(body)
+
     async def send_request(
-        self, payload: Dict[str, Any], timeout: int = 30
+        self,
+        payload: Dict[str, Any],
+        timeout: int = 30,
+        priority_class: PriorityClass = PriorityClass.STANDARD,
     ) -> Dict[str, Any]:
         """Отправка запроса в очередь и ожидание ответа"""
+        correlation_id = str(uuid.uuid4())
+        future = asyncio.get_running_loop().create_future()
+        self._pending[correlation_id] = future
         try:
-            # Создаем временную очередь для ответа
-            callback_queue = await self.channel.declare_queue(exclusive=True)
-
-            correlation_id = str(uuid.uuid4())
-
-            await self.channel.default_exchange.publish(
-                aio_pika.Message(
-                    body=json.dumps(payload).encode(),
-                    reply_to=callback_queue.name,
-                    correlation_id=correlation_id,
-                    expiration=timeout * 1000,
-                ),
-                routing_key=self.request_queue,
+            await self._publish(
+                self._build_message(payload, correlation_id, timeout, priority_class)
             )
-
-            # Ожидаем ответ
-            async with callback_queue.iterator() as queue_iter:
-                async for message in queue_iter:
-                    if message.correlation_id == correlation_id:
-                        async with message.process():
-                            return json.loads(message.body.decode())
-
-            raise TimeoutError("No response received within timeout")
+            return await asyncio.wait_for(future, timeout)
 
         except asyncio.TimeoutError:
             raise TimeoutError("Request timed out")
         except Exception as e:
             raise ConnectionError(f"Queue error: {str(e)}")
+        finally:
+            self._pending.pop(correlation_id, None)
+
+    async def publish_job(
+        self,
+        payload: Dict[str, Any],
+        correlation_id: str,
+        reply_to: str,
+        timeout: int,
+        priority_class: PriorityClass = PriorityClass.STANDARD,
+    ):
+        """
+        Асинхронная задача: ответ воркера уходит в общую очередь reply_to
+        и обрабатывается фоновым consumer'ом, здесь его не ждем
+        """
+        try:
+            await self._publish(
+                self._build_message(
+                    payload,
+                    correlation_id,
+                    timeout,
+                    priority_class,
+                    reply_to=reply_to,
+                    expires=False,
+                )
+            )
+        except Exception as e:
+            raise ConnectionError(f"Queue error: {str(e)}")
+
+    async def stream_request(
+        self,
+        payload: Dict[str, Any],
+        timeout: int = 30,
+        priority_class: PriorityClass = PriorityClass.INTERACTIVE,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Потоковый запрос: отдает куски ответа {"chunk": ...} по мере генерации,
+        последним - итоговый результат воркера
+        """
+        correlation_id = str(uuid.uuid4())
+        stream: "asyncio.Queue[Tuple[Optional[str], Any]]" = asyncio.Queue()
+        self._streams[correlation_id] = stream
+
+        try:
+            await self._publish(
+                self._build_message(
+                    {**payload, "stream": True},
+                    correlation_id,
+                    timeout,
+                    priority_class,
+                )
+            )
+
+            while True:
+                # timeout ограничивает паузу между кусками, а не всю генерацию
+                message_type, body = await asyncio.wait_for(stream.get(), timeout)
+                if isinstance(body, Exception):
+                    raise ConnectionError(f"Queue error: {str(body)}")
+                yield body
+                if message_type != CHUNK_MESSAGE_TYPE:
+                    return
+
+        except asyncio.TimeoutError:
+            raise TimeoutError("Request timed out")
+        finally:
+            self._streams.pop(correlation_id, None)
+
+    async def get_queue_stats(self) -> Tuple[int, int]:
+        """Глубина очереди запросов и число consumer'ов (passive declare)"""
+        async with self._channel_pool.acquire() as channel:
+            if channel.is_closed:
+                await channel.reopen()
+            queue = await channel.declare_queue(self.request_queue, passive=True)
+            result = queue.declaration_result
+            return result.message_count, result.consumer_count
+
+    async def health_check(self) -> bool:
+        # Пул каналов создается последним шагом connect
+        return (
+            self._channel_pool is not None
+            and self.connection is not None
+            and not self.connection.is_closed
+        )
 
     async def close(self):
         """Закрытие соединения"""
+        if self._channel_pool is not None:
+            await self._channel_pool.close()
         if self.connection:
             await self.connection.close()
@@ -1,6 +1,16 @@
+from collections import defaultdict
 from decimal import Decimal
-from typing import List, Optional, Dict
-from db.models.request_history import RequestHistoryDB
+from typing import Iterable, List, Optional, Dict, Tuple
+from db.models.request_history import RequestHistoryDB, RequestStatusDB
+from db.models.request_stats import (
+    FINAL_STATUSES,
+    LATENCY_BUCKETS_MS,
+    NO_LATENCY_BUCKET,
+    RequestStatsRollupDB,
+    latency_bucket,
+    latency_bucket_sql,
+    rollup_rebuild_statements,
+)
 from db.models.user import UserDB
 from db.models.mlmodel import MLModelDB
 from schemas.request_history import (
@@ -9,9 +19,67 @@ from schemas.request_history import (
     RequestHistoryUpdate,
     RequestHistoryDetailRead,
 )
+from services.pagination import keyset_page
+
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from sqlalchemy import Integer, bindparam, cast, column, func
+from sqlalchemy import literal, select, update
+from sqlalchemy import values as sql_values
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import joinedload, lazyload
+
+# Поля, которые пишет воркер; None в обновлении - оставить как есть
+RESULT_FIELDS = ("output_data", "output_metrics", "execution_time_ms", "cost")
+
+# Вклад запроса в RequestStatsRollupDB: (user_id, status, cost, execution_time_ms)
+StatsEntry = Tuple[int, RequestStatusDB, Optional[Decimal], Optional[int]]
 
-from sqlalchemy.ext.asyncio import async_sessionmaker
-from sqlalchemy import desc, select
+
+def user_stats_from_rows(rows: Iterable[Tuple]) -> Dict[str, Decimal]:
+    """
+    Статистика из строк (status, latency_bucket, requests, total_cost,
+    total_execution_ms). Перцентили времени выполнения - верхняя граница
+    корзины гистограммы; для последней корзины - нижняя
+    """
+    total = completed = 0
+    total_cost = Decimal("0.0")
+    total_ms = 0
+    histogram = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+    for status, bucket, requests, cost, execution_ms in rows:
+        total += requests
+        if status != RequestStatusDB.COMPLETED:
+            continue
+        completed += requests
+        total_cost += Decimal(cost or 0)
+        total_ms += execution_ms or 0
+        if bucket != NO_LATENCY_BUCKET:
+            histogram[bucket] += requests
+
+    def percentile(q: float) -> Decimal:
+        measured = sum(histogram)
+        if not measured:
+            return Decimal("0.0")
+        seen = 0
+        for index, count in enumerate(histogram):
+            seen += count
+            if seen >= q * measured:
+                break
+        return Decimal(LATENCY_BUCKETS_MS[min(index, len(LATENCY_BUCKETS_MS) - 1)])
+
+    return {
+        "total_requests": total,
+        "completed_requests": completed,
+        "failed_requests": total - completed,
+        "total_cost": total_cost,
+        # Как и раньше, запросы без времени выполнения считаются за 0
+        "avg_execution_time": (
+            (Decimal(total_ms) / completed).quantize(Decimal("0.00"))
+            if completed
+            else Decimal("0.0")
+        ),
+        "p50_execution_time": percentile(0.5),
+        "p95_execution_time": percentile(0.95),
+    }
 
 
 class RequestHistoryService:
@@ -25,13 +93,19 @@ class RequestHistoryService:
         async with self.async_session_factory() as session:
             try:
                 async with session.begin():
-                    # Validate user and model exist
-                    user = await session.get(UserDB, request_data.user_id)
-                    if not user:
+                    # Validate user and model exist (ids only, no relationships)
+                    user_id = await session.scalar(
+                        select(UserDB.id).where(UserDB.id == request_data.user_id)
+                    )
+                    if user_id is None:
                         raise ValueError("User not found")
 
-                    mlmodel = await session.get(MLModelDB, request_data.model_id)
-                    if not mlmodel:
+                    model_id = await session.scalar(
+                        select(MLModelDB.id).where(
+                            MLModelDB.id == request_data.model_id
+                        )
+                    )
+                    if model_id is None:
                         raise ValueError("MLModel not found")
 
                     # Create request
@@ -51,15 +125,27 @@ class RequestHistoryService:
         async with self.async_session_factory() as session:
             try:
                 async with session.begin():
-                    request = await session.get(RequestHistoryDB, request_id)
+                    # Блокировка строки, как в apply_results: иначе отмена и
+                    # завершение одного запроса обе вычтут из статистики
+                    # прежний статус и прибавят свой
+                    request = await session.get(
+                        RequestHistoryDB,
+                        request_id,
+                        options=self._load_options(False),
+                        with_for_update=True,
+                    )
                     if not request:
                         return None
 
+                    before = self._stats_entry(request)
                     update_dict = update_data.model_dump(exclude_unset=True)
                     for field, value in update_dict.items():
                         setattr(request, field, value)
 
                     await session.flush()
+                    await self._update_rollup(
+                        session, removed=[before], added=[self._stats_entry(request)]
+                    )
                     await session.refresh(request)
                     return RequestHistoryRead.model_validate(request)
             except Exception:
@@ -102,37 +188,169 @@ class RequestHistoryService:
             ),
         )
 
+    async def cancel_request(
+        self,
+        request_id: int,
+        reason: str,
+        execution_time_ms: Optional[int] = None,
+    ) -> Optional[RequestHistoryRead]:
+        """Mark request as cancelled (timeout or client disconnect)"""
+        return await self.update_request(
+            request_id,
+            RequestHistoryUpdate(
+                status="cancelled",
+                output_metrics=reason,
+                execution_time_ms=execution_time_ms,
+            ),
+        )
+
+    async def apply_results(
+        self, updates: List[Tuple[int, RequestHistoryUpdate]]
+    ) -> int:
+        """
+        Apply many worker results in one statement.
+
+        PostgreSQL: a single UPDATE ... FROM (VALUES ...), other dialects:
+        one executemany UPDATE. Returns the number of updated rows.
+        """
+        if not updates:
+            return 0
+        table = RequestHistoryDB.__table__
+        rows = [
+            {
+                "id": request_id,
+                "status": update_data.status,
+                **{field: getattr(update_data, field) for field in RESULT_FIELDS},
+            }
+            for request_id, update_data in updates
+        ]
+
+        async with self.async_session_factory() as session:
+            async with session.begin():
+                # Прежние значения - для RequestStatsRollupDB
+                previous = await session.execute(
+                    select(
+                        RequestHistoryDB.id,
+                        RequestHistoryDB.user_id,
+                        RequestHistoryDB.status,
+                        RequestHistoryDB.cost,
+                        RequestHistoryDB.execution_time_ms,
+                    )
+                    .where(RequestHistoryDB.id.in_([row["id"] for row in rows]))
+                    .with_for_update()
+                )
+                before = {row.id: row for row in previous}
+                after = [
+                    (
+                        before[row["id"]].user_id,
+                        (
+                            RequestStatusDB(row["status"])
+                            if row["status"]
+                            else before[row["id"]].status
+                        ),
+                        (
+                            row["cost"]
+                            if row["cost"] is not None
+                            else before[row["id"]].cost
+                        ),
+                        (
+                            row["execution_time_ms"]
+                            if row["execution_time_ms"] is not None
+                            else before[row["id"]].execution_time_ms
+                        ),
+                    )
+                    for row in rows
+                    if row["id"] in before
+                ]
+
+                if session.bind.dialect.name == "postgresql":
+                    data = sql_values(
+                        column("id", Integer),
+                        column("status", table.c.status.type),
+                        *(
+                            column(field, table.c[field].type)
+                            for field in RESULT_FIELDS
+                        ),
+                        name="results",
+                    ).data([tuple(row.values()) for row in rows])
+                    # Колонка из одних NULL в VALUES получает тип text - приводим явно
+                    stmt = (
+                        update(RequestHistoryDB)
+                        .where(RequestHistoryDB.id == data.c.id)
+                        .values(
+                            status=data.c.status,
+                            **{
+                                field: func.coalesce(
+                                    cast(data.c[field], table.c[field].type),
+                                    table.c[field],
+                                )
+                                for field in RESULT_FIELDS
+                            },
+                        )
+                    )
+                    result = await session.execute(stmt)
+                else:
+                    stmt = (
+                        update(table)
+                        .where(table.c.id == bindparam("b_id"))
+                        .values(
+                            status=bindparam("b_status"),
+                            **{
+                                field: func.coalesce(
+                                    bindparam(f"b_{field}", type_=table.c[field].type),
+                                    table.c[field],
+                                )
+                                for field in RESULT_FIELDS
+                            },
+                        )
+                    )
+                    result = await session.execute(
+                        stmt,
+                        [
+                            {f"b_{key}": value for key, value in row.items()}
+                            for row in rows
+                        ],
+                    )
+                await self._update_rollup(
+                    session,
+                    removed=[tuple(row)[1:] for row in before.values()],
+                    added=after,
+                )
+                return result.rowcount
+
     async def get_request_by_id(
         self, request_id: int, include_details: bool = False
     ) -> Optional[RequestHistoryRead | RequestHistoryDetailRead]:
         """Get request by ID"""
         async with self.async_session_factory() as session:
-            request = await session.get(RequestHistoryDB, request_id)
+            request = await session.get(
+                RequestHistoryDB,
+                request_id,
+                options=self._load_options(include_details),
+            )
             if not request:
                 return None
 
-            if include_details:
-                await session.refresh(request, ["user", "model"])
-
             return self._map_to_read_model(request, include_details)
 
     async def get_user_requests(
-        self, user_id: int, limit: int = 100, include_details: bool = False
+        self,
+        user_id: int,
+        limit: int = 100,
+        include_details: bool = False,
+        cursor: Optional[str] = None,
     ) -> List[RequestHistoryRead | RequestHistoryDetailRead]:
-        """Get user's requests"""
+        """Get user's requests, newest first; cursor - see services.pagination"""
         async with self.async_session_factory() as session:
-            result = await session.execute(
+            stmt = (
                 select(RequestHistoryDB)
+                .options(*self._load_options(include_details))
                 .where(RequestHistoryDB.user_id == user_id)
-                .order_by(desc(RequestHistoryDB.created_at))
-                .limit(limit)
+            )
+            result = await session.execute(
+                keyset_page(stmt, RequestHistoryDB, limit, cursor)
             )
             requests = result.scalars().all()
-
-            if include_details:
-                for request in requests:
-                    await session.refresh(request, ["user", "model"])
-
             return [self._map_to_read_model(r, include_details) for r in requests]
 
     async def get_model_requests(
@@ -142,16 +360,12 @@ class RequestHistoryService:
         async with self.async_session_factory() as session:
             result = await session.execute(
                 select(RequestHistoryDB)
+                .options(*self._load_options(include_details))
                 .where(RequestHistoryDB.model_id == model_id)
                 .order_by(RequestHistoryDB.created_at)
                 .limit(limit)
             )
             requests = result.scalars().all()
-
-            if include_details:
-                for request in requests:
-                    await session.refresh(request, ["user", "model"])
-
             return [self._map_to_read_model(r, include_details) for r in requests]
 
     async def get_pending_requests(
@@ -161,54 +375,157 @@ class RequestHistoryService:
         async with self.async_session_factory() as session:
             result = await session.execute(
                 select(RequestHistoryDB)
+                .options(*self._load_options(include_details))
                 .where(RequestHistoryDB.status == "pending")
                 .order_by(RequestHistoryDB.created_at)
                 .limit(limit)
             )
             requests = result.scalars().all()
-
-            if include_details:
-                for request in requests:
-                    await session.refresh(request, ["user", "model"])
-
             return [self._map_to_read_model(r, include_details) for r in requests]
 
-    async def get_user_stats(self, user_id: int) -> Dict[str, Decimal]:
-        """Get user request statistics"""
+    async def get_user_stats(
+        self, user_id: int, exact: bool = False
+    ) -> Dict[str, Decimal]:
+        """
+        Статистика запросов пользователя.
+
+        Завершенные запросы - из RequestStatsRollupDB (несколько строк
+        на пользователя), незавершенные - COUNT по истории. exact=True
+        считает все одним GROUP BY по истории пользователя.
+        """
         async with self.async_session_factory() as session:
-            result = await session.execute(
-                select(RequestHistoryDB).where(RequestHistoryDB.user_id == user_id)
+            if exact:
+                result = await session.execute(
+                    self._stats_stmt().where(RequestHistoryDB.user_id == user_id)
+                )
+                return user_stats_from_rows(result.all())
+
+            rollup = await session.execute(
+                select(
+                    RequestStatsRollupDB.status,
+                    RequestStatsRollupDB.latency_bucket,
+                    RequestStatsRollupDB.requests,
+                    RequestStatsRollupDB.total_cost,
+                    RequestStatsRollupDB.total_execution_ms,
+                ).where(RequestStatsRollupDB.user_id == user_id)
             )
-            requests = result.scalars().all()
+            in_progress = await session.execute(
+                select(
+                    RequestHistoryDB.status,
+                    literal(NO_LATENCY_BUCKET),
+                    func.count(),
+                    literal(0),
+                    literal(0),
+                )
+                .where(
+                    RequestHistoryDB.user_id == user_id,
+                    # IN, а не NOT IN: поиск по индексу user_id + status
+                    RequestHistoryDB.status.in_(
+                        [
+                            status
+                            for status in RequestStatusDB
+                            if status not in FINAL_STATUSES
+                        ]
+                    ),
+                )
+                .group_by(RequestHistoryDB.status)
+            )
+            return user_stats_from_rows([*rollup.all(), *in_progress.all()])
 
-            stats = {
-                "total_requests": 0,
-                "completed_requests": 0,
-                "failed_requests": 0,
-                "total_cost": Decimal("0.0"),
-                "avg_execution_time": Decimal("0.0"),
-            }
+    async def rebuild_stats(self, user_id: Optional[int] = None) -> int:
+        """
+        Пересчитывает RequestStatsRollupDB по истории - для всех
+        пользователей или одного. Возвращает число строк статистики
+        """
+        clear, fill = rollup_rebuild_statements(user_id)
+        async with self.async_session_factory() as session:
+            async with session.begin():
+                await session.execute(clear)
+                result = await session.execute(fill)
+                return result.rowcount
 
-            if not requests:
-                return stats
+    def _stats_stmt(self):
+        bucket = latency_bucket_sql(RequestHistoryDB.execution_time_ms)
+        return select(
+            RequestHistoryDB.status,
+            bucket,
+            func.count(),
+            func.coalesce(func.sum(RequestHistoryDB.cost), 0),
+            func.coalesce(func.sum(RequestHistoryDB.execution_time_ms), 0),
+        ).group_by(RequestHistoryDB.status, bucket)
 
-            completed = [r for r in requests if r.status == "completed"]
-            stats["total_requests"] = len(requests)
-            stats["completed_requests"] = len(completed)
-            stats["failed_requests"] = len(requests) - len(completed)
+    def _stats_entry(self, request: RequestHistoryDB) -> StatsEntry:
+        return (
+            request.user_id,
+            RequestStatusDB(request.status),
+            request.cost,
+            request.execution_time_ms,
+        )
 
-            if completed:
-                stats["total_cost"] = sum(
-                    r.cost for r in completed if r.cost is not None
-                )
-                avg_time = sum(r.execution_time_ms or 0 for r in completed) / len(
-                    completed
-                )
-                stats["avg_execution_time"] = Decimal(str(avg_time)).quantize(
-                    Decimal("0.00")
-                )
+    async def _update_rollup(
+        self,
+        session: AsyncSession,
+        removed: Iterable[StatsEntry],
+        added: Iterable[StatsEntry],
+    ):
+        """
+        Переносит изменения статусов в RequestStatsRollupDB: прежнее
+        состояние запроса вычитается, новое прибавляется. Учитываются
+        только завершенные статусы
+        """
+        deltas = defaultdict(lambda: [0, Decimal("0.0"), 0])
+        for sign, entries in ((-1, removed), (1, added)):
+            for user_id, status, cost, execution_ms in entries:
+                if status not in FINAL_STATUSES:
+                    continue
+                delta = deltas[(user_id, status, latency_bucket(execution_ms))]
+                delta[0] += sign
+                delta[1] += sign * Decimal(cost or 0)
+                delta[2] += sign * (execution_ms or 0)
+        # Сортировка - одинаковый порядок блокировок строк в параллельных
+        # транзакциях
+        rows = [
+            {
+                "user_id": user_id,
+                "status": status,
+                "latency_bucket": bucket,
+                "requests": requests,
+                "total_cost": cost,
+                "total_execution_ms": execution_ms,
+            }
+            for (user_id, status, bucket), (requests, cost, execution_ms) in sorted(
+                deltas.items()
+            )
+            if requests or cost or execution_ms
+        ]
+        if not rows:
+            return
+        dialect = postgresql if session.bind.dialect.name == "postgresql" else sqlite
+        stmt = dialect.insert(RequestStatsRollupDB)
+        table = RequestStatsRollupDB.__table__
+        await session.execute(
+            stmt.on_conflict_do_update(
+                index_elements=["user_id", "status", "latency_bucket"],
+                set_={
+                    name: table.c[name] + stmt.excluded[name]
+                    for name in ("requests", "total_cost", "total_execution_ms")
+                },
+            ),
+            rows,
+        )
 
-            return stats
+    def _load_options(self, include_details: bool) -> tuple:
+        if include_details:
+            # Связи для DetailRead грузятся тем же запросом, что и список
+            return (
+                joinedload(RequestHistoryDB.user),
+                joinedload(RequestHistoryDB.mlmodel),
+            )
+        # Для RequestHistoryRead связи не нужны - без JOIN
+        return (
+            lazyload(RequestHistoryDB.user),
+            lazyload(RequestHistoryDB.mlmodel),
+        )
 
     def _map_to_read_model(
         self, request: RequestHistoryDB, include_details: bool = False
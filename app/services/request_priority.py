@@ -0,0 +1,37 @@
+from enum import Enum
+from typing import Iterable, Optional
+
+from db.models.request_history import RequestTypeDB
+from db.models.user_roles import Roles
+
+
+class PriorityClass(str, Enum):
+    """Класс приоритета запроса в очереди ML воркера"""
+
+    INTERACTIVE = "interactive"
+    STANDARD = "standard"
+    BULK = "bulk"
+
+
+# AMQP priority сообщения; очередь объявлена с x-max-priority
+PRIORITY_VALUES = {
+    PriorityClass.INTERACTIVE: 8,
+    PriorityClass.STANDARD: 4,
+    PriorityClass.BULK: 1,
+}
+
+
+def choose_priority_class(
+    request_type: str,
+    interactive: bool = False,
+    roles: Optional[Iterable[Roles]] = None,
+) -> PriorityClass:
+    """
+    Чат (пользователь ждет ответ на экране) идет первым,
+    боты и custom-запросы - фоновая нагрузка, остальное - посередине
+    """
+    if interactive:
+        return PriorityClass.INTERACTIVE
+    if request_type == RequestTypeDB.CUSTOM or Roles.BOT in set(roles or ()):
+        return PriorityClass.BULK
+    return PriorityClass.STANDARD
@@ -0,0 +1,119 @@
+import hashlib
+import json
+import logging
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+from redis.asyncio import Redis
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_text(text: str) -> str:
+    """Схлопывает пробелы, чтобы одинаковые вопросы давали один ключ"""
+    return " ".join(text.split())
+
+
+def make_cache_key(
+    model_id: int,
+    text: str,
+    image: Optional[bytes] = None,
+    params: Optional[Dict[str, Any]] = None,
+) -> str:
+    """Ключ по (модель, нормализованный текст, хэш картинки, параметры генерации)"""
+    key_data = {
+        "model": model_id,
+        "text": normalize_text(text),
+        "image": hashlib.sha256(image).hexdigest() if image else None,
+        "params": params or {},
+    }
+    digest = hashlib.sha256(
+        json.dumps(key_data, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    ).hexdigest()
+    return f"response:{digest}"
+
+
+class ResponseCache:
+    """
+    Кэш ответов модели для детерминированных промптов.
+
+    Два уровня: локальный LRU в процессе и общий Redis.
+    Попадание в Redis прогревает локальный уровень.
+    """
+
+    def __init__(
+        self,
+        redis_url: Optional[str],
+        ttl_seconds: int = 3600,
+        local_max_size: int = 1024,
+    ):
+        self.redis = (
+            Redis.from_url(redis_url, decode_responses=False) if redis_url else None
+        )
+        self.ttl = ttl_seconds
+        self.local_max_size = local_max_size
+        self._local: "OrderedDict[str, Tuple[float, dict]]" = OrderedDict()
+        self.local_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+
+    def _get_local(self, key: str) -> Optional[dict]:
+        item = self._local.get(key)
+        if item is None:
+            return None
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._local[key]
+            return None
+        self._local.move_to_end(key)
+        return value
+
+    def _set_local(self, key: str, value: dict):
+        self._local[key] = (time.monotonic() + self.ttl, value)
+        self._local.move_to_end(key)
+        while len(self._local) > self.local_max_size:
+            self._local.popitem(last=False)
+
+    async def get(self, key: str) -> Optional[dict]:
+        value = self._get_local(key)
+        if value is not None:
+            self.local_hits += 1
+            return value
+
+        if self.redis is not None:
+            try:
+                compressed = await self.redis.get(key)
+                if compressed:
+                    value = json.loads(zlib.decompress(compressed).decode("utf-8"))
+                    self._set_local(key, value)
+                    self.redis_hits += 1
+                    return value
+            except Exception as e:
+                logger.error(f"Redis get error: {e}")
+
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, value: dict):
+        self._set_local(key, value)
+        if self.redis is None:
+            return
+        try:
+            compressed = zlib.compress(json.dumps(value).encode("utf-8"))
+            await self.redis.setex(key, self.ttl, compressed)
+        except Exception as e:
+            # Кэш не должен ронять запрос
+            logger.error(f"Redis save error: {e}")
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "local_hits": self.local_hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+            "local_size": len(self._local),
+        }
+
+    async def close(self):
+        if self.redis is not None:
+            await self.redis.close()
@@ -0,0 +1,121 @@
+import asyncio
+import logging
+import time
+from typing import Dict, List, Optional, Tuple
+
+from schemas.request_history import RequestHistoryUpdate
+from services.request_history_service import RequestHistoryService
+
+logger = logging.getLogger(__name__)
+
+
+class ResultWriter:
+    """
+    Пакетная запись результатов воркера в requesthistorydb.
+
+    write() кладет обновление в буфер и ждет, пока его батч будет записан
+    одним запросом (RequestHistoryService.apply_results). Батч уходит
+    каждые flush_interval секунд или сразу, как наберется max_batch_size.
+    """
+
+    def __init__(
+        self,
+        request_service: RequestHistoryService,
+        flush_interval: float = 0.05,
+        max_batch_size: int = 500,
+    ):
+        self.request_service = request_service
+        self.flush_interval = flush_interval
+        self.max_batch_size = max(1, max_batch_size)
+        self._buffer: List[Tuple[int, RequestHistoryUpdate, asyncio.Future]] = []
+        self._full = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self.batches = 0
+        self.rows = 0
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        return self
+
+    async def write(self, request_id: int, update_data: RequestHistoryUpdate):
+        """Ждет, пока обновление записано в БД"""
+        future = asyncio.get_running_loop().create_future()
+        self._buffer.append((request_id, update_data, future))
+        if len(self._buffer) >= self.max_batch_size:
+            self._full.set()
+        await future
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._full.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
+
+    async def flush(self):
+        self._full.clear()
+        while self._buffer:
+            batch = self._buffer[: self.max_batch_size]
+            del self._buffer[: self.max_batch_size]
+            # Повторный ответ на ту же задачу: пишем последний
+            latest: Dict[int, RequestHistoryUpdate] = {
+                request_id: update_data for request_id, update_data, _ in batch
+            }
+            started = time.perf_counter()
+            try:
+                await self.request_service.apply_results(list(latest.items()))
+            except Exception as e:
+                logger.warning(f"Failed to write {len(latest)} results in batch: {e}")
+                errors = await self._write_rows(latest)
+            else:
+                errors = {}
+                self.batches += 1
+                self.rows += len(latest)
+                logger.debug(
+                    f"Wrote {len(latest)} results in "
+                    f"{(time.perf_counter() - started) * 1000:.1f} ms"
+                )
+            for request_id, _, future in batch:
+                if future.done():
+                    continue
+                if request_id in errors:
+                    future.set_exception(errors[request_id])
+                else:
+                    future.set_result(None)
+
+    async def _write_rows(
+        self, updates: Dict[int, RequestHistoryUpdate]
+    ) -> Dict[int, Exception]:
+        """
+        Запись батча по одной строке после ошибки пакета: временный сбой
+        или конфликт блокировки на одной строке не теряет остальные
+        """
+        errors: Dict[int, Exception] = {}
+        for request_id, update_data in updates.items():
+            try:
+                await self.request_service.apply_results([(request_id, update_data)])
+            except Exception as e:
+                logger.error(f"Failed to write result {request_id}: {e}")
+                errors[request_id] = e
+            else:
+                self.rows += 1
+        return errors
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "batches": self.batches,
+            "rows": self.rows,
+            "buffered": len(self._buffer),
+        }
+
+    async def stop(self):
+        """Останавливает фоновую запись, дописав то, что уже в буфере"""
+        self._stopping = True
+        self._full.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+        await self.flush()
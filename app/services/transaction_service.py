@@ -1,8 +1,8 @@
 from decimal import Decimal
 from typing import List, Optional
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import selectinload
-from sqlalchemy import desc, select
+from sqlalchemy.orm import joinedload, lazyload, selectinload
+from sqlalchemy import desc, select, update
 from db.models.transaction import TransactionDB
 from db.models.user import UserDB
 from schemas.transaction import (
@@ -11,6 +11,7 @@ from schemas.transaction import (
     TransactionDetailRead,
     TransactionUpdate,
 )
+from services.pagination import keyset_page
 
 
 from sqlalchemy.ext.asyncio import async_sessionmaker
@@ -29,8 +30,7 @@ class TransactionService:
             try:
                 async with session.begin():
                     # Проверка существования пользователя
-                    user = await session.get(UserDB, transaction_data.user_id)
-                    if not user:
+                    if not await self._user_exists(session, transaction_data.user_id):
                         raise ValueError("User not found")
 
                     # Создание транзакции
@@ -76,32 +76,34 @@ class TransactionService:
     ) -> Optional[TransactionRead | TransactionDetailRead]:
         """Получение транзакции по ID"""
         async with self.async_session_factory() as session:
-            transaction = await session.get(TransactionDB, transaction_id)
+            transaction = await session.get(
+                TransactionDB,
+                transaction_id,
+                options=self._load_options(include_details),
+            )
             if not transaction:
                 return None
 
-            if include_details:
-                await session.refresh(transaction, ["user"])
-
             return self._map_to_read_model(transaction, include_details)
 
     async def get_user_transactions(
-        self, user_id: int, limit: int = 100, include_details: bool = False
+        self,
+        user_id: int,
+        limit: int = 100,
+        include_details: bool = False,
+        cursor: Optional[str] = None,
     ) -> List[TransactionRead | TransactionDetailRead]:
-        """Получение транзакций пользователя"""
+        """Получение транзакций пользователя, новые первыми (курсор: services.pagination)"""
         async with self.async_session_factory() as session:
-            result = await session.execute(
+            stmt = (
                 select(TransactionDB)
+                .options(*self._load_options(include_details))
                 .where(TransactionDB.user_id == user_id)
-                .order_by(desc(TransactionDB.created_at))
-                .limit(limit)
+            )
+            result = await session.execute(
+                keyset_page(stmt, TransactionDB, limit, cursor)
             )
             transactions = result.scalars().all()
-
-            if include_details:
-                for transaction in transactions:
-                    await session.refresh(transaction, ["user"])
-
             return [self._map_to_read_model(t, include_details) for t in transactions]
 
     async def get_pending_transactions(
@@ -111,16 +113,12 @@ class TransactionService:
         async with self.async_session_factory() as session:
             result = await session.execute(
                 select(TransactionDB)
+                .options(*self._load_options(include_details))
                 .where(TransactionDB.status == "pending")
                 .order_by(desc(TransactionDB.created_at))
                 .limit(limit)
             )
             transactions = result.scalars().all()
-
-            if include_details:
-                for transaction in transactions:
-                    await session.refresh(transaction, ["user"])
-
             return [self._map_to_read_model(t, include_details) for t in transactions]
 
     async def process_deposit(
@@ -130,9 +128,8 @@ class TransactionService:
         async with self.async_session_factory() as session:
             try:
                 async with session.begin():
-                    # Проверка существования пользователя
-                    user = await session.get(UserDB, user_id)
-                    if not user:
+                    # Обновляем баланс одним UPDATE, заодно проверяя пользователя
+                    if not await self._change_balance(session, user_id, amount):
                         raise ValueError("User not found")
 
                     # Создаем транзакцию
@@ -146,10 +143,6 @@ class TransactionService:
                         ),
                     )
 
-                    # Обновляем баланс
-                    user = await session.get(UserDB, user_id)
-                    user.balance += amount
-
                     # Завершаем транзакцию
                     transaction.status = "completed"
                     await session.flush()
@@ -167,10 +160,13 @@ class TransactionService:
         async with self.async_session_factory() as session:
             try:
                 async with session.begin():
-                    user = await session.get(UserDB, user_id)
-
-                    # Проверка баланса
-                    if user.balance < amount:
+                    # Проверка и списание одним UPDATE: параллельные списания
+                    # не уведут баланс в минус
+                    if not await self._change_balance(
+                        session, user_id, -amount, UserDB.balance >= amount
+                    ):
+                        if not await self._user_exists(session, user_id):
+                            raise ValueError("User not found")
                         raise ValueError("Insufficient balance")
 
                     # Создаем транзакцию
@@ -184,19 +180,31 @@ class TransactionService:
                         ),
                     )
 
-                    # Обновляем баланс
-                    user.balance = user.balance - amount
-
                     # Завершаем транзакцию
                     transaction.status = "completed"
                     await session.flush()
-                    await session.refresh(transaction, ["user"])
-                    await session.refresh(user)
                     return TransactionRead.model_validate(transaction)
             except Exception:
                 await session.rollback()
                 raise
 
+    async def _user_exists(self, session: AsyncSession, user_id: int) -> bool:
+        return (
+            await session.scalar(select(UserDB.id).where(UserDB.id == user_id))
+        ) is not None
+
+    async def _change_balance(
+        self, session: AsyncSession, user_id: int, amount: Decimal, *conditions
+    ) -> bool:
+        """Атомарно меняет баланс; False, если пользователь не найден или не прошел условия"""
+        result = await session.execute(
+            update(UserDB)
+            .where(UserDB.id == user_id, *conditions)
+            .values(balance=UserDB.balance + amount)
+            .returning(UserDB.id)
+        )
+        return result.first() is not None
+
     async def _create_transaction_in_session(
         self, session: AsyncSession, transaction_data: TransactionCreate
     ) -> TransactionDB:
@@ -207,6 +215,23 @@ class TransactionService:
         await session.refresh(db_transaction)
         return db_transaction
 
+    def _load_options(self, include_details: bool) -> tuple:
+        if include_details:
+            # Связи для DetailRead грузятся вместе со списком: user - JOIN,
+            # связанные транзакции - по одному selectin-запросу на всю
+            # страницу, без их собственных связей (в TransactionRead их нет)
+            return (
+                joinedload(TransactionDB.user),
+                selectinload(TransactionDB.related_transaction).lazyload("*"),
+                selectinload(TransactionDB.child_transactions).lazyload("*"),
+            )
+        # Для TransactionRead связи не нужны
+        return (
+            lazyload(TransactionDB.user),
+            lazyload(TransactionDB.related_transaction),
+            lazyload(TransactionDB.child_transactions),
+        )
+
     def _map_to_read_model(
         self, transaction: TransactionDB, include_details: bool = False
     ) -> TransactionRead | TransactionDetailRead:
@@ -1,6 +1,6 @@
 from datetime import datetime, timezone
 from typing import List, Optional
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, joinedload, lazyload
 from sqlalchemy import desc, select
 from db.models.user_action_history import UserActionHistoryDB, ActionTypeDB
 from schemas.user_action_history import (
@@ -9,6 +9,7 @@ from schemas.user_action_history import (
     UserActionHistoryReadWithUser,
     UserActionHistoryUpdate,
 )
+from services.pagination import keyset_page
 
 from sqlalchemy.ext.asyncio import async_sessionmaker
 from sqlalchemy import desc, select
@@ -62,32 +63,32 @@ class UserActionHistoryService:
     ) -> Optional[UserActionHistoryRead | UserActionHistoryReadWithUser]:
         """Получение действия по ID"""
         async with self.async_session_factory() as session:
-            action = await session.get(UserActionHistoryDB, action_id)
+            action = await session.get(
+                UserActionHistoryDB, action_id, options=self._load_options(include_user)
+            )
             if not action:
                 return None
 
-            if include_user:
-                await session.refresh(action, ["user"])
-
             return self._map_to_read_model(action, include_user)
 
     async def get_user_actions(
-        self, user_id: int, limit: int = 100, include_user: bool = False
+        self,
+        user_id: int,
+        limit: int = 100,
+        include_user: bool = False,
+        cursor: Optional[str] = None,
     ) -> List[UserActionHistoryRead | UserActionHistoryReadWithUser]:
-        """Получение действий пользователя"""
+        """Получение действий пользователя, новые первыми (курсор: services.pagination)"""
         async with self.async_session_factory() as session:
-            result = await session.execute(
+            stmt = (
                 select(UserActionHistoryDB)
+                .options(*self._load_options(include_user))
                 .where(UserActionHistoryDB.user_id == user_id)
-                .order_by(desc(UserActionHistoryDB.created_at))
-                .limit(limit)
+            )
+            result = await session.execute(
+                keyset_page(stmt, UserActionHistoryDB, limit, cursor)
             )
             actions = result.scalars().all()
-
-            if include_user:
-                for action in actions:
-                    await session.refresh(action, ["user"])
-
             return [self._map_to_read_model(action, include_user) for action in actions]
 
     async def get_recent_actions(
@@ -98,8 +99,10 @@ class UserActionHistoryService:
     ) -> List[UserActionHistoryRead | UserActionHistoryReadWithUser]:
         """Получение последних действий"""
         async with self.async_session_factory() as session:
-            stmt = select(UserActionHistoryDB).order_by(
-                desc(UserActionHistoryDB.created_at)
+            stmt = (
+                select(UserActionHistoryDB)
+                .options(*self._load_options(include_user))
+                .order_by(desc(UserActionHistoryDB.created_at))
             )
 
             if action_type:
@@ -109,13 +112,14 @@ class UserActionHistoryService:
 
             result = await session.execute(stmt)
             actions = result.scalars().all()
-
-            if include_user:
-                for action in actions:
-                    await session.refresh(action, ["user"])
-
             return [self._map_to_read_model(action, include_user) for action in actions]
 
+    def _load_options(self, include_user: bool) -> tuple:
+        if include_user:
+            # Пользователь для ReadWithUser - тем же запросом, что и список
+            return (joinedload(UserActionHistoryDB.user),)
+        return (lazyload(UserActionHistoryDB.user),)
+
     def _map_to_read_model(
         self, action: UserActionHistoryDB, include_user: bool = False
     ) -> UserActionHistoryRead | UserActionHistoryReadWithUser:
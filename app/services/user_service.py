@@ -3,7 +3,7 @@ from decimal import Decimal
 from typing import List, Optional
 from passlib.context import CryptContext
 from jose import ExpiredSignatureError, JWTError, jwt
-from sqlalchemy import insert, select
+from sqlalchemy import insert, select, update
 from db.models.user import UserDB
 from db.models.user_action_history import UserActionHistoryDB, ActionTypeDB
 from schemas.user import (
@@ -21,6 +21,17 @@ ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 from sqlalchemy.ext.asyncio import async_sessionmaker
 
+# Колонки UserRead: проверка токена и логин читают только их, без ORM-объекта
+USER_READ_COLUMNS = (
+    UserDB.id,
+    UserDB.username,
+    UserDB.email,
+    UserDB.balance,
+    UserDB.is_active,
+    UserDB.created_at,
+    UserDB.updated_at,
+)
+
 
 class UserService:
     def __init__(self, async_session_factory: async_sessionmaker):
@@ -70,9 +81,11 @@ class UserService:
     async def authenticate_user(self, login_data: UserLogin) -> Optional[UserWithToken]:
         async with self.async_session_factory() as session:
             result = await session.execute(
-                select(UserDB).where(UserDB.username == login_data.username)
+                select(*USER_READ_COLUMNS, UserDB.password_hash).where(
+                    UserDB.username == login_data.username
+                )
             )
-            user = result.scalars().first()
+            user = result.first()
 
             if not user or not self._verify_password(
                 login_data.password, user.password_hash
@@ -111,9 +124,9 @@ class UserService:
 
             async with self.async_session_factory() as session:
                 result = await session.execute(
-                    select(UserDB).where(UserDB.id == int(user_id))
+                    select(*USER_READ_COLUMNS).where(UserDB.id == int(user_id))
                 )
-                user = result.scalars().first()
+                user = result.first()
                 return UserRead.model_validate(user) if user else None
 
         except ExpiredSignatureError:
@@ -128,14 +141,12 @@ class UserService:
 
     async def get_user_by_id(self, user_id: int) -> Optional[UserRead]:
         async with self.async_session_factory() as session:
-            result = await session.execute(select(UserDB).where(UserDB.id == user_id))
-            user = result.scalar_one_or_none()
-            if not user:
-                return None
-
-            # Явная загрузка связанных данных
-            await session.refresh(user, ["roles", "actions_history", "transactions"])
-            return UserRead.model_validate(user)
+            result = await session.execute(
+                select(*USER_READ_COLUMNS).where(UserDB.id == user_id)
+            )
+            user = result.first()
+            # UserRead без связей: история пользователю здесь не нужна
+            return UserRead.model_validate(user) if user else None
 
     async def update_user(
         self, user_id: int, update_data: UserUpdate
@@ -203,14 +214,20 @@ class UserService:
         async with self.async_session_factory() as session:
             try:
                 async with session.begin():
-                    user = await session.get(UserDB, user_id)
+                    # Один UPDATE ... RETURNING вместо загрузки пользователя
+                    result = await session.execute(
+                        update(UserDB)
+                        .where(UserDB.id == user_id)
+                        .values(
+                            balance=UserDB.balance + amount,
+                            updated_at=datetime.now(timezone.utc),
+                        )
+                        .returning(*USER_READ_COLUMNS)
+                    )
+                    user = result.first()
                     if not user:
                         return None
 
-                    user.balance += amount
-                    user.updated_at = datetime.now(timezone.utc)
-                    await session.flush()
-
                     # Логирование изменения баланса
                     await session.execute(
                         insert(UserActionHistoryDB).values(
@@ -221,7 +238,6 @@ class UserService:
                         )
                     )
 
-                    await session.refresh(user)
                     return UserRead.model_validate(user)
             except Exception:
                 await session.rollback()
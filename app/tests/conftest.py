@@ -10,6 +10,7 @@ sys.path.append(str(Path(__file__).parent.parent))
 from services.user_service import UserService
 from services.transaction_service import TransactionService
 from db.base_model import Base
+from db.migrations import migrate, schema_migrations
 
 # Настройка тестовой базы данных (используем SQLite в памяти)
 TEST_DATABASE_URL = "sqlite+aiosqlite:///:memory:"
@@ -21,7 +22,8 @@ async def engine():
     engine = create_async_engine(TEST_DATABASE_URL, echo=False)
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.drop_all)
-        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(schema_migrations.drop, checkfirst=True)
+    await migrate(engine)
     yield engine
     await engine.dispose()
 
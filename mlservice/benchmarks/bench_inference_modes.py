@@ -0,0 +1,139 @@
+"""
+Режимы инференса QwenVLModel на CPU: fp32, bf16, int8.
+
+Каждый режим грузится в отдельном процессе (чтобы пик памяти одного
+не влиял на другой) и жадно генерирует ответы на фиксированный набор
+промптов. Печатает время загрузки, токены в секунду, размер весов,
+пиковый RSS процесса и расхождение ответов с первым режимом из
+--modes: долю совпавших ответов и среднюю позицию первого
+расходящегося токена.
+
+Нужны веса модели. Запуск из каталога mlservice:
+    python -m benchmarks.bench_inference_modes --modes fp32 bf16 int8
+"""
+
+import argparse
+import multiprocessing
+import resource
+import time
+from concurrent.futures import ProcessPoolExecutor
+from statistics import mean
+from typing import Dict, List
+
+from config import config
+
+PROMPTS = [
+    "Сколько будет 17 умножить на 23?",
+    "Кратко объясни, что такое очередь сообщений.",
+    "Переведи на английский: 'Модель отвечает быстрее на CPU'.",
+    "Назови три столицы европейских государств.",
+    "Напиши функцию на Python, которая переворачивает строку.",
+    "Чем отличается процесс от потока?",
+    "Продолжи последовательность: 2, 4, 8, 16, ...",
+    "Что такое квантизация нейросети? Ответь в двух предложениях.",
+]
+
+
+def run_mode(model_name: str, mode: str, max_new_tokens: int) -> Dict:
+    """Выполняется в отдельном процессе"""
+    import torch
+
+    from core.model import QwenVLModel
+
+    started = time.perf_counter()
+    model = QwenVLModel(model_name=model_name, inference_mode=mode)
+    load_s = time.perf_counter() - started
+    tokenizer = model.processor.tokenizer
+
+    def generate(text: str) -> List[int]:
+        prompt = model.processor.apply_chat_template(
+            [{"role": "user", "content": text}],
+            tokenize=False,
+            add_generation_prompt=True,
+        )
+        inputs = model.processor(text=[prompt], return_tensors="pt")
+        inputs = inputs.to(model.model.device)
+        with torch.inference_mode():
+            output = model.model.generate(
+                **inputs, max_new_tokens=max_new_tokens, do_sample=False
+            )
+        return output[0, inputs.input_ids.shape[1] :].tolist()
+
+    # Прогрев: первые вызовы включают выбор ядер и аллокации
+    generate(PROMPTS[0])
+
+    tokens = 0
+    outputs = []
+    started = time.perf_counter()
+    for text in PROMPTS:
+        token_ids = generate(text)
+        tokens += len(token_ids)
+        outputs.append(token_ids)
+    elapsed = time.perf_counter() - started
+
+    return {
+        "mode": model.inference_mode,
+        "load_s": load_s,
+        "tokens_per_s": tokens / elapsed,
+        "weights_mb": model.memory_footprint() / 2**20,
+        # ru_maxrss в Linux - килобайты
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "outputs": outputs,
+        "texts": [tokenizer.decode(ids, skip_special_tokens=True) for ids in outputs],
+    }
+
+
+def first_divergence(a: List[int], b: List[int]) -> int:
+    for i, (x, y) in enumerate(zip(a, b)):
+        if x != y:
+            return i
+    return min(len(a), len(b))
+
+
+def drift(baseline: Dict, result: Dict) -> Dict[str, float]:
+    pairs = list(zip(baseline["outputs"], result["outputs"]))
+    return {
+        "exact": sum(a == b for a, b in pairs) / len(pairs),
+        "first_diff": mean(first_divergence(a, b) for a, b in pairs),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--model", default=config.MODEL_NAME)
+    parser.add_argument("--modes", nargs="+", default=["fp32", "bf16", "int8"])
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    parser.add_argument("--show-outputs", action="store_true")
+    args = parser.parse_args()
+
+    results = []
+    context = multiprocessing.get_context("spawn")
+    for mode in args.modes:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            results.append(
+                pool.submit(run_mode, args.model, mode, args.max_new_tokens).result()
+            )
+
+    baseline = results[0]
+    print(
+        f"{'mode':>6} {'load s':>8} {'tok/s':>8} {'speedup':>8} {'weights MB':>11} "
+        f"{'peak RSS MB':>12} {'exact':>6} {'1st diff':>9}"
+    )
+    for result in results:
+        d = drift(baseline, result)
+        print(
+            f"{result['mode']:>6} {result['load_s']:>8.1f} "
+            f"{result['tokens_per_s']:>8.2f} "
+            f"{result['tokens_per_s'] / baseline['tokens_per_s']:>7.2f}x "
+            f"{result['weights_mb']:>11.0f} {result['peak_rss_mb']:>12.0f} "
+            f"{d['exact']:>6.0%} {d['first_diff']:>9.1f}"
+        )
+    if args.show_outputs:
+        for i, text in enumerate(PROMPTS):
+            print(f"\n{text}")
+            for result in results:
+                print(f"  [{result['mode']}] {result['texts'][i]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Speculative decoding (assisted generation) против обычного generate.
+
+Загружает QwenVLModel с draft-моделью и жадно генерирует ответы на
+набор промптов двумя способами. Печатает токены в секунду, ускорение,
+долю принятых токенов draft-модели и число новых токенов на один
+проход основной модели. При жадной генерации ответы должны совпадать -
+это тоже проверяется.
+
+Доля принятых считается по прямым проходам: каждый проход основной
+модели дает один свой токен и принимает часть предложенных, каждый
+проход draft-модели предлагает один токен.
+
+Нужны веса обеих моделей. Запуск из каталога mlservice:
+    python -m benchmarks.bench_speculative --draft Qwen/Qwen2-0.5B-Instruct
+"""
+
+import argparse
+import time
+from typing import Dict, List
+
+import torch
+
+from config import config
+from core.generation import GenerationParams
+from core.model import QwenVLModel
+
+PROMPTS = [
+    "Кратко объясни, что такое очередь сообщений.",
+    "Напиши функцию на Python, которая проверяет, является ли строка палиндромом.",
+    "Перечисли плюсы и минусы микросервисной архитектуры.",
+    "Переведи на английский: 'Сервис отвечает на вопросы пользователей о балансе'.",
+    "Что делает оператор JOIN в SQL? Приведи пример.",
+    "Расскажи, как работает кэширование в Redis.",
+]
+
+
+class ForwardCounter:
+    def __init__(self, module: torch.nn.Module):
+        self.calls = 0
+        module.register_forward_hook(self._hook)
+
+    def _hook(self, *_):
+        self.calls += 1
+
+
+def run(model: QwenVLModel, params: GenerationParams, counters) -> Dict:
+    tokens = 0
+    outputs: List[List[int]] = []
+    for counter in counters:
+        counter.calls = 0
+    started = time.perf_counter()
+    for text in PROMPTS:
+        prompt = model.processor.apply_chat_template(
+            [{"role": "user", "content": text}],
+            tokenize=False,
+            add_generation_prompt=True,
+        )
+        inputs = model.processor(text=[prompt], return_tensors="pt")
+        inputs = inputs.to(model.model.device)
+        with torch.inference_mode():
+            output = model.model.generate(**inputs, **model._generate_kwargs(params))
+        new_ids = output[0, inputs.input_ids.shape[1] :].tolist()
+        tokens += len(new_ids)
+        outputs.append(new_ids)
+    elapsed = time.perf_counter() - started
+    return {
+        "tokens": tokens,
+        "tokens_per_s": tokens / elapsed,
+        "outputs": outputs,
+        "target_calls": counters[0].calls,
+        "draft_calls": counters[1].calls,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--model", default=config.MODEL_NAME)
+    parser.add_argument(
+        "--draft", default=config.DRAFT_MODEL_NAME or "Qwen/Qwen2-0.5B-Instruct"
+    )
+    parser.add_argument("--mode", default=config.INFERENCE_MODE)
+    parser.add_argument("--num-assistant-tokens", type=int, default=5)
+    parser.add_argument("--max-new-tokens", type=int, default=128)
+    args = parser.parse_args()
+
+    model = QwenVLModel(
+        model_name=args.model,
+        inference_mode=args.mode,
+        draft_model_name=args.draft,
+        num_assistant_tokens=args.num_assistant_tokens,
+    )
+    if model.draft_model is None:
+        raise SystemExit("Draft model is not compatible with the target model")
+    counters = [ForwardCounter(model.model), ForwardCounter(model.draft_model)]
+
+    plain = GenerationParams(max_new_tokens=args.max_new_tokens, temperature=0)
+    assisted = GenerationParams(
+        max_new_tokens=args.max_new_tokens, temperature=0, assisted=True
+    )
+    # Прогрев обеих моделей
+    run(model, assisted, counters)
+
+    baseline = run(model, plain, counters)
+    result = run(model, assisted, counters)
+
+    # Каждый проход основной модели дает один свой токен, остальное - принятые
+    accepted = result["tokens"] - result["target_calls"]
+    print(f"{'mode':>9} {'tok/s':>8} {'speedup':>8} {'accept':>7} {'tok/step':>9}")
+    print(
+        f"{'plain':>9} {baseline['tokens_per_s']:>8.2f} {1:>7.2f}x {'-':>7} {1:>9.2f}"
+    )
+    print(
+        f"{'assisted':>9} {result['tokens_per_s']:>8.2f} "
+        f"{result['tokens_per_s'] / baseline['tokens_per_s']:>7.2f}x "
+        f"{accepted / max(1, result['draft_calls']):>7.0%} "
+        f"{result['tokens'] / max(1, result['target_calls']):>9.2f}"
+    )
+    same = sum(a == b for a, b in zip(baseline["outputs"], result["outputs"]))
+    print(f"identical outputs: {same}/{len(PROMPTS)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Холодный старт воркера: загрузка модели через from_pretrained из кэша Hub
+против локального safetensors-снапшота.
+
+Каждый замер - новый процесс: загрузка модели, процессора и прогрев
+(self_check), как в create_ml_service. Печатает фазы загрузки, время
+до готовности и пиковый RSS. Первый прогон со снапшотом его собирает,
+он показан отдельно (build). Для честного сравнения холодного чтения
+с диска сбросьте page cache между прогонами (--drop-caches, нужен root).
+
+Нужны веса модели. Запуск из каталога mlservice:
+    python -m benchmarks.bench_startup --snapshot-dir /tmp/qwen-snapshot
+"""
+
+import argparse
+import multiprocessing
+import resource
+import shutil
+import subprocess
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional
+
+from config import config
+
+PHASES = ("processor", "weights", "snapshot_save", "quantize", "warmup")
+
+
+def cold_start(
+    model_name: str, mode: str, snapshot_dir: Optional[str], warmup_tokens: int
+) -> Dict:
+    """Выполняется в отдельном процессе"""
+    started = time.perf_counter()
+    from core.model import QwenVLModel
+
+    imports_s = time.perf_counter() - started
+    model = QwenVLModel(
+        model_name=model_name, inference_mode=mode, snapshot_dir=snapshot_dir
+    )
+    warmup_started = time.perf_counter()
+    model.self_check(warmup_tokens)
+    model.load_timings["warmup"] = time.perf_counter() - warmup_started
+    return {
+        "imports": imports_s,
+        **model.load_timings,
+        "total": time.perf_counter() - started,
+        # ru_maxrss в Linux - килобайты
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def drop_caches():
+    subprocess.run(["sync"], check=True)
+    with open("/proc/sys/vm/drop_caches", "w") as f:
+        f.write("3\n")
+
+
+def run(label: str, args, snapshot_dir: Optional[str]):
+    if args.drop_caches:
+        drop_caches()
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+        result = pool.submit(
+            cold_start, args.model, args.mode, snapshot_dir, args.warmup_tokens
+        ).result()
+    print(
+        f"{label:>9} "
+        + " ".join(f"{result.get(phase, 0):>13.1f}" for phase in PHASES)
+        + f" {result['total']:>8.1f} {result['peak_rss_mb']:>12.0f}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--model", default=config.MODEL_NAME)
+    parser.add_argument("--mode", default=config.INFERENCE_MODE)
+    parser.add_argument("--snapshot-dir", default="/tmp/ml-model-snapshot")
+    parser.add_argument("--warmup-tokens", type=int, default=16)
+    parser.add_argument("--drop-caches", action="store_true")
+    args = parser.parse_args()
+
+    shutil.rmtree(args.snapshot_dir, ignore_errors=True)
+    print(
+        f"{'start':>9} "
+        + " ".join(f"{phase + ' s':>13}" for phase in PHASES)
+        + f" {'total s':>8} {'peak RSS MB':>12}"
+    )
+    run("hub", args, None)
+    run("build", args, args.snapshot_dir)
+    run("snapshot", args, args.snapshot_dir)
+
+
+if __name__ == "__main__":
+    main()
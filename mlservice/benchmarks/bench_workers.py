@@ -0,0 +1,182 @@
+"""
+Пропускная способность ML воркеров в зависимости от числа процессов.
+
+Для каждого n от 1 до --max-workers запускает `python main.py`
+с WORKER_PROCESSES=n, подает --requests запросов с --concurrency
+одновременными RPC через RabbitMQ и печатает req/s, p50/p99 задержки
+и ускорение относительно одного воркера. После замера воркеры
+останавливаются SIGTERM (с drain).
+
+Нужны запущенный RabbitMQ и веса модели. Запуск из каталога mlservice:
+    python -m benchmarks.bench_workers --max-workers 4
+С --attach замеряет уже запущенных воркеров, ничего не запуская.
+"""
+
+import argparse
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+import time
+import uuid
+from pathlib import Path
+from statistics import median
+from typing import Dict, List
+
+import aio_pika
+
+from config import config
+from core.message_codec import (
+    ACCEPT_HEADER,
+    MSGPACK_CONTENT_TYPE,
+    SUPPORTED_CONTENT_TYPES,
+    decode,
+    encode,
+)
+
+SERVICE_DIR = Path(__file__).resolve().parent.parent
+
+
+class RpcClient:
+    def __init__(self, rabbitmq_url: str, queue_name: str):
+        self.rabbitmq_url = rabbitmq_url
+        self.queue_name = queue_name
+        self._pending: Dict[str, asyncio.Future] = {}
+
+    async def connect(self):
+        self.connection = await aio_pika.connect_robust(self.rabbitmq_url)
+        self.channel = await self.connection.channel()
+        await self.channel.declare_queue(
+            self.queue_name,
+            durable=True,
+            arguments={"x-max-priority": config.ML_QUEUE_MAX_PRIORITY},
+        )
+        self.callback_queue = await self.channel.declare_queue(exclusive=True)
+        await self.callback_queue.consume(self._on_response, no_ack=True)
+        return self
+
+    async def _on_response(self, message):
+        future = self._pending.pop(message.correlation_id, None)
+        if future is not None and not future.done():
+            future.set_result(decode(message.body, message.content_type))
+
+    async def call(self, text: str, timeout: float) -> dict:
+        correlation_id = str(uuid.uuid4())
+        future = asyncio.get_running_loop().create_future()
+        self._pending[correlation_id] = future
+        await self.channel.default_exchange.publish(
+            aio_pika.Message(
+                body=encode({"text": text}),
+                content_type=MSGPACK_CONTENT_TYPE,
+                headers={ACCEPT_HEADER: ", ".join(SUPPORTED_CONTENT_TYPES)},
+                reply_to=self.callback_queue.name,
+                correlation_id=correlation_id,
+            ),
+            routing_key=self.queue_name,
+        )
+        try:
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self._pending.pop(correlation_id, None)
+
+    async def close(self):
+        await self.connection.close()
+
+
+def _percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+async def run_load(client: RpcClient, args) -> dict:
+    latencies: List[float] = []
+    failures = 0
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def one(i: int):
+        nonlocal failures
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                # Разные тексты, чтобы не мерить кэш ответов
+                response = await client.call(f"{args.text} ({i})", args.timeout)
+                if not response.get("success"):
+                    failures += 1
+            except asyncio.TimeoutError:
+                failures += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(args.requests)))
+    elapsed = time.perf_counter() - started
+    return {
+        "throughput": args.requests / elapsed,
+        "p50_ms": median(latencies) * 1000,
+        "p99_ms": _percentile(latencies, 0.99) * 1000,
+        "failures": failures,
+    }
+
+
+async def wait_ready(client: RpcClient, processes: int, timeout: float):
+    """Процессы сначала грузят модель: ждем, пока воркеры начнут отвечать"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            await asyncio.gather(
+                *(client.call("ping", timeout=30) for _ in range(processes * 2))
+            )
+            return
+        except asyncio.TimeoutError:
+            continue
+    raise TimeoutError(f"Workers not ready after {timeout}s")
+
+
+async def bench(processes: int, args) -> dict:
+    worker = None
+    if not args.attach:
+        worker = subprocess.Popen(
+            [sys.executable, "main.py"],
+            cwd=SERVICE_DIR,
+            env={**os.environ, "WORKER_PROCESSES": str(processes)},
+        )
+    client = await RpcClient(config.RABBITMQ_URL, config.ML_QUEUE).connect()
+    try:
+        await wait_ready(client, processes, args.startup_timeout)
+        return await run_load(client, args)
+    finally:
+        await client.close()
+        if worker is not None:
+            worker.send_signal(signal.SIGTERM)
+            worker.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--max-workers", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--startup-timeout", type=float, default=600)
+    parser.add_argument("--text", default="Кратко расскажи о RabbitMQ")
+    parser.add_argument("--attach", action="store_true")
+    args = parser.parse_args()
+
+    counts = [1] if args.attach else range(1, args.max_workers + 1)
+    print(
+        f"{'workers':>8} {'req/s':>8} {'speedup':>8} {'p50 ms':>9} "
+        f"{'p99 ms':>9} {'failed':>7}"
+    )
+    baseline = None
+    for processes in counts:
+        result = asyncio.run(bench(processes, args))
+        baseline = baseline or result["throughput"]
+        print(
+            f"{processes:>8} {result['throughput']:>8.2f} "
+            f"{result['throughput'] / baseline:>7.2f}x {result['p50_ms']:>9.0f} "
+            f"{result['p99_ms']:>9.0f} {result['failures']:>7}"
+        )
+
+
+if __name__ == "__main__":
+    main()
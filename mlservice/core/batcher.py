@@ -0,0 +1,226 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Deque, Dict, List, Optional, Set
+
+from core.executor import InferenceExecutor
+from core.generation import DEFAULT_GENERATION, GenerationParams
+from core.model import QwenVLModel
+
+logger = logging.getLogger(__name__)
+
+
+class DeadlineExceededError(TimeoutError):
+    """Дедлайн запроса истек, пока он ждал своего батча"""
+
+
+@dataclass
+class _PendingRequest:
+    text: str
+    future: asyncio.Future
+    enqueued_at: float = field(default_factory=time.perf_counter)
+    # Unix-время из заголовка x-deadline
+    deadline: Optional[float] = None
+    params: GenerationParams = DEFAULT_GENERATION
+
+    def expired(self, now: float) -> bool:
+        return self.deadline is not None and self.deadline < now
+
+
+class BatchMetrics:
+    """Метрики батчей: размер, время генерации и ожидания в окне"""
+
+    def __init__(self, window: int = 1000):
+        self.batches = 0
+        self.requests = 0
+        self._sizes: Deque[int] = deque(maxlen=window)
+        self._latencies_ms: Deque[float] = deque(maxlen=window)
+        self._waits_ms: Deque[float] = deque(maxlen=window)
+
+    def record(self, size: int, latency_ms: float, max_wait_ms: float):
+        self.batches += 1
+        self.requests += size
+        self._sizes.append(size)
+        self._latencies_ms.append(latency_ms)
+        self._waits_ms.append(max_wait_ms)
+
+    @staticmethod
+    def _percentile(values: List[float], q: float) -> float:
+        if not values:
+            return 0.0
+        ordered = sorted(values)
+        index = min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))
+        return ordered[index]
+
+    def snapshot(self) -> Dict[str, float]:
+        sizes = list(self._sizes)
+        latencies = list(self._latencies_ms)
+        waits = list(self._waits_ms)
+        return {
+            "batches": self.batches,
+            "requests": self.requests,
+            "avg_batch_size": sum(sizes) / len(sizes) if sizes else 0.0,
+            "latency_p50_ms": self._percentile(latencies, 0.5),
+            "latency_p99_ms": self._percentile(latencies, 0.99),
+            "wait_p50_ms": self._percentile(waits, 0.5),
+            "wait_p99_ms": self._percentile(waits, 0.99),
+        }
+
+
+class BatchScheduler:
+    """
+    Собирает запросы в батчи между очередью и моделью.
+
+    Батч уходит в generate, когда набрано max_batch_size запросов
+    или с момента первого запроса прошло max_wait_ms. Сама генерация
+    выполняется в InferenceExecutor, чтобы не блокировать event loop.
+
+    В батч попадают запросы с одинаковыми параметрами генерации
+    (GenerationParams.batch_key); остальные откладываются и открывают
+    следующий батч в порядке поступления.
+    """
+
+    def __init__(
+        self,
+        model: QwenVLModel,
+        executor: InferenceExecutor,
+        max_batch_size: int = 8,
+        max_wait_ms: float = 20,
+    ):
+        self.model = model
+        self.executor = executor
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000
+        self.metrics = BatchMetrics()
+        self._queue: "asyncio.Queue[_PendingRequest]" = asyncio.Queue()
+        # Запросы, не подошедшие по параметрам к предыдущему батчу
+        self._held: Deque[_PendingRequest] = deque()
+        self._task: Optional[asyncio.Task] = None
+        # Одновременно в работе не больше батчей, чем потоков в пуле
+        self._slots = asyncio.Semaphore(executor.max_workers)
+        self._in_progress: Set[asyncio.Task] = set()
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            logger.info(
+                f"Batch scheduler started: max_batch_size={self.max_batch_size}, "
+                f"max_wait_ms={self.max_wait * 1000:.0f}"
+            )
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # Дожидаемся батчей, которые уже генерируются
+        if self._in_progress:
+            await asyncio.gather(*self._in_progress, return_exceptions=True)
+
+    async def submit(
+        self,
+        text: str,
+        deadline: Optional[float] = None,
+        params: GenerationParams = DEFAULT_GENERATION,
+    ) -> str:
+        """Ставит запрос в очередь и ждет его результат из батча"""
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put(
+            _PendingRequest(text=text, future=future, deadline=deadline, params=params)
+        )
+        return await future
+
+    def _drop_expired(self, batch: List[_PendingRequest]) -> List[_PendingRequest]:
+        """Запросы, чьи вызывающие уже отвалились, не тратят CPU"""
+        now = time.time()
+        alive = []
+        for pending in batch:
+            if pending.future.done():
+                continue
+            if pending.expired(now):
+                pending.future.set_exception(
+                    DeadlineExceededError("Deadline exceeded before generation")
+                )
+                continue
+            alive.append(pending)
+        return alive
+
+    async def _collect_batch(self) -> List[_PendingRequest]:
+        loop = asyncio.get_running_loop()
+        batch = [self._held.popleft() if self._held else await self._queue.get()]
+        key = batch[0].params.batch_key()
+        # Assisted generation идет по одному запросу
+        limit = 1 if key.assisted else self.max_batch_size
+
+        # Сначала отложенные раньше запросы с теми же параметрами
+        held: Deque[_PendingRequest] = deque()
+        for pending in self._held:
+            if len(batch) < limit and pending.params.batch_key() == key:
+                batch.append(pending)
+            else:
+                held.append(pending)
+        self._held = held
+
+        deadline = loop.time() + self.max_wait
+        while len(batch) < limit:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                pending = await asyncio.wait_for(self._queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            if pending.params.batch_key() == key:
+                batch.append(pending)
+            else:
+                self._held.append(pending)
+        return batch
+
+    async def _run(self):
+        while True:
+            # Пока все потоки заняты, сообщения копятся и следующий батч будет полнее
+            await self._slots.acquire()
+            batch = self._drop_expired(await self._collect_batch())
+            if not batch:
+                self._slots.release()
+                continue
+            task = asyncio.create_task(self._process(batch))
+            self._in_progress.add(task)
+            task.add_done_callback(self._in_progress.discard)
+
+    async def _process(self, batch: List[_PendingRequest]):
+        try:
+            await self._generate(batch)
+        finally:
+            self._slots.release()
+
+    async def _generate(self, batch: List[_PendingRequest]):
+        started = time.perf_counter()
+        max_wait_ms = (started - min(p.enqueued_at for p in batch)) * 1000
+        try:
+            outputs = await self.executor.submit(
+                self.model.generate_batch,
+                [p.text for p in batch],
+                [p.params for p in batch],
+            )
+        except Exception as e:
+            logger.error(f"Batch generation failed: {e}", exc_info=True)
+            for pending in batch:
+                if not pending.future.done():
+                    pending.future.set_exception(e)
+        else:
+            for pending, output in zip(batch, outputs):
+                if not pending.future.done():
+                    pending.future.set_result(output)
+        finally:
+            latency_ms = (time.perf_counter() - started) * 1000
+            self.metrics.record(len(batch), latency_ms, max_wait_ms)
+            logger.info(
+                f"Batch processed: size={len(batch)}, latency_ms={latency_ms:.1f}, "
+                f"max_wait_ms={max_wait_ms:.1f}"
+            )
@@ -0,0 +1,90 @@
+import asyncio
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Dict, Optional
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+
+def available_cpus() -> int:
+    """Число ядер, доступных процессу (с учетом affinity контейнера)"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+class InferenceExecutor:
+    """
+    Выделенный пул потоков для model.generate.
+
+    Генерация блокирует поток на секунды, поэтому выполняется здесь,
+    а event loop остается свободен для приема, ack и публикации ответов.
+    Потоки torch делятся между воркерами пула поровну.
+    """
+
+    def __init__(self, max_workers: int = 1, torch_threads: Optional[int] = None):
+        self.max_workers = max(1, max_workers)
+        self.torch_threads = torch_threads or max(
+            1, available_cpus() // self.max_workers
+        )
+        torch.set_num_threads(self.torch_threads)
+
+        self._pool = ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="inference"
+        )
+        self._lock = threading.Lock()
+        self._submitted = 0
+        self._in_flight = 0
+        self._completed = 0
+        logger.info(
+            f"Inference executor started: workers={self.max_workers}, "
+            f"torch_threads={self.torch_threads}"
+        )
+
+    @property
+    def in_flight(self) -> int:
+        """Задачи, которые выполняются прямо сейчас"""
+        return self._in_flight
+
+    @property
+    def queue_depth(self) -> int:
+        """Задачи, которые ждут свободного потока"""
+        with self._lock:
+            return self._submitted - self._completed - self._in_flight
+
+    def _run(self, fn: Callable[..., Any]) -> Any:
+        with self._lock:
+            self._in_flight += 1
+        try:
+            return fn()
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+                self._completed += 1
+
+    async def submit(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Выполняет fn(*args, **kwargs) в пуле и возвращает результат"""
+        with self._lock:
+            self._submitted += 1
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._pool, self._run, partial(fn, *args, **kwargs)
+        )
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "workers": self.max_workers,
+            "torch_threads": self.torch_threads,
+            "queue_depth": self.queue_depth,
+            "in_flight": self.in_flight,
+            "completed": self._completed,
+        }
+
+    def shutdown(self, wait: bool = True):
+        self._pool.shutdown(wait=wait)
@@ -0,0 +1,135 @@
+import logging
+from dataclasses import dataclass, field, replace
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_NEW_TOKENS = 128
+# Потолок на случай ошибки в настройках модели
+MAX_NEW_TOKENS_LIMIT = 2048
+
+
+@dataclass(frozen=True)
+class GenerationParams:
+    """
+    Параметры генерации из настроек модели (MLModelSettingsDB).
+    None - значение из generation_config самой модели.
+    """
+
+    max_new_tokens: int = DEFAULT_MAX_NEW_TOKENS
+    # 0 - жадная генерация
+    temperature: Optional[float] = None
+    top_p: Optional[float] = None
+    # Генерация останавливается на первой из строк, сама строка в ответ не входит
+    stop: Tuple[str, ...] = field(default_factory=tuple)
+    # Ранняя остановка по времени, секунды
+    max_time: Optional[float] = None
+    # Speculative decoding с draft-моделью воркера
+    assisted: bool = False
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict[str, Any]]) -> "GenerationParams":
+        """Из поля generation сообщения; неверные значения заменяются умолчаниями"""
+        if not data:
+            return DEFAULT_GENERATION
+        parsers = {
+            "max_new_tokens": lambda v: min(max(1, int(v)), MAX_NEW_TOKENS_LIMIT),
+            "temperature": lambda v: max(0.0, float(v)),
+            "top_p": lambda v: min(max(float(v), 0.01), 1.0),
+            "stop": lambda v: tuple(
+                str(s) for s in ([v] if isinstance(v, str) else v) if s
+            ),
+            "max_time": lambda v: float(v) if float(v) > 0 else None,
+            "assisted": lambda v: v in (True, 1, "true", "1"),
+        }
+        params = {}
+        for name, parse in parsers.items():
+            if data.get(name) is None:
+                continue
+            try:
+                params[name] = parse(data[name])
+            except (TypeError, ValueError) as e:
+                logger.warning(f"Invalid generation param {name}={data[name]!r}: {e}")
+        return cls(**params)
+
+    @property
+    def sampling(self) -> bool:
+        return self.temperature is not None and self.temperature > 0
+
+    def batch_key(self) -> "GenerationParams":
+        """
+        Запросы с одинаковым ключом идут одним generate. max_new_tokens
+        в ключ не входит: батч генерирует по максимуму, а каждая строка
+        обрезается до своего лимита
+        """
+        return replace(self, max_new_tokens=0)
+
+    def generate_kwargs(self, tokenizer, max_new_tokens: Optional[int] = None):
+        kwargs: Dict[str, Any] = {
+            "max_new_tokens": max_new_tokens or self.max_new_tokens
+        }
+        if self.temperature is not None:
+            kwargs["do_sample"] = self.sampling
+            if self.sampling:
+                kwargs["temperature"] = self.temperature
+        if self.top_p is not None and self.sampling:
+            kwargs["top_p"] = self.top_p
+        if self.stop:
+            # Для stop_strings generate нужен токенизатор
+            kwargs["stop_strings"] = list(self.stop)
+            kwargs["tokenizer"] = tokenizer
+        if self.max_time is not None:
+            kwargs["max_time"] = self.max_time
+        return kwargs
+
+    def apply_stop(self, text: str) -> str:
+        """Обрезает текст по самому раннему вхождению стоп-строки"""
+        found = [text.find(stop) for stop in self.stop if stop in text]
+        return text[: min(found)] if found else text
+
+
+class StreamStopFilter:
+    """
+    apply_stop для потоковой выдачи. Хвост текста короче самой длинной
+    стоп-строки придерживается, пока не ясно, не начало ли это
+    стоп-строки: иначе клиент получил бы ее раньше, чем ответ обрежется
+    """
+
+    def __init__(self, stop: Tuple[str, ...]):
+        self.stop = stop
+        self._hold = max((len(s) for s in stop), default=1) - 1
+        self._text = ""
+        self._sent = 0
+        self.stopped = False
+
+    def feed(self, chunk: str) -> str:
+        """Часть текста, которую уже можно отправить клиенту"""
+        if self.stopped:
+            return ""
+        self._text += chunk
+        return self._advance(len(self._text) - self._hold)
+
+    def flush(self) -> str:
+        """Придержанный хвост в конце генерации"""
+        if self.stopped:
+            return ""
+        return self._advance(len(self._text))
+
+    def _advance(self, safe: int) -> str:
+        # Стоп-строка, начатая раньше safe, уже видна целиком. Найденная
+        # дальше окончательна, только если раньше нее не может начаться
+        # более длинная - apply_stop режет по самому раннему вхождению
+        found = [
+            index
+            for index in (self._text.find(stop, self._sent) for stop in self.stop)
+            if index != -1
+        ]
+        end = max(self._sent, safe)
+        if found and min(found) <= end:
+            self.stopped = True
+            end = min(found)
+        ready, self._sent = self._text[self._sent : end], end
+        return ready
+
+
+DEFAULT_GENERATION = GenerationParams()
@@ -0,0 +1,84 @@
+import asyncio
+import base64
+import binascii
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from typing import Union
+
+from PIL import Image
+from transformers import BatchFeature
+
+from core.model import QwenVLModel
+
+logger = logging.getLogger(__name__)
+
+
+class ImageTooLargeError(ValueError):
+    """Картинка больше допустимого числа пикселей после декодирования"""
+
+
+class ImagePreprocessor:
+    """
+    Декодирование, ресайз и vision-препроцессинг картинок.
+
+    Работает в своем пуле потоков, отдельном от генерации: пока модель
+    генерирует, следующие картинки уже готовятся, и CPU-работа PIL
+    не встает в очередь к generate.
+    """
+
+    def __init__(
+        self,
+        model: QwenVLModel,
+        max_workers: int = 2,
+        max_decoded_pixels: int = 4096 * 4096,
+        max_pixels: int = 1280 * 28 * 28,
+    ):
+        self.model = model
+        self.max_decoded_pixels = max_decoded_pixels
+        self.max_pixels = max_pixels
+        self._pool = ThreadPoolExecutor(
+            max_workers=max(1, max_workers), thread_name_prefix="preprocess"
+        )
+
+    def decode(self, image_data: Union[str, bytes]) -> Image.Image:
+        """
+        base64-строка или сырые байты -> RGB картинка. Битые данные -
+        ValueError: повтор даст ту же ошибку, запрос сразу получает отказ
+        """
+        if isinstance(image_data, str):
+            try:
+                image_data = base64.b64decode(image_data, validate=True)
+            except binascii.Error as e:
+                raise ValueError(f"Invalid base64 image: {e}") from e
+
+        try:
+            image = Image.open(BytesIO(image_data))
+        except Image.DecompressionBombError as e:
+            raise ImageTooLargeError(str(e)) from e
+        except OSError as e:
+            # UnidentifiedImageError - не картинка или неизвестный формат
+            raise ValueError(f"Invalid image: {e}") from e
+        # Размер известен из заголовка, до распаковки пикселей
+        width, height = image.size
+        if width * height > self.max_decoded_pixels:
+            raise ImageTooLargeError(
+                f"Image {width}x{height} exceeds {self.max_decoded_pixels} pixels"
+            )
+        try:
+            return image.convert("RGB")
+        except OSError as e:
+            # Заголовок читается, а данные обрезаны
+            raise ValueError(f"Invalid image: {e}") from e
+
+    def _prepare(self, text: str, image_data: Union[str, bytes]) -> BatchFeature:
+        image = self.decode(image_data)
+        return self.model.prepare_image_inputs(text, image, self.max_pixels)
+
+    async def prepare(self, text: str, image_data: Union[str, bytes]) -> BatchFeature:
+        """Готовит входы модели для запроса с картинкой"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._pool, self._prepare, text, image_data)
+
+    def shutdown(self, wait: bool = True):
+        self._pool.shutdown(wait=wait)
@@ -0,0 +1,110 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+
+def cache_nbytes(past_key_values: Any) -> int:
+    """Размер KV-кэша в байтах (DynamicCache или tuple тензоров)"""
+    layers = getattr(past_key_values, "key_cache", None)
+    if layers is not None:
+        tensors = list(layers) + list(past_key_values.value_cache)
+    else:
+        tensors = [t for layer in past_key_values for t in layer]
+    return sum(t.element_size() * t.numel() for t in tensors)
+
+
+def common_prefix_length(a: torch.Tensor, b: torch.Tensor) -> int:
+    """Длина общего префикса двух одномерных последовательностей токенов"""
+    length = min(a.shape[0], b.shape[0])
+    if length == 0:
+        return 0
+    mismatch = (a[:length] != b[:length]).nonzero()
+    return int(mismatch[0]) if mismatch.numel() else length
+
+
+@dataclass
+class KVCacheEntry:
+    # Токены, для которых посчитан past_key_values
+    token_ids: torch.Tensor
+    past_key_values: Any
+    # Текстовая история диалога на момент сохранения
+    messages: List[dict]
+    nbytes: int = 0
+    expires_at: float = field(default=0.0)
+
+
+class SessionKVCache:
+    """
+    LRU-кэш KV-состояний по session_id с бюджетом по байтам и TTL.
+
+    take() извлекает запись из кэша: пока идет генерация, кэш сессии
+    меняется на месте и не должен быть доступен другим запросам.
+    После генерации запись возвращается через put().
+    """
+
+    def __init__(self, max_bytes: int, ttl_seconds: float):
+        self.max_bytes = max_bytes
+        self.ttl = ttl_seconds
+        self._entries: "OrderedDict[str, KVCacheEntry]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def take(self, session_id: str) -> Optional[KVCacheEntry]:
+        with self._lock:
+            entry = self._entries.pop(session_id, None)
+            if entry is not None:
+                self._bytes -= entry.nbytes
+                if entry.expires_at < time.monotonic():
+                    entry = None
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return entry
+
+    def put(self, session_id: str, entry: KVCacheEntry):
+        entry.nbytes = cache_nbytes(entry.past_key_values)
+        if entry.nbytes > self.max_bytes:
+            logger.info(
+                f"KV cache for session {session_id} exceeds budget "
+                f"({entry.nbytes} > {self.max_bytes} bytes), not cached"
+            )
+            return
+        entry.expires_at = time.monotonic() + self.ttl
+
+        with self._lock:
+            previous = self._entries.pop(session_id, None)
+            if previous is not None:
+                self._bytes -= previous.nbytes
+            self._entries[session_id] = entry
+            self._bytes += entry.nbytes
+            self._evict()
+
+    def _evict(self):
+        now = time.monotonic()
+        for session_id in [s for s, e in self._entries.items() if e.expires_at < now]:
+            self._bytes -= self._entries.pop(session_id).nbytes
+            self.evictions += 1
+        while self._bytes > self.max_bytes and self._entries:
+            _, entry = self._entries.popitem(last=False)
+            self._bytes -= entry.nbytes
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "sessions": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,48 @@
+import base64
+import json
+from typing import Any, Dict, Optional
+import msgpack
+
+# Форматы тела AMQP сообщения. msgpack передает картинку сырыми байтами,
+# JSON оставлен для совместимости: в нем картинка идет base64-строкой
+JSON_CONTENT_TYPE = "application/json"
+MSGPACK_CONTENT_TYPE = "application/x-msgpack"
+SUPPORTED_CONTENT_TYPES = (MSGPACK_CONTENT_TYPE, JSON_CONTENT_TYPE)
+
+# Заголовок, в котором отправитель перечисляет форматы, понятные ему в ответе
+ACCEPT_HEADER = "x-accept"
+
+# Unix-время, после которого ответ отправителю уже не нужен
+DEADLINE_HEADER = "x-deadline"
+# Unix-время публикации и класс приоритета - для метрик ожидания в очереди
+ENQUEUED_AT_HEADER = "x-enqueued-at"
+PRIORITY_CLASS_HEADER = "x-priority-class"
+
+
+def encode(payload: Dict[str, Any], content_type: str = MSGPACK_CONTENT_TYPE) -> bytes:
+    """Сериализует сообщение; бинарное поле image в JSON уходит как image_base64"""
+    if content_type == MSGPACK_CONTENT_TYPE:
+        return msgpack.packb(payload, use_bin_type=True)
+
+    image = payload.get("image")
+    if isinstance(image, (bytes, bytearray)):
+        payload = {k: v for k, v in payload.items() if k != "image"}
+        payload["image_base64"] = base64.b64encode(image).decode()
+    return json.dumps(payload).encode()
+
+
+def decode(body: bytes, content_type: Optional[str] = None) -> Dict[str, Any]:
+    """Сообщение без content_type считается JSON (старые отправители)"""
+    if content_type == MSGPACK_CONTENT_TYPE:
+        return msgpack.unpackb(body, raw=False)
+    return json.loads(body.decode())
+
+
+def choose_content_type(accept: Optional[str]) -> str:
+    """Лучший формат ответа из перечисленных в ACCEPT_HEADER"""
+    if accept:
+        offered = [item.strip() for item in str(accept).split(",")]
+        for content_type in SUPPORTED_CONTENT_TYPES:
+            if content_type in offered:
+                return content_type
+    return JSON_CONTENT_TYPE
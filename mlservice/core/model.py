@@ -1,50 +1,418 @@
-import asyncio
-import base64
-from io import BytesIO
+from contextlib import contextmanager
+from dataclasses import dataclass
+import itertools
 import logging
+import time
 from typing import Dict, List, Optional
 import torch
-from transformers import Qwen2VLForConditionalGeneration, AutoProcessor
+from torch.ao.nn.quantized.dynamic import Linear as DynamicQuantizedLinear
+from transformers import (
+    AsyncTextIteratorStreamer,
+    AutoModelForCausalLM,
+    AutoProcessor,
+    BatchFeature,
+    Qwen2VLForConditionalGeneration,
+)
 from qwen_vl_utils import process_vision_info
 from PIL import Image
+from core.generation import DEFAULT_GENERATION, GenerationParams
+from core.kv_cache import KVCacheEntry, common_prefix_length
+from core.snapshot import save_snapshot, snapshot_ready
 
 logger = logging.getLogger(__name__)
 
+# auto - dtype из конфига модели; int8 - динамическая квантизация Linear (только CPU)
+INFERENCE_MODES = ("auto", "fp32", "bf16", "int8")
 
-logger = logging.getLogger(__name__)
+SELF_CHECK_PROMPT = "Сколько будет 2+2? Ответь одним числом."
+
+
+def bf16_supported() -> bool:
+    """Нативный bf16 на CPU (AVX512-BF16/AMX); без него bf16 медленнее fp32"""
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except Exception:
+        return False
+
+
+def quantize_linear_int8(module: torch.nn.Module, skip=("visual",), prefix: str = ""):
+    """
+    Динамическая int8-квантизация Linear по одному слою: веса грузятся
+    в bf16, и fp32-копия нужна только текущему слою, а не всей модели.
+    Vision tower не трогаем: он берет dtype из весов своих Linear.
+    """
+    for name, child in module.named_children():
+        full_name = f"{prefix}{name}"
+        if full_name in skip:
+            continue
+        if isinstance(child, torch.nn.Linear):
+            child = child.float()
+            child.qconfig = torch.ao.quantization.per_channel_dynamic_qconfig
+            setattr(module, name, DynamicQuantizedLinear.from_float(child))
+        else:
+            quantize_linear_int8(child, skip, f"{full_name}.")
+
+
+@dataclass
+class SessionGeneration:
+    output: str
+    cache_entry: KVCacheEntry
+    # Сколько токенов промпта пришлось прогнать и сколько взято из кэша
+    prefill_tokens: int
+    reused_tokens: int
 
 
 class QwenVLModel:
-    def __init__(self, model_name: str = "Qwen/Qwen2-VL-2B-Instruct"):
-        try:
-            self.model = Qwen2VLForConditionalGeneration.from_pretrained(
-                model_name,
-                torch_dtype="auto",
-                device_map="auto",
+    def __init__(
+        self,
+        model_name: str = "Qwen/Qwen2-VL-2B-Instruct",
+        inference_mode: str = "auto",
+        snapshot_dir: Optional[str] = None,
+        draft_model_name: Optional[str] = None,
+        num_assistant_tokens: int = 5,
+    ):
+        """
+        snapshot_dir - локальный safetensors-снапшот. Если он уже собран,
+        модель и процессор грузятся из него (mmap, без Hub), иначе
+        загружаются как обычно и снапшот сохраняется для следующих стартов.
+        draft_model_name - маленькая модель с тем же словарем для
+        assisted generation (speculative decoding)
+        """
+        if inference_mode not in INFERENCE_MODES:
+            raise ValueError(
+                f"Unknown inference mode {inference_mode!r}, expected one of {INFERENCE_MODES}"
             )
-            self.processor = AutoProcessor.from_pretrained(model_name)
+        if inference_mode == "bf16" and not bf16_supported():
+            logger.warning("CPU has no native bf16 support, falling back to fp32")
+            inference_mode = "fp32"
+        self.inference_mode = inference_mode
+        # Длительность фаз загрузки, секунды
+        self.load_timings: Dict[str, float] = {}
+        from_snapshot = snapshot_ready(snapshot_dir, model_name)
+        source = snapshot_dir if from_snapshot else model_name
+        try:
+            with self._phase("processor"):
+                self.processor = AutoProcessor.from_pretrained(
+                    source, local_files_only=from_snapshot
+                )
+            # Для батчевой генерации decoder-only модели паддинг нужен слева
+            self.processor.tokenizer.padding_side = "left"
+            with self._phase("weights"):
+                self.model = Qwen2VLForConditionalGeneration.from_pretrained(
+                    source,
+                    torch_dtype=self._load_dtype(inference_mode),
+                    # Квантованные ядра есть только на CPU
+                    device_map="cpu" if inference_mode == "int8" else "auto",
+                    local_files_only=from_snapshot,
+                )
+            if snapshot_dir and not from_snapshot:
+                # До квантизации: int8-веса в safetensors не сохраняются
+                with self._phase("snapshot_save"):
+                    save_snapshot(self.model, self.processor, snapshot_dir, model_name)
+            if inference_mode == "int8":
+                with self._phase("quantize"):
+                    quantize_linear_int8(self.model)
+                    # Активации динамически квантованных Linear - fp32
+                    self.model.float()
+            self.model.eval()
+            self.draft_model = None
+            if draft_model_name:
+                with self._phase("draft"):
+                    self.draft_model = self._load_draft(
+                        draft_model_name, num_assistant_tokens
+                    )
         except Exception as e:
             logger.error(f"Initialization error: {e}")
             raise
+        logger.info(
+            f"Model loaded from {'snapshot ' if from_snapshot else ''}{source} "
+            f"({inference_mode}), phases: {self.load_timings}"
+        )
 
-    async def predict(self, text: str, image_base64: Optional[str] = None):
-        """Основной метод для предсказаний"""
+    @contextmanager
+    def _phase(self, name: str):
+        started = time.perf_counter()
         try:
+            yield
+        finally:
+            self.load_timings[name] = round(time.perf_counter() - started, 3)
+
+    def _load_draft(self, draft_model_name: str, num_assistant_tokens: int):
+        draft = AutoModelForCausalLM.from_pretrained(
+            draft_model_name,
+            torch_dtype=self._load_dtype(self.inference_mode),
+            device_map="cpu" if self.inference_mode == "int8" else "auto",
+        )
+        # Draft предлагает токены основной модели: словари должны совпадать
+        if draft.config.vocab_size != getattr(self.model.config, "vocab_size", None):
+            logger.warning(
+                f"Draft model {draft_model_name} has a different vocabulary, "
+                "assisted generation disabled"
+            )
+            return None
+        if self.inference_mode == "int8":
+            quantize_linear_int8(draft)
+            draft.float()
+        draft.generation_config.num_assistant_tokens = num_assistant_tokens
+        return draft.eval()
+
+    def _generate_kwargs(
+        self,
+        params: GenerationParams,
+        max_new_tokens: Optional[int] = None,
+        batch_size: int = 1,
+    ) -> Dict:
+        kwargs = params.generate_kwargs(self.processor.tokenizer, max_new_tokens)
+        # Assisted generation в transformers работает только с батчем из одного
+        if params.assisted and self.draft_model is not None and batch_size == 1:
+            kwargs["assistant_model"] = self.draft_model
+        return kwargs
+
+    @staticmethod
+    def _load_dtype(inference_mode: str):
+        # int8 квантуется из bf16: fp32-копия нужна только одному слою за раз
+        return {
+            "auto": "auto",
+            "fp32": torch.float32,
+            "bf16": torch.bfloat16,
+            "int8": torch.bfloat16,
+        }[inference_mode]
+
+    def memory_footprint(self) -> int:
+        """Байты весов и буферов, включая упакованные int8-веса"""
+        total = sum(
+            t.numel() * t.element_size()
+            for t in itertools.chain(self.model.parameters(), self.model.buffers())
+        )
+        for module in self.model.modules():
+            if isinstance(module, DynamicQuantizedLinear):
+                for t in module._weight_bias():
+                    if t is not None:
+                        total += t.numel() * t.element_size()
+        return total
+
+    def self_check(self, max_new_tokens: int = 16) -> Dict[str, float]:
+        """
+        Проверка после загрузки: жадная генерация на фиксированном промпте
+        должна дать непустой ответ без NaN/inf в логитах (признак того,
+        что квантизация или bf16 испортили модель)
+        """
+        prompt = self.processor.apply_chat_template(
+            [{"role": "user", "content": SELF_CHECK_PROMPT}],
+            tokenize=False,
+            add_generation_prompt=True,
+        )
+        inputs = self.processor(text=[prompt], return_tensors="pt")
+        inputs = inputs.to(self.model.device)
+        started = time.perf_counter()
+        with torch.inference_mode():
+            output = self.model.generate(
+                **inputs,
+                max_new_tokens=max_new_tokens,
+                do_sample=False,
+                output_scores=True,
+                return_dict_in_generate=True,
+            )
+        elapsed = time.perf_counter() - started
+        new_tokens = output.sequences.shape[1] - inputs.input_ids.shape[1]
+        answer = self.processor.batch_decode(
+            output.sequences[:, inputs.input_ids.shape[1] :], skip_special_tokens=True
+        )[0]
+        if not all(torch.isfinite(scores).all() for scores in output.scores):
+            raise RuntimeError(
+                f"Self-check failed in {self.inference_mode} mode: non-finite logits"
+            )
+        if new_tokens == 0 or not answer.strip():
+            raise RuntimeError(
+                f"Self-check failed in {self.inference_mode} mode: empty output"
+            )
+        return {
+            "inference_mode": self.inference_mode,
+            "answer": answer.strip(),
+            "tokens_per_s": new_tokens / elapsed,
+            "weights_mb": self.memory_footprint() / 2**20,
+        }
+
+    def generate_batch(
+        self, texts: List[str], params: Optional[List[GenerationParams]] = None
+    ) -> List[str]:
+        """
+        Один проход generate для пачки запросов, ответы в порядке texts.
+        У всех params должен совпадать batch_key(), max_new_tokens - свой
+        """
+        params = params or [DEFAULT_GENERATION] * len(texts)
+        # Паддим все тексты в один тензор
+        inputs = self.processor(text=texts, padding=True, return_tensors="pt")
+        inputs = inputs.to(self.model.device)
+
+        generated_ids = self.model.generate(
+            **inputs,
+            **self._generate_kwargs(
+                params[0], max(p.max_new_tokens for p in params), len(texts)
+            ),
+        )
+
+        # Отрезаем промпт: при левом паддинге он одной длины у всех строк батча
+        generated_ids = generated_ids[:, inputs.input_ids.shape[1] :]
+        # Каждая строка - не длиннее своего лимита
+        outputs = self.processor.batch_decode(
+            [ids[: p.max_new_tokens] for ids, p in zip(generated_ids, params)],
+            skip_special_tokens=True,
+        )
+        return [p.apply_stop(output) for p, output in zip(params, outputs)]
+
+    def create_streamer(self) -> AsyncTextIteratorStreamer:
+        """Streamer для generate_stream, создается внутри работающего event loop"""
+        return AsyncTextIteratorStreamer(
+            self.processor.tokenizer, skip_prompt=True, skip_special_tokens=True
+        )
 
-            # Обрабатываем через процессор
-            inputs = self.processor(text=text, padding=True, return_tensors="pt")
-            # inputs = inputs.to("cuda")
+    def generate_stream(
+        self,
+        text: str,
+        streamer: AsyncTextIteratorStreamer,
+        params: GenerationParams = DEFAULT_GENERATION,
+    ) -> str:
+        """Генерация одного запроса с выдачей текста в streamer по мере готовности"""
+        inputs = self.processor(text=[text], return_tensors="pt")
+        inputs = inputs.to(self.model.device)
+
+        generated_ids = self.model.generate(
+            **inputs,
+            streamer=streamer,
+            **self._generate_kwargs(params),
+        )
+
+        generated_ids = generated_ids[:, inputs.input_ids.shape[1] :]
+        return params.apply_stop(
+            self.processor.batch_decode(generated_ids, skip_special_tokens=True)[0]
+        )
+
+    def _prepare_rope_for_cache(self, inputs: BatchFeature) -> bool:
+        """
+        Qwen2-VL считает mrope-позиции в prefill с нуля, а продолжая с
+        KV-кэша, прибавляет смещение rope_deltas последнего prefill - он мог
+        быть чужим запросом с картинкой. Смещение этого промпта считается
+        публичным get_rope_index. Модель с rope_deltas без get_rope_index
+        (другая версия transformers) кэш не переиспользует: False
+        """
+        for module in (self.model, getattr(self.model, "model", None)):
+            if module is None or not hasattr(module, "rope_deltas"):
+                continue
+            if not hasattr(module, "get_rope_index"):
+                logger.warning("Model has no get_rope_index, session KV reuse is off")
+                return False
+            _, module.rope_deltas = module.get_rope_index(
+                input_ids=inputs.input_ids, attention_mask=inputs.attention_mask
+            )
+            return True
+        # Обычный RoPE: позиции продолжения берутся из cache_position
+        return True
 
-            # Генерируем ответ
-            generated_ids = self.model.generate(**inputs, max_new_tokens=128)
+    def generate_session(
+        self,
+        messages: List[dict],
+        cached: Optional[KVCacheEntry] = None,
+        streamer: Optional[AsyncTextIteratorStreamer] = None,
+        params: GenerationParams = DEFAULT_GENERATION,
+    ) -> SessionGeneration:
+        """
+        Генерация очередного хода диалога.
 
-            # Декодируем ответ
-            response = self.processor.batch_decode(
-                generated_ids, skip_special_tokens=True
+        Если есть KV-кэш прошлых ходов, prefill считается только для токенов
+        после общего префикса с новым промптом.
+        """
+        prompt = self.processor.apply_chat_template(
+            messages, tokenize=False, add_generation_prompt=True
+        )
+        inputs = self.processor(text=[prompt], return_tensors="pt")
+        inputs = inputs.to(self.model.device)
+        input_ids = inputs.input_ids[0]
+
+        past_key_values = None
+        reused = 0
+        if cached is not None:
+            # Хотя бы один токен должен пройти через модель
+            reused = min(
+                common_prefix_length(cached.token_ids.to(input_ids.device), input_ids),
+                input_ids.shape[0] - 1,
+            )
+            if reused > 0 and self._prepare_rope_for_cache(inputs):
+                past_key_values = cached.past_key_values
+                past_key_values.crop(reused)
+            else:
+                reused = 0
+
+        try:
+            output = self.model.generate(
+                **inputs,
+                past_key_values=past_key_values,
+                streamer=streamer,
+                return_dict_in_generate=True,
+                **params.generate_kwargs(self.processor.tokenizer),
+            )
+        except Exception:
+            if past_key_values is not None:
+                # Кэш меняется на месте: в записи остается только префикс,
+                # который точно совпадает с token_ids, и ее можно вернуть
+                past_key_values.crop(reused)
+                cached.token_ids = cached.token_ids[:reused]
+            raise
+
+        sequence = output.sequences[0]
+        answer = params.apply_stop(
+            self.processor.batch_decode(
+                [sequence[input_ids.shape[0] :]], skip_special_tokens=True
             )[0]
+        )
+        cache = output.past_key_values
+        cache_entry = KVCacheEntry(
+            token_ids=sequence[: cache.get_seq_length()].cpu(),
+            past_key_values=cache,
+            messages=messages + [{"role": "assistant", "content": answer}],
+        )
+        return SessionGeneration(
+            output=answer,
+            cache_entry=cache_entry,
+            prefill_tokens=input_ids.shape[0] - reused,
+            reused_tokens=reused,
+        )
 
-            return response
+    def prepare_image_inputs(
+        self, text: str, image: Image.Image, max_pixels: int
+    ) -> BatchFeature:
+        """Промпт с картинкой: ресайз под бюджет пикселей модели и vision-препроцессинг"""
+        messages = [
+            {
+                "role": "user",
+                "content": [
+                    {"type": "image", "image": image, "max_pixels": max_pixels},
+                    {"type": "text", "text": text},
+                ],
+            }
+        ]
+        prompt = self.processor.apply_chat_template(
+            messages, tokenize=False, add_generation_prompt=True
+        )
+        image_inputs, _ = process_vision_info(messages)
+        return self.processor(
+            text=[prompt], images=image_inputs, padding=True, return_tensors="pt"
+        )
 
-        except Exception as e:
-            logger.error(f"Prediction error: {e}")
-            return f"Error: {str(e)}"
+    def generate_from_inputs(
+        self,
+        inputs: BatchFeature,
+        streamer: Optional[AsyncTextIteratorStreamer] = None,
+        params: GenerationParams = DEFAULT_GENERATION,
+    ) -> str:
+        """Генерация по заранее подготовленным входам (например, с картинкой)"""
+        inputs = inputs.to(self.model.device)
+        generated_ids = self.model.generate(
+            **inputs,
+            streamer=streamer,
+            **params.generate_kwargs(self.processor.tokenizer),
+        )
+        generated_ids = generated_ids[:, inputs.input_ids.shape[1] :]
+        return params.apply_stop(
+            self.processor.batch_decode(generated_ids, skip_special_tokens=True)[0]
+        )
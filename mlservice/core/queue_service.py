@@ -1,21 +1,346 @@
+import asyncio
 import aio_pika
-import json
 import logging
-from typing import Callable, Awaitable
+import time
+from collections import defaultdict, deque
+from typing import Callable, Awaitable, Deque, Dict, Optional
 from aio_pika.abc import AbstractIncomingMessage
+from core.message_codec import (
+    ACCEPT_HEADER,
+    DEADLINE_HEADER,
+    ENQUEUED_AT_HEADER,
+    PRIORITY_CLASS_HEADER,
+    choose_content_type,
+    decode,
+    encode,
+)
+
+# Тип ответного сообщения: кусок потоковой генерации или итоговый результат
+CHUNK_MESSAGE_TYPE = "chunk"
+RESULT_MESSAGE_TYPE = "result"
+
+# Сколько раз сообщение уже возвращалось из очереди повторов
+RETRY_COUNT_HEADER = "x-retry-count"
+# Последняя ошибка обработки - видна в DLQ при разборе
+LAST_ERROR_HEADER = "x-last-error"
+# Сколько раз брокер вернул сообщение неподтвержденным (отдельно от повторов)
+REDELIVERY_COUNT_HEADER = "x-redelivery-count"
+
+Emit = Callable[[dict], Awaitable[None]]
 
 logger = logging.getLogger(__name__)
 
 
+def _float_header(message: AbstractIncomingMessage, name: str) -> Optional[float]:
+    """Числовой заголовок; неверное значение - как отсутствующее"""
+    value = message.headers.get(name)
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        logger.warning(
+            f"Ignoring invalid {name} header {value!r} "
+            f"on message {message.correlation_id}"
+        )
+        return None
+
+
+class QueueWaitMetrics:
+    """Время от публикации до получения воркером по классам приоритета"""
+
+    def __init__(self, window: int = 1000):
+        self._waits_ms: Dict[str, Deque[float]] = defaultdict(
+            lambda: deque(maxlen=window)
+        )
+        self._counts: Dict[str, int] = defaultdict(int)
+
+    def record(self, priority_class: str, wait_ms: float):
+        self._counts[priority_class] += 1
+        self._waits_ms[priority_class].append(wait_ms)
+
+    @staticmethod
+    def _percentile(values, q: float) -> float:
+        ordered = sorted(values)
+        return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        return {
+            priority_class: {
+                "count": self._counts[priority_class],
+                "wait_p50_ms": self._percentile(waits, 0.5),
+                "wait_p95_ms": self._percentile(waits, 0.95),
+            }
+            for priority_class, waits in self._waits_ms.items()
+            if waits
+        }
+
+
 class QueueService:
-    def __init__(self, rabbitmq_url: str, queue_name: str):
+    def __init__(
+        self,
+        rabbitmq_url: str,
+        queue_name: str,
+        prefetch_count: int = 1,
+        max_priority: int = 10,
+        max_retries: int = 3,
+        retry_base_delay_ms: int = 1000,
+        max_redeliveries: int = 5,
+    ):
         self.rabbitmq_url = rabbitmq_url
         self.queue_name = queue_name
+        self.prefetch_count = prefetch_count
+        self.max_priority = max_priority
+        self.max_retries = max_retries
+        self.retry_base_delay_ms = retry_base_delay_ms
+        self.max_redeliveries = max_redeliveries
+        self.dead_letter_queue = f"{queue_name}.dead"
+        self.retried = 0
+        self.redelivered = 0
+        self.dead_lettered = 0
+        self.wait_metrics = QueueWaitMetrics()
         self.connection = None
         self.channel = None
         self.is_consuming = False
+        self._queue = None
+        self._consumer_tag = None
+        # Сообщения, которые сейчас обрабатываются (для drain)
+        self._in_flight = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    async def _reply(
+        self,
+        message: AbstractIncomingMessage,
+        body: dict,
+        message_type: str = RESULT_MESSAGE_TYPE,
+    ):
+        """Публикует ответ в reply_to с correlation_id исходного сообщения"""
+        if not message.reply_to:
+            return
+        # Отвечаем в формате, который понимает отправитель (по умолчанию JSON)
+        content_type = choose_content_type(message.headers.get(ACCEPT_HEADER))
+        response = aio_pika.Message(
+            body=encode(body, content_type),
+            content_type=content_type,
+            correlation_id=message.correlation_id,
+            type=message_type,
+        )
+        await self.channel.default_exchange.publish(
+            response, routing_key=message.reply_to
+        )
+
+    def _retry_delay_ms(self, retries: int) -> int:
+        """Экспоненциальная задержка перед повтором номер retries + 1"""
+        return self.retry_base_delay_ms * 2**retries
+
+    def _retry_queue_name(self, retries: int) -> str:
+        # TTL - аргумент очереди, поэтому задержка входит в имя
+        return f"{self.queue_name}.retry.{self._retry_delay_ms(retries)}ms"
+
+    async def _declare_retry_queues(self):
+        """
+        Очереди повторов без потребителей: сообщение лежит в них
+        x-message-ttl и по dead-letter возвращается в основную очередь.
+        Отказавшие окончательно сообщения складываются в DLQ.
+        """
+        await self.channel.declare_queue(self.dead_letter_queue, durable=True)
+        for retries in range(self.max_retries):
+            await self.channel.declare_queue(
+                self._retry_queue_name(retries),
+                durable=True,
+                arguments={
+                    "x-message-ttl": self._retry_delay_ms(retries),
+                    "x-dead-letter-exchange": "",
+                    "x-dead-letter-routing-key": self.queue_name,
+                },
+            )
+
+    async def _republish(
+        self, message: AbstractIncomingMessage, routing_key: str, headers: dict
+    ):
+        """Копия входящего сообщения с обновленными заголовками"""
+        await self.channel.default_exchange.publish(
+            aio_pika.Message(
+                body=message.body,
+                content_type=message.content_type,
+                headers={**message.headers, **headers},
+                correlation_id=message.correlation_id,
+                reply_to=message.reply_to,
+                priority=message.priority,
+                delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+            ),
+            routing_key=routing_key,
+        )
+
+    async def _handle_failure(
+        self, message: AbstractIncomingMessage, error: Exception, retryable: bool
+    ):
+        """
+        Повтор с экспоненциальной задержкой, пока не кончились попытки
+        и повтор успевает до дедлайна. Иначе - в DLQ и сразу ответ
+        об ошибке в reply_to, чтобы отправитель не ждал свой таймаут.
+        """
+        retries = int(message.headers.get(RETRY_COUNT_HEADER, 0))
+        delay_ms = self._retry_delay_ms(retries)
+        deadline = _float_header(message, DEADLINE_HEADER)
+        in_time = deadline is None or time.time() + delay_ms / 1000 < deadline
+        error_text = f"{type(error).__name__}: {error}"
+        try:
+            if retryable and retries < self.max_retries and in_time:
+                await self._republish(
+                    message,
+                    self._retry_queue_name(retries),
+                    {
+                        RETRY_COUNT_HEADER: retries + 1,
+                        LAST_ERROR_HEADER: error_text[:500],
+                    },
+                )
+                self.retried += 1
+                logger.warning(
+                    f"Retrying message {message.correlation_id} in {delay_ms} ms "
+                    f"(attempt {retries + 1}/{self.max_retries}): {error_text}"
+                )
+                return
+            await self._republish(
+                message,
+                self.dead_letter_queue,
+                {RETRY_COUNT_HEADER: retries, LAST_ERROR_HEADER: error_text[:500]},
+            )
+            self.dead_lettered += 1
+            logger.error(
+                f"Dead-lettered message {message.correlation_id} "
+                f"after {retries} retries: {error_text}"
+            )
+        except Exception as e:
+            logger.error(
+                f"Failed to republish message {message.correlation_id}: {e}",
+                exc_info=True,
+            )
+        try:
+            await self._reply(
+                message,
+                {
+                    "success": False,
+                    "error": f"Processing failed after {retries} retries: {error_text}",
+                },
+            )
+        except Exception as e:
+            logger.error(f"Failed to send failure reply: {e}", exc_info=True)
+
+    async def _handle_redelivery(self, message: AbstractIncomingMessage):
+        """
+        Брокер вернул неподтвержденное сообщение: prefetch воркера, который
+        остановился (drain, отмена consumer), обрыв соединения или падение
+        воркера на этом сообщении. Это не ошибка обработки - попытки
+        x-retry-count не тратятся, сообщение сразу уходит в конец очереди.
+        Отдельный лимит не дает poison-сообщению ронять воркеры по кругу.
+        """
+        redeliveries = int(message.headers.get(REDELIVERY_COUNT_HEADER, 0)) + 1
+        if redeliveries > self.max_redeliveries:
+            await self._handle_failure(
+                message,
+                RuntimeError(f"Redelivered {redeliveries - 1} times"),
+                retryable=False,
+            )
+            return
+        try:
+            await self._republish(
+                message, self.queue_name, {REDELIVERY_COUNT_HEADER: redeliveries}
+            )
+            self.redelivered += 1
+        except Exception as e:
+            logger.error(
+                f"Failed to requeue redelivered message {message.correlation_id}: {e}",
+                exc_info=True,
+            )
+            raise
+
+    async def _process(
+        self,
+        message: AbstractIncomingMessage,
+        callback: Callable[[dict, Emit], Awaitable[dict]],
+    ):
+        # Повторная доставка при ошибке возвращается в очередь: ее копию
+        # опубликовать не удалось, и ack потерял бы сообщение
+        async with message.process(requeue=message.redelivered):
+            logger.info(
+                f"Received message {message.correlation_id}: "
+                f"{len(message.body)} bytes, {message.content_type}"
+            )
+            if message.redelivered:
+                await self._handle_redelivery(message)
+                return
+
+            deadline = _float_header(message, DEADLINE_HEADER)
+            if deadline is not None and deadline < time.time():
+                # Отправитель уже не ждет ответа - не тратим CPU
+                logger.warning(
+                    f"Dropping expired message {message.correlation_id}: "
+                    f"deadline passed {time.time() - deadline:.1f}s ago"
+                )
+                # Асинхронной задаче нужен финальный статус
+                await self._reply(
+                    message,
+                    {
+                        "success": False,
+                        "error": "Deadline exceeded before processing",
+                    },
+                )
+                return
 
-    async def start_consuming(self, callback: Callable[[dict], Awaitable[dict]]):
+            try:
+                data = decode(message.body, message.content_type)
+            except Exception as e:
+                # Poison: повтор не поможет, сразу в DLQ
+                await self._handle_failure(message, e, retryable=False)
+                return
+
+            priority_class = message.headers.get(PRIORITY_CLASS_HEADER, "standard")
+            queue_wait_ms = None
+            enqueued_at = _float_header(message, ENQUEUED_AT_HEADER)
+            if enqueued_at is not None:
+                queue_wait_ms = max(0.0, (time.time() - enqueued_at) * 1000)
+                self.wait_metrics.record(priority_class, queue_wait_ms)
+
+            if deadline is not None:
+                data["deadline"] = deadline
+            emitted = False
+
+            async def emit(chunk: dict):
+                nonlocal emitted
+                emitted = True
+                await self._reply(message, chunk, CHUNK_MESSAGE_TYPE)
+
+            try:
+                result = await callback(data, emit)
+                if queue_wait_ms is not None and "metrics" in result:
+                    result["metrics"] = {
+                        **result["metrics"],
+                        "priority_class": priority_class,
+                        "queue_wait_ms": int(queue_wait_ms),
+                    }
+
+                # Если есть reply_to, отправляем ответ
+                await self._reply(message, result)
+
+            except Exception as e:
+                logger.error(f"Error processing message: {e}", exc_info=True)
+                # Клиент уже получил часть потока - повтор его продублирует
+                await self._handle_failure(message, e, retryable=not emitted)
+
+    def retry_stats(self) -> Dict[str, int]:
+        return {
+            "retried": self.retried,
+            "redelivered": self.redelivered,
+            "dead_lettered": self.dead_lettered,
+        }
+
+    async def start_consuming(self, callback: Callable[[dict, Emit], Awaitable[dict]]):
+        """
+        callback(data, emit) возвращает итоговый результат; через emit
+        можно отправить промежуточные куски ответа (для потоковой генерации)
+        """
         try:
             # Создаем устойчивое подключение
             self.connection = await aio_pika.connect_robust(
@@ -25,40 +350,32 @@ class QueueService:
 
             # Создаем канал
             self.channel = await self.connection.channel()
-            await self.channel.set_qos(
-                prefetch_count=1
-            )  # Обрабатываем по одному сообщению
+            # Берем сразу несколько сообщений, чтобы планировщик мог собрать батч
+            await self.channel.set_qos(prefetch_count=self.prefetch_count)
 
             # Объявляем очередь с параметрами
             queue = await self.channel.declare_queue(
                 self.queue_name,
                 durable=True,  # Очередь сохраняется после перезапуска RabbitMQ
                 auto_delete=False,  # Очередь не удаляется после отключения потребителей
+                # Чат обгоняет фоновые предсказания (priority сообщения)
+                arguments={"x-max-priority": self.max_priority},
             )
+            await self._declare_retry_queues()
 
             async def on_message(message: AbstractIncomingMessage):
-                async with message.process():
-                    try:
-                        logger.info(f"Received message: {message.body}")
-                        data = json.loads(message.body.decode())
-                        result = await callback(data)
-
-                        # Если есть reply_to, отправляем ответ
-                        if message.reply_to:
-                            response = aio_pika.Message(
-                                body=json.dumps(result).encode(),
-                                correlation_id=message.correlation_id,
-                            )
-                            await self.channel.default_exchange.publish(
-                                response, routing_key=message.reply_to
-                            )
-
-                    except Exception as e:
-                        logger.error(f"Error processing message: {e}", exc_info=True)
-                        # Можно добавить логику повторной обработки или DLQ здесь
+                self._in_flight += 1
+                self._idle.clear()
+                try:
+                    await self._process(message, callback)
+                finally:
+                    self._in_flight -= 1
+                    if self._in_flight == 0:
+                        self._idle.set()
 
             self.is_consuming = True
-            await queue.consume(on_message)
+            self._queue = queue
+            self._consumer_tag = await queue.consume(on_message)
             logger.info(f"Started consuming queue: {self.queue_name}")
 
         except Exception as e:
@@ -66,6 +383,24 @@ class QueueService:
             await self.close()
             raise
 
+    async def drain(self, timeout: float):
+        """
+        Graceful shutdown: перестаем брать новые сообщения и ждем,
+        пока догенерируются уже принятые. Неподтвержденные сообщения
+        из prefetch брокер вернет в очередь другим воркерам.
+        """
+        if self._queue is not None and self._consumer_tag is not None:
+            await self._queue.cancel(self._consumer_tag)
+            self._consumer_tag = None
+        self.is_consuming = False
+        logger.info(f"Draining {self._in_flight} in-flight messages")
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(
+                f"Drain timed out after {timeout}s, {self._in_flight} messages left"
+            )
+
     async def close(self):
         try:
             if self.channel:
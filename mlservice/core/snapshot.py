@@ -0,0 +1,66 @@
+import json
+import logging
+import os
+import shutil
+import time
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Метаданные снапшота: по ним понимаем, что он дописан и для какой модели
+SNAPSHOT_META = "snapshot.json"
+
+
+def snapshot_ready(path: Optional[str], model_name: str) -> bool:
+    """Локальный снапшот есть, дописан и сделан из той же модели"""
+    if not path:
+        return False
+    meta_path = os.path.join(path, SNAPSHOT_META)
+    if not os.path.exists(meta_path):
+        return False
+    with open(meta_path) as f:
+        meta = json.load(f)
+    if meta.get("model_name") != model_name:
+        logger.warning(
+            f"Snapshot {path} was built from {meta.get('model_name')}, "
+            f"not {model_name}; ignoring it"
+        )
+        return False
+    return True
+
+
+def save_snapshot(model, processor, path: str, model_name: str):
+    """
+    Сохраняет веса в safetensors (при загрузке они отображаются в память
+    через mmap, без копии и без обращения к Hub) вместе с процессором.
+
+    Пишем во временный каталог и переименовываем: воркеры, которые
+    собирают снапшот одновременно, не увидят недописанные файлы.
+    """
+    started = time.perf_counter()
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    model.save_pretrained(tmp_path, safe_serialization=True)
+    processor.save_pretrained(tmp_path)
+    with open(os.path.join(tmp_path, SNAPSHOT_META), "w") as f:
+        json.dump(
+            {
+                "model_name": model_name,
+                "dtype": str(model.dtype),
+                "created_at": time.time(),
+            },
+            f,
+        )
+    try:
+        # Пустой каталог (например, точка монтирования) можно заменить
+        if os.path.isdir(path) and not os.listdir(path):
+            os.rmdir(path)
+        os.rename(tmp_path, path)
+    except OSError:
+        # Другой процесс успел первым - его снапшот не хуже
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        logger.info(f"Snapshot {path} already exists")
+        return
+    logger.info(
+        f"Saved model snapshot to {path} in {time.perf_counter() - started:.1f}s"
+    )
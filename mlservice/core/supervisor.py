@@ -0,0 +1,133 @@
+import logging
+import multiprocessing
+import os
+import signal
+import time
+from pathlib import Path
+from typing import Callable, List, Optional
+
+from core.executor import available_cpus
+
+logger = logging.getLogger(__name__)
+
+
+def plan_cpu_slices(
+    processes: int, cpus: Optional[List[int]] = None
+) -> List[List[int]]:
+    """
+    Делит доступные ядра между процессами без пересечений.
+    Если ядер меньше, чем процессов, все процессы делят все ядра.
+    """
+    if cpus is None:
+        try:
+            cpus = sorted(os.sched_getaffinity(0))
+        except AttributeError:
+            cpus = list(range(os.cpu_count() or 1))
+    if len(cpus) < processes:
+        return [list(cpus) for _ in range(processes)]
+    share = len(cpus) // processes
+    return [cpus[i * share : (i + 1) * share] for i in range(processes)]
+
+
+def worker_ready_file(ready_file: str, index: int) -> str:
+    """Файл готовности процесса-воркера index"""
+    return f"{ready_file}.{index}"
+
+
+class WorkerSupervisor:
+    """
+    Запускает N процессов-воркеров, каждый со своей моделью и своей
+    долей ядер, и все они читают одну очередь ML_QUEUE.
+
+    Упавший воркер перезапускается. SIGTERM/SIGINT пересылается воркерам:
+    они перестают брать сообщения и дожидаются текущих генераций,
+    после drain_timeout оставшиеся процессы убиваются.
+
+    ready_file - базовое имя файлов готовности воркеров: файл вышедшего
+    процесса удаляет супервизор, иначе healthcheck видел бы готовность
+    воркера, которого уже нет (SIGKILL и OOM не доходят до finally).
+    """
+
+    def __init__(
+        self,
+        target: Callable[[int, List[int], int], None],
+        processes: int,
+        drain_timeout: float = 60,
+        ready_file: Optional[str] = None,
+    ):
+        self.target = target
+        self.processes = max(1, processes)
+        self.drain_timeout = drain_timeout
+        self.ready_file = ready_file
+        # spawn: torch и потоки родителя не наследуются через fork
+        self._context = multiprocessing.get_context("spawn")
+        self._slices = plan_cpu_slices(self.processes)
+        self._workers: List[Optional[multiprocessing.Process]] = [None] * self.processes
+        self._stopping = False
+
+    def _torch_threads(self, index: int) -> int:
+        if len(self._slices[index]) < available_cpus():
+            return len(self._slices[index])
+        # Ядра общие: делим их число поровну между процессами
+        return max(1, available_cpus() // self.processes)
+
+    def _clear_ready(self, index: int):
+        if self.ready_file is not None:
+            Path(worker_ready_file(self.ready_file, index)).unlink(missing_ok=True)
+
+    def _start(self, index: int):
+        self._clear_ready(index)
+        process = self._context.Process(
+            target=self.target,
+            args=(index, self._slices[index], self._torch_threads(index)),
+            name=f"ml-worker-{index}",
+        )
+        process.start()
+        self._workers[index] = process
+        logger.info(
+            f"Started worker {index} (pid={process.pid}, "
+            f"cpus={self._slices[index]}, torch_threads={self._torch_threads(index)})"
+        )
+
+    def _request_stop(self, signum, frame):
+        if self._stopping:
+            return
+        self._stopping = True
+        logger.info(f"Received signal {signum}, draining workers")
+        for process in self._workers:
+            if process is not None and process.is_alive():
+                process.terminate()  # SIGTERM: воркер сам делает drain
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self._request_stop)
+        signal.signal(signal.SIGINT, self._request_stop)
+
+        if self.ready_file is not None:
+            # Остаток запуска с одним процессом после рестарта контейнера
+            Path(self.ready_file).unlink(missing_ok=True)
+        for index in range(self.processes):
+            self._start(index)
+
+        while not self._stopping:
+            for index, process in enumerate(self._workers):
+                if self._stopping:
+                    break
+                if process is not None and not process.is_alive():
+                    logger.error(
+                        f"Worker {index} exited with code {process.exitcode}, restarting"
+                    )
+                    self._start(index)
+            time.sleep(1)
+
+        # Воркер ждет drain_timeout, сверху небольшой запас на закрытие соединений
+        deadline = time.monotonic() + self.drain_timeout + 10
+        for index, process in enumerate(self._workers):
+            if process is None:
+                continue
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                logger.warning(f"Worker {index} did not drain in time, killing")
+                process.kill()
+                process.join()
+            self._clear_ready(index)
+        logger.info("All workers stopped")
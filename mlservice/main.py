@@ -1,41 +1,152 @@
 import asyncio
 import logging
+import os
+import signal
+import time
+from pathlib import Path
+from typing import List, Optional
 from config import config
 from aio_pika import logger
 from core.queue_service import QueueService
+from core.batcher import BatchScheduler
+from core.executor import InferenceExecutor
+from core.image_pipeline import ImagePreprocessor
+from core.kv_cache import SessionKVCache
+from core.redis_manager import RedisHistoryManager
 from core.model import QwenVLModel
+from core.supervisor import WorkerSupervisor, worker_ready_file
 from services.ml_service import MLService
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-async def create_ml_service():
-    model = QwenVLModel(model_name=config.MODEL_NAME)
-    return MLService(model)
+async def create_ml_service(torch_threads: Optional[int] = None):
+    model = QwenVLModel(
+        model_name=config.MODEL_NAME,
+        inference_mode=config.INFERENCE_MODE,
+        snapshot_dir=config.MODEL_SNAPSHOT_DIR or None,
+        draft_model_name=config.DRAFT_MODEL_NAME or None,
+        num_assistant_tokens=config.DRAFT_NUM_TOKENS,
+    )
+    executor = InferenceExecutor(
+        max_workers=config.INFERENCE_WORKERS,
+        torch_threads=config.TORCH_THREADS or torch_threads,
+    )
+    batcher = BatchScheduler(
+        model,
+        executor,
+        max_batch_size=config.BATCH_MAX_SIZE,
+        max_wait_ms=config.BATCH_MAX_WAIT_MS,
+    )
+    if config.WARMUP_MAX_NEW_TOKENS > 0:
+        # Первая генерация медленная (выбор ядер, аллокации) - платим за нее
+        # до приема сообщений, а не на первом запросе пользователя
+        started = time.perf_counter()
+        check = await executor.submit(model.self_check, config.WARMUP_MAX_NEW_TOKENS)
+        model.load_timings["warmup"] = round(time.perf_counter() - started, 3)
+        logger.info(f"Warm-up: {check}")
+    await batcher.start()
+    session_cache = SessionKVCache(
+        max_bytes=config.SESSION_CACHE_MAX_BYTES, ttl_seconds=config.SESSION_CACHE_TTL
+    )
+    history = RedisHistoryManager(
+        config.REDIS_URL, ttl_seconds=config.SESSION_HISTORY_TTL
+    )
+    preprocessor = ImagePreprocessor(
+        model,
+        max_workers=config.PREPROCESS_WORKERS,
+        max_decoded_pixels=config.MAX_DECODED_PIXELS,
+        max_pixels=config.IMAGE_MAX_PIXELS,
+    )
+    return MLService(model, executor, batcher, session_cache, history, preprocessor)
 
 
-async def main():
-    ml_service = await create_ml_service()
+async def main(torch_threads: Optional[int] = None, ready_file: Optional[str] = None):
+    """
+    Один воркер: модель, пул генерации и consumer очереди.
+    torch_threads - бюджет потоков torch на каждый поток пула генерации
+    """
+    started = time.perf_counter()
+    ready = Path(ready_file or config.READY_FILE)
+    # Файл мог остаться от процесса, убитого SIGKILL/OOM: до прогрева
+    # модели healthcheck не должен видеть готовность
+    ready.unlink(missing_ok=True)
+    ml_service = await create_ml_service(torch_threads)
     queue_service = QueueService(
-        rabbitmq_url=config.RABBITMQ_URL, queue_name=config.ML_QUEUE
+        rabbitmq_url=config.RABBITMQ_URL,
+        queue_name=config.ML_QUEUE,
+        prefetch_count=config.PREFETCH_COUNT,
+        max_priority=config.ML_QUEUE_MAX_PRIORITY,
+        max_retries=config.MAX_RETRIES,
+        retry_base_delay_ms=config.RETRY_BASE_DELAY_MS,
+        max_redeliveries=config.MAX_REDELIVERIES,
     )
 
-    async def handler(data: dict):
+    async def handler(data: dict, emit):
+        if data.pop("stream", False):
+            return await ml_service.predict_stream(on_chunk=emit, **data)
         return await ml_service.predict(**data)
 
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, stop.set)
+
     try:
         await queue_service.start_consuming(handler)
+        # Готовность: модель прогрета и сообщения уже принимаются
+        ready.touch()
+        logger.info(
+            f"Worker ready in {time.perf_counter() - started:.1f}s, "
+            f"startup phases: {ml_service.model.load_timings}"
+        )
 
-        # Держим сервис запущенным
-        while True:
-            await asyncio.sleep(1)
+        # Держим сервис запущенным и периодически пишем метрики
+        while not stop.is_set():
+            try:
+                await asyncio.wait_for(stop.wait(), config.METRICS_LOG_INTERVAL)
+            except asyncio.TimeoutError:
+                logger.info(f"Executor stats: {ml_service.executor.stats()}")
+                logger.info(f"Batch metrics: {ml_service.batcher.metrics.snapshot()}")
+                logger.info(f"Session cache: {ml_service.session_cache.stats()}")
+                logger.info(f"Queue wait: {queue_service.wait_metrics.snapshot()}")
+                logger.info(f"Retries: {queue_service.retry_stats()}")
 
-    except KeyboardInterrupt:
         logger.info("Shutting down...")
+        # Новые сообщения не берем, текущие генерации доводим до конца
+        await queue_service.drain(config.DRAIN_TIMEOUT)
     finally:
+        ready.unlink(missing_ok=True)
         await queue_service.close()
+        await ml_service.batcher.stop()
+        ml_service.executor.shutdown()
+        ml_service.preprocessor.shutdown()
+        await ml_service.history.close()
+
+
+def run_worker(index: int, cpus: List[int], torch_threads: int):
+    """Точка входа процесса-воркера под WorkerSupervisor"""
+    logging.basicConfig(level=logging.INFO)
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+    # Потоки процесса делятся между потоками пула генерации
+    asyncio.run(
+        main(
+            max(1, torch_threads // max(1, config.INFERENCE_WORKERS)),
+            # У каждого процесса свой файл готовности
+            ready_file=worker_ready_file(config.READY_FILE, index),
+        )
+    )
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    if config.WORKER_PROCESSES > 1:
+        WorkerSupervisor(
+            run_worker,
+            processes=config.WORKER_PROCESSES,
+            drain_timeout=config.DRAIN_TIMEOUT,
+            ready_file=config.READY_FILE,
+        ).run()
+    else:
+        asyncio.run(main())
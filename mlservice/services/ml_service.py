@@ -1,24 +1,236 @@
+import asyncio
 import logging
-from typing import Optional, Dict
+import time
+from dataclasses import replace
+from typing import Awaitable, Callable, List, Optional, Dict, Tuple, Union
+from core.batcher import BatchScheduler, DeadlineExceededError
+from core.executor import InferenceExecutor
+from core.generation import DEFAULT_GENERATION, GenerationParams, StreamStopFilter
+from core.image_pipeline import ImagePreprocessor
+from core.kv_cache import KVCacheEntry, SessionKVCache
 from core.model import QwenVLModel
+from core.redis_manager import RedisHistoryManager
 
 logger = logging.getLogger(__name__)
 
+# Ошибки самого запроса (некорректные данные, истекший дедлайн): повтор
+# даст тот же результат, поэтому сразу отвечаем ошибкой. Остальные
+# (OOM, сбой генерации) уходят в QueueService - повтор с задержкой и DLQ
+REQUEST_ERRORS = (ValueError, TypeError, DeadlineExceededError)
+
 
 class MLService:
-    def __init__(self, model: QwenVLModel):
+    def __init__(
+        self,
+        model: QwenVLModel,
+        executor: InferenceExecutor,
+        batcher: Optional[BatchScheduler] = None,
+        session_cache: Optional[SessionKVCache] = None,
+        history: Optional[RedisHistoryManager] = None,
+        preprocessor: Optional[ImagePreprocessor] = None,
+    ):
         self.model = model
-        # self.redis = redis_manager
+        self.executor = executor
+        self.batcher = batcher
+        self.session_cache = session_cache
+        self.history = history
+        self.preprocessor = preprocessor
+
+    def _params(self, generation: Optional[Dict]) -> GenerationParams:
+        params = GenerationParams.from_dict(generation)
+        # Без draft-модели такой запрос батчится вместе с обычными
+        if params.assisted and self.model.draft_model is None:
+            params = replace(params, assisted=False)
+        return params
+
+    def _is_session_request(self, session_id: Optional[str]) -> bool:
+        return session_id is not None and self.session_cache is not None
+
+    async def _load_session(
+        self, session_id: str
+    ) -> Tuple[Optional[KVCacheEntry], List[dict]]:
+        """KV-кэш сессии, а если его вытеснили - текстовая история из Redis"""
+        cached = self.session_cache.take(session_id)
+        if cached is not None:
+            return cached, cached.messages
+
+        history = None
+        if self.history is not None:
+            history = await self.history.get_history(session_id)
+        return None, history or []
+
+    async def _generate_session(
+        self,
+        text: str,
+        session_id: str,
+        streamer=None,
+        params: GenerationParams = DEFAULT_GENERATION,
+    ) -> Tuple[str, Dict]:
+        cached, history = await self._load_session(session_id)
+        messages = history + [{"role": "user", "content": text}]
+
+        try:
+            generation = await self.executor.submit(
+                self.model.generate_session, messages, cached, streamer, params
+            )
+        except Exception:
+            # Запись взята из кэша на время генерации: без нее следующий
+            # ход сессии считал бы prefill всей истории заново
+            if cached is not None:
+                self.session_cache.put(session_id, cached)
+            raise
+        self.session_cache.put(session_id, generation.cache_entry)
+        if self.history is not None:
+            try:
+                await self.history.save_history(
+                    session_id, generation.cache_entry.messages
+                )
+            except Exception:
+                # Ошибка уже залогирована, ответ пользователю важнее истории
+                pass
+
+        metrics = {
+            "prefill_tokens": generation.prefill_tokens,
+            "prefill_tokens_saved": generation.reused_tokens,
+        }
+        logger.info(f"Session {session_id} turn: {metrics}")
+        return generation.output, metrics
+
+    async def _generate_stream(
+        self, text: str, streamer, params: GenerationParams = DEFAULT_GENERATION
+    ) -> Tuple[str, Dict]:
+        output = await self.executor.submit(
+            self.model.generate_stream, text, streamer, params
+        )
+        return output, {}
+
+    async def _generate_image(
+        self,
+        text: str,
+        image: Union[str, bytes],
+        streamer=None,
+        params: GenerationParams = DEFAULT_GENERATION,
+    ) -> Tuple[str, Dict]:
+        """Препроцессинг в своем пуле, генерация - в пуле инференса"""
+        started = time.perf_counter()
+        inputs = await self.preprocessor.prepare(text, image)
+        preprocess_ms = int((time.perf_counter() - started) * 1000)
+
+        output = await self.executor.submit(
+            self.model.generate_from_inputs, inputs, streamer, params
+        )
+        return output, {
+            "preprocess_ms": preprocess_ms,
+            "image_tokens": int(inputs["image_grid_thw"].prod()) // 4,
+        }
 
     async def predict(
         self,
         text: str,
         image_base64: Optional[str] = None,
+        session_id: Optional[str] = None,
+        image: Optional[bytes] = None,
+        deadline: Optional[float] = None,
+        generation: Optional[Dict] = None,
     ) -> Dict:
+        """
+        image - сырые байты из msgpack, image_base64 - из JSON сообщений,
+        deadline - unix-время, после которого запрос в батч не попадет,
+        generation - параметры генерации из настроек модели
+        """
         try:
-            response = await self.model.predict(text)
+            started = time.perf_counter()
+            metrics = {}
+            params = self._params(generation)
+            image = image or image_base64
+            if image:
+                response, metrics = await self._generate_image(
+                    text, image, params=params
+                )
+            elif self._is_session_request(session_id):
+                response, metrics = await self._generate_session(
+                    text, session_id, params=params
+                )
+            elif self.batcher is not None:
+                response = await self.batcher.submit(text, deadline, params)
+            else:
+                outputs = await self.executor.submit(
+                    self.model.generate_batch, [text], [params]
+                )
+                response = outputs[0]
 
-            return {"success": True, "output_data": response}
-        except Exception as e:
+            return {
+                "success": True,
+                "output_data": response,
+                "execution_time_ms": int((time.perf_counter() - started) * 1000),
+                "metrics": metrics,
+            }
+        except REQUEST_ERRORS as e:
             logger.error(f"Prediction failed: {e}")
-            return {"success": False, "output_data": f"Prediction failed: {e}"}
+            return {"success": False, "error": f"Prediction failed: {e}"}
+
+    async def predict_stream(
+        self,
+        text: str,
+        on_chunk: Callable[[dict], Awaitable[None]],
+        image_base64: Optional[str] = None,
+        session_id: Optional[str] = None,
+        image: Optional[bytes] = None,
+        deadline: Optional[float] = None,
+        generation: Optional[Dict] = None,
+    ) -> Dict:
+        """
+        Генерация с отправкой кусков текста через on_chunk по мере готовности.
+        deadline уже проверен при получении сообщения: поток идет мимо батчера
+        """
+        try:
+            started = time.perf_counter()
+            streamer = self.model.create_streamer()
+            params = self._params(generation)
+            image = image or image_base64
+            if image:
+                task = asyncio.ensure_future(
+                    self._generate_image(text, image, streamer, params)
+                )
+            elif self._is_session_request(session_id):
+                task = asyncio.ensure_future(
+                    self._generate_session(text, session_id, streamer, params)
+                )
+            else:
+                task = asyncio.ensure_future(
+                    self._generate_stream(text, streamer, params)
+                )
+
+            def _finish(task: asyncio.Future):
+                # При ошибке generate сам не закроет streamer
+                if task.cancelled() or task.exception() is not None:
+                    streamer.end()
+
+            task.add_done_callback(_finish)
+
+            first_chunk_ms = None
+            # Стоп-строка не должна попасть к клиенту, как и в output_data
+            stop_filter = StreamStopFilter(params.stop)
+
+            async def send(chunk: str):
+                nonlocal first_chunk_ms
+                if not chunk:
+                    return
+                if first_chunk_ms is None:
+                    first_chunk_ms = int((time.perf_counter() - started) * 1000)
+                await on_chunk({"chunk": chunk})
+
+            async for chunk in streamer:
+                await send(stop_filter.feed(chunk))
+
+            response, metrics = await task
+            await send(stop_filter.flush())
+            return {
+                "success": True,
+                "output_data": response,
+                "execution_time_ms": int((time.perf_counter() - started) * 1000),
+                "metrics": {**metrics, "time_to_first_chunk_ms": first_chunk_ms},
+            }
+        except REQUEST_ERRORS as e:
+            logger.error(f"Streaming prediction failed: {e}")
+            return {"success": False, "error": f"Prediction failed: {e}"}
@@ -0,0 +1,79 @@
+import pytest
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+from aio_pika.message import ProcessContext
+
+# Импорты воркера идут от каталога mlservice (core.*, services.*)
+from pathlib import Path
+import sys
+
+sys.path.append(str(Path(__file__).parent.parent))
+from core.queue_service import QueueService
+
+
+@dataclass
+class FakeMessage:
+    """Входящее сообщение aio_pika: ack/reject только запоминаются"""
+
+    body: bytes = b"{}"
+    headers: dict = field(default_factory=dict)
+    content_type: str = "application/json"
+    correlation_id: str = "corr-1"
+    reply_to: Optional[str] = "replies"
+    priority: int = 0
+    redelivered: bool = False
+    acked: bool = False
+    rejected: Optional[bool] = None  # requeue при reject
+
+    @property
+    def processed(self) -> bool:
+        return self.acked or self.rejected is not None
+
+    def process(
+        self, requeue=False, reject_on_redelivered=False, ignore_processed=False
+    ):
+        return ProcessContext(
+            self,
+            requeue=requeue,
+            reject_on_redelivered=reject_on_redelivered,
+            ignore_processed=ignore_processed,
+        )
+
+    async def ack(self):
+        self.acked = True
+
+    async def reject(self, requeue=False):
+        self.rejected = requeue
+
+
+class FakeExchange:
+    def __init__(self):
+        self.published: List[tuple] = []
+        self.fail = False
+
+    async def publish(self, message, routing_key):
+        if self.fail:
+            raise ConnectionError("channel closed")
+        self.published.append((routing_key, message))
+
+    def routed_to(self, routing_key):
+        return [m for key, m in self.published if key == routing_key]
+
+
+class FakeChannel:
+    def __init__(self):
+        self.default_exchange = FakeExchange()
+
+
+@pytest.fixture
+def queue_service():
+    service = QueueService(
+        "amqp://unused",
+        "ml_requests",
+        max_retries=3,
+        retry_base_delay_ms=1000,
+        max_redeliveries=2,
+    )
+    service.channel = FakeChannel()
+    return service
@@ -0,0 +1,378 @@
+import asyncio
+import random
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from core.generation import DEFAULT_GENERATION, GenerationParams, StreamStopFilter
+from core.message_codec import DEADLINE_HEADER, ENQUEUED_AT_HEADER, decode
+from core.queue_service import (
+    LAST_ERROR_HEADER,
+    REDELIVERY_COUNT_HEADER,
+    RETRY_COUNT_HEADER,
+)
+from tests.conftest import FakeMessage
+
+
+async def _never_called(data, emit):
+    raise AssertionError("callback must not run for this message")
+
+
+@pytest.mark.asyncio
+async def test_redelivery_requeued_to_main_queue(queue_service):
+    message = FakeMessage(redelivered=True, headers={REDELIVERY_COUNT_HEADER: 1})
+    await queue_service._process(message, _never_called)
+
+    assert message.acked
+    [copy] = queue_service.channel.default_exchange.routed_to("ml_requests")
+    assert copy.headers[REDELIVERY_COUNT_HEADER] == 2
+    assert queue_service.redelivered == 1
+
+
+@pytest.mark.asyncio
+async def test_redelivery_not_acked_when_republish_fails(queue_service):
+    """Копию опубликовать не удалось - сообщение возвращается брокеру"""
+    queue_service.channel.default_exchange.fail = True
+    message = FakeMessage(redelivered=True)
+
+    with pytest.raises(ConnectionError):
+        await queue_service._process(message, _never_called)
+
+    assert not message.acked
+    assert message.rejected is True
+    assert queue_service.redelivered == 0
+
+
+def test_generation_params_from_dict_clamps_values():
+    params = GenerationParams.from_dict(
+        {
+            "max_new_tokens": 10**6,
+            "temperature": -1,
+            "top_p": 5,
+            "stop": "\n",
+            "max_time": "2.5",
+            "assisted": "true",
+        }
+    )
+    assert params == GenerationParams(
+        max_new_tokens=2048,
+        temperature=0.0,
+        top_p=1.0,
+        stop=("\n",),
+        max_time=2.5,
+        assisted=True,
+    )
+    assert not params.sampling
+
+    params = GenerationParams.from_dict(
+        {"max_new_tokens": 0, "top_p": 0, "stop": ["###", "", None], "max_time": 0}
+    )
+    assert params.max_new_tokens == 1
+    assert params.top_p == 0.01
+    assert params.stop == ("###",)
+    assert params.max_time is None
+
+
+def test_generation_params_from_dict_rejects_bad_values():
+    """Неверное значение заменяется умолчанием, остальные применяются"""
+    params = GenerationParams.from_dict(
+        {
+            "max_new_tokens": "много",
+            "temperature": "hot",
+            "top_p": [0.9],
+            "stop": 42,
+            "max_time": None,
+            "assisted": "yes",
+        }
+    )
+    assert params == DEFAULT_GENERATION
+    assert GenerationParams.from_dict(None) is DEFAULT_GENERATION
+    assert GenerationParams.from_dict({}) is DEFAULT_GENERATION
+    assert GenerationParams.from_dict({"temperature": "0.7"}).sampling
+
+
+def _stream(params, chunks):
+    stop_filter = StreamStopFilter(params.stop)
+    return "".join(stop_filter.feed(chunk) for chunk in chunks) + stop_filter.flush()
+
+
+def test_apply_stop_cuts_at_earliest_match():
+    params = GenerationParams(stop=("bc", "abc"))
+    assert params.apply_stop("abc") == ""
+    assert params.apply_stop("xxabcbc") == "xx"
+    assert params.apply_stop("без стопа") == "без стопа"
+
+
+def test_stream_stop_filter_matches_apply_stop():
+    """Поток по любым кускам совпадает с итоговым output_data"""
+    rng = random.Random(19)
+    for _ in range(2000):
+        stop = tuple(
+            "".join(rng.choice("abc") for _ in range(rng.randint(1, 4)))
+            for _ in range(rng.randint(1, 3))
+        )
+        text = "".join(rng.choice("abcd") for _ in range(rng.randint(0, 20)))
+        cuts = sorted(rng.sample(range(len(text) + 1), rng.randint(0, len(text))))
+        chunks = [text[a:b] for a, b in zip([0] + cuts, cuts + [len(text)])]
+        params = GenerationParams(stop=stop)
+        assert _stream(params, chunks) == params.apply_stop(text), (stop, chunks)
+
+
+class _FailingExecutor:
+    async def submit(self, fn, *args):
+        raise ValueError("bad input")
+
+
+@pytest.mark.asyncio
+async def test_request_error_reply_uses_error_key():
+    """Отказ по запросу в том же виде, что и отказы QueueService"""
+    pytest.importorskip("torch")
+    from services.ml_service import MLService
+
+    model = SimpleNamespace(draft_model=None, generate_batch=None)
+    service = MLService(model, _FailingExecutor())
+    response = await service.predict("Привет")
+
+    assert response == {"success": False, "error": "Prediction failed: bad input"}
+
+
+class _InlineExecutor:
+    """Генерация прямо в event loop: порядок батчей детерминирован"""
+
+    max_workers = 1
+
+    async def submit(self, fn, *args):
+        return fn(*args)
+
+
+class _RecordingModel:
+    def __init__(self):
+        self.batches = []
+
+    def generate_batch(self, texts, params):
+        self.batches.append(list(texts))
+        return [text.upper() for text in texts]
+
+
+async def _run_batches(requests, max_batch_size=8):
+    """Все запросы в очереди до старта планировщика, затем ответы"""
+    pytest.importorskip("transformers")
+    from core.batcher import BatchScheduler
+
+    model = _RecordingModel()
+    scheduler = BatchScheduler(
+        model, _InlineExecutor(), max_batch_size=max_batch_size, max_wait_ms=20
+    )
+    tasks = [
+        asyncio.ensure_future(scheduler.submit(text, deadline, params))
+        for text, deadline, params in requests
+    ]
+    await asyncio.sleep(0)
+    await scheduler.start()
+    try:
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+    finally:
+        await scheduler.stop()
+    return model.batches, results
+
+
+@pytest.mark.asyncio
+async def test_batcher_groups_by_batch_key_in_fifo_order():
+    greedy = GenerationParams(temperature=0)
+    sampled = GenerationParams(temperature=0.7)
+    # max_new_tokens в ключ не входит
+    long_greedy = GenerationParams(temperature=0, max_new_tokens=512)
+    stopped = GenerationParams(temperature=0, stop=("\n",))
+
+    batches, results = await _run_batches(
+        [
+            ("a", None, greedy),
+            ("b", None, sampled),
+            ("c", None, stopped),
+            ("d", None, sampled),
+            ("e", None, long_greedy),
+            ("f", None, stopped),
+        ]
+    )
+
+    # Отложенные запросы открывают следующие батчи в порядке поступления
+    assert batches == [["a", "e"], ["b", "d"], ["c", "f"]]
+    assert results == ["A", "B", "C", "D", "E", "F"]
+
+
+@pytest.mark.asyncio
+async def test_batcher_respects_max_batch_size():
+    batches, _ = await _run_batches(
+        [(text, None, DEFAULT_GENERATION) for text in "abcde"], max_batch_size=2
+    )
+    assert batches == [["a", "b"], ["c", "d"], ["e"]]
+
+
+@pytest.mark.asyncio
+async def test_batcher_fails_expired_requests_without_generation():
+    pytest.importorskip("transformers")
+    from core.batcher import DeadlineExceededError
+
+    batches, results = await _run_batches(
+        [
+            ("late", time.time() - 1, DEFAULT_GENERATION),
+            ("on time", time.time() + 60, DEFAULT_GENERATION),
+        ]
+    )
+
+    assert isinstance(results[0], DeadlineExceededError)
+    assert results[1] == "ON TIME"
+    assert batches == [["on time"]]
+
+
+def _kv_entry(torch, floats: int):
+    """Запись на floats * 2 float32 (ключи и значения одного слоя)"""
+    from core.kv_cache import KVCacheEntry
+
+    return KVCacheEntry(
+        token_ids=torch.tensor([1, 2, 3]),
+        past_key_values=[(torch.zeros(floats), torch.zeros(floats))],
+        messages=[],
+    )
+
+
+def test_kv_cache_evicts_least_recently_used():
+    torch = pytest.importorskip("torch")
+    from core.kv_cache import SessionKVCache
+
+    cache = SessionKVCache(max_bytes=2 * 256, ttl_seconds=60)
+    cache.put("a", _kv_entry(torch, 32))
+    cache.put("b", _kv_entry(torch, 32))
+    # Ход сессии a: take и put после генерации делают ее самой свежей
+    cache.put("a", cache.take("a"))
+    cache.put("c", _kv_entry(torch, 32))
+
+    assert cache.take("b") is None
+    assert cache.take("a") is not None
+    assert cache.take("c") is not None
+    assert cache.stats()["evictions"] == 1
+
+
+def test_kv_cache_byte_budget():
+    torch = pytest.importorskip("torch")
+    from core.kv_cache import SessionKVCache
+
+    cache = SessionKVCache(max_bytes=1000, ttl_seconds=60)
+    cache.put("small", _kv_entry(torch, 32))
+    # Больше всего бюджета - не кэшируется и не вытесняет остальные
+    cache.put("huge", _kv_entry(torch, 1000))
+    assert cache.stats()["sessions"] == 1
+    assert cache.stats()["bytes"] == 256
+
+    # Вместе не помещаются - вытесняется старшая
+    cache.put("big", _kv_entry(torch, 100))
+    assert cache.take("small") is None
+    assert cache.take("big") is not None
+    assert cache.stats()["bytes"] == 0
+
+
+def test_kv_cache_ttl():
+    torch = pytest.importorskip("torch")
+    from core.kv_cache import SessionKVCache
+
+    cache = SessionKVCache(max_bytes=10_000, ttl_seconds=0.05)
+    cache.put("a", _kv_entry(torch, 32))
+    cache.put("b", _kv_entry(torch, 32))
+    time.sleep(0.1)
+
+    # Просроченная запись не возвращается, а ее байты освобождаются
+    assert cache.take("a") is None
+    assert cache.stats()["bytes"] == 256
+    assert cache.stats()["misses"] == 1
+
+    # Следующая запись вытесняет просроченные, даже если бюджет не исчерпан
+    cache.put("c", _kv_entry(torch, 32))
+    assert cache.stats()["sessions"] == 1
+    assert cache.stats()["bytes"] == 256
+    assert cache.stats()["evictions"] == 1
+
+
+def _reply_bodies(queue_service):
+    exchange = queue_service.channel.default_exchange
+    return [decode(m.body, m.content_type) for m in exchange.routed_to("replies")]
+
+
+@pytest.mark.asyncio
+async def test_failure_goes_to_retry_queue_with_backoff(queue_service):
+    message = FakeMessage(headers={RETRY_COUNT_HEADER: 1})
+    await queue_service._handle_failure(message, RuntimeError("oom"), retryable=True)
+
+    exchange = queue_service.channel.default_exchange
+    # Вторая попытка уже была: задержка 1000 * 2**1
+    [copy] = exchange.routed_to("ml_requests.retry.2000ms")
+    assert copy.headers[RETRY_COUNT_HEADER] == 2
+    assert copy.headers[LAST_ERROR_HEADER] == "RuntimeError: oom"
+    assert _reply_bodies(queue_service) == []
+    assert queue_service.retry_stats()["retried"] == 1
+
+
+@pytest.mark.parametrize(
+    "headers, retryable",
+    [
+        # Попытки кончились
+        ({RETRY_COUNT_HEADER: 3}, True),
+        # Повтор бессмысленен
+        ({}, False),
+        # Повтор с задержкой 1 с не успеет до дедлайна
+        ({DEADLINE_HEADER: time.time() + 0.5}, True),
+    ],
+)
+@pytest.mark.asyncio
+async def test_failure_dead_lettered_with_reply(queue_service, headers, retryable):
+    message = FakeMessage(headers=headers)
+    await queue_service._handle_failure(message, RuntimeError("oom"), retryable)
+
+    exchange = queue_service.channel.default_exchange
+    [copy] = exchange.routed_to("ml_requests.dead")
+    # Счетчик в DLQ - сколько повторов было, без прибавки
+    assert copy.headers[RETRY_COUNT_HEADER] == headers.get(RETRY_COUNT_HEADER, 0)
+    [reply] = _reply_bodies(queue_service)
+    assert reply["success"] is False
+    assert "RuntimeError: oom" in reply["error"]
+    assert queue_service.retry_stats()["dead_lettered"] == 1
+
+
+@pytest.mark.asyncio
+async def test_redeliveries_past_limit_dead_lettered(queue_service):
+    """max_redeliveries=2: третья повторная доставка уходит в DLQ"""
+    message = FakeMessage(
+        redelivered=True, headers={RETRY_COUNT_HEADER: 1, REDELIVERY_COUNT_HEADER: 2}
+    )
+    await queue_service._process(message, _never_called)
+
+    exchange = queue_service.channel.default_exchange
+    assert exchange.routed_to("ml_requests") == []
+    [copy] = exchange.routed_to("ml_requests.dead")
+    # Повторные доставки не тратят попытки x-retry-count
+    assert copy.headers[RETRY_COUNT_HEADER] == 1
+    assert "Redelivered 2 times" in copy.headers[LAST_ERROR_HEADER]
+    assert message.acked
+    [reply] = _reply_bodies(queue_service)
+    assert reply["success"] is False
+
+
+@pytest.mark.asyncio
+async def test_malformed_deadline_header_ignored(queue_service):
+    """Неверный x-deadline - как его отсутствие, а не повтор с задержкой"""
+    received = []
+
+    async def callback(data, emit):
+        received.append(data)
+        return {"success": True, "output_data": "ok"}
+
+    message = FakeMessage(
+        body=b'{"text": "hi"}',
+        headers={DEADLINE_HEADER: "завтра", ENQUEUED_AT_HEADER: "n/a"},
+    )
+    await queue_service._process(message, callback)
+
+    assert received == [{"text": "hi"}]
+    assert _reply_bodies(queue_service) == [{"success": True, "output_data": "ok"}]
+    assert queue_service.retry_stats()["retried"] == 0
+    assert message.acked